@@ -0,0 +1,852 @@
+#!/usr/bin/env python3
+"""
+Branch Flow - Search Benchmarks
+
+Measures bf-search.py without a real embedding server:
+- A stub server speaking the Ollama and llama.cpp embedding APIs, returning
+  deterministic hash-seeded vectors after a configurable latency
+- Synthetic repositories of any size (1k, 10k, 100k files, ...)
+- Scenarios: cold index, no-op re-index, single-file edit, search latency
+  and `similar` latency
+
+Results are written as JSON, so runs can be kept and compared over time.
+"""
+
+import os
+import re
+import json
+import hashlib
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
+import argparse
+import collections
+import functools
+import importlib.util
+import math
+import platform
+
+BENCH_VERSION = 1
+CORPUS_VERSION = 1  # bump when generated content changes, so cached corpora are rebuilt
+
+# =============================================================================
+# Stub Embedding Server
+# =============================================================================
+#
+# Vectors are feature-hashed bags of words: each token adds a few +-1 entries
+# at positions derived from its hash. The same text always gets the same
+# vector, in every process, and texts sharing words score as similar, so
+# search and similar return meaningful neighbours.
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+# bf-search.py's ENDPOINT_PROBE, embedded once per run to verify the server; counted apart
+ENDPOINT_PROBE = "branch-flow endpoint check"
+TOKEN_FEATURES = 8  # vector entries set per distinct token
+
+
+@functools.lru_cache(maxsize=65536)
+def token_features(token: str, dimensions: int) -> Tuple[Tuple[int, float], ...]:
+    """(position, sign) pairs a token contributes, seeded by its hash."""
+    digest = hashlib.blake2b(token.encode("utf-8"), digest_size=4 * TOKEN_FEATURES).digest()
+    features = []
+    for i in range(TOKEN_FEATURES):
+        value = int.from_bytes(digest[4 * i:4 * i + 4], "little")
+        features.append((value % dimensions, 1.0 if value & 0x80000000 else -1.0))
+    return tuple(features)
+
+
+def stub_embedding(text: str, dimensions: int) -> List[float]:
+    """Deterministic unit vector for a text."""
+    counts = collections.Counter(TOKEN_RE.findall(text.lower()))
+    if not counts:
+        counts = {hashlib.md5(text.encode("utf-8")).hexdigest(): 1}
+    
+    vector = [0.0] * dimensions
+    for token, n in counts.items():
+        weight = 1.0 + math.log(n)
+        for position, sign in token_features(token, dimensions):
+            vector[position] += sign * weight
+    
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [round(x / norm, 6) for x in vector]
+
+
+class StubEmbeddingServer:
+    """Ollama and llama.cpp embedding endpoints, served from a background thread.
+    
+    Each request sleeps `latency` seconds plus `per_text` seconds per input
+    text before answering. With `parallel` > 0, at most that many requests are
+    processed at once, like a GPU server; the rest queue.
+    """
+    
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, dimensions: int = 768,
+                 latency: float = 0.0, per_text: float = 0.0, parallel: int = 0):
+        self.host = host
+        self.port = port
+        self.dimensions = dimensions
+        self.latency = latency
+        self.per_text = per_text
+        self.slots = threading.BoundedSemaphore(parallel) if parallel > 0 else None
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "texts": 0, "probes": 0}
+        self.server = None
+        self.thread = None
+    
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+    
+    def stats(self) -> Dict[str, int]:
+        """Requests, texts and endpoint probes embedded so far."""
+        with self.lock:
+            return dict(self.counts)
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts after the configured delay."""
+        with self.lock:
+            if texts == [ENDPOINT_PROBE]:
+                self.counts["probes"] += 1
+            else:
+                self.counts["requests"] += 1
+                self.counts["texts"] += len(texts)
+        
+        delay = self.latency + self.per_text * len(texts)
+        if self.slots is not None:
+            with self.slots:
+                time.sleep(delay)
+        elif delay:
+            time.sleep(delay)
+        return [stub_embedding(text, self.dimensions) for text in texts]
+    
+    def start(self) -> "StubEmbeddingServer":
+        from http.server import ThreadingHTTPServer
+        
+        self.server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+    
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+    
+    def _handler(self):
+        from http.server import BaseHTTPRequestHandler
+        
+        stub = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, as bf-search.py pools its connections
+            protocol_version = "HTTP/1.1"
+            
+            def log_message(self, format, *args):
+                pass
+            
+            def send_json(self, payload, status: int = 200):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def do_GET(self):
+                if self.path == "/health":
+                    self.send_json({"status": "ok"})
+                elif self.path == "/api/version":
+                    self.send_json({"version": "0.0.0-stub"})
+                elif self.path == "/api/tags":
+                    self.send_json({"models": []})
+                else:
+                    self.send_json({"error": "not found"}, 404)
+            
+            def do_POST(self):
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    request = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError as e:
+                    self.send_json({"error": f"invalid request: {e}"}, 400)
+                    return
+                
+                if self.path == "/api/embed":
+                    # Ollama >= 0.3: one or many texts
+                    texts = request.get("input", "")
+                    texts = [texts] if isinstance(texts, str) else texts
+                    self.send_json({"model": request.get("model"), "embeddings": stub.embed(texts)})
+                elif self.path == "/api/embeddings":
+                    # Older Ollama: one text per request
+                    self.send_json({"embedding": stub.embed([request.get("prompt", "")])[0]})
+                elif self.path == "/embedding":
+                    # llama.cpp: array content gets one pooled vector per text
+                    content = request.get("content", "")
+                    if isinstance(content, str):
+                        self.send_json({"embedding": stub.embed([content])[0]})
+                    else:
+                        self.send_json([{"index": i, "embedding": [vector]}
+                                        for i, vector in enumerate(stub.embed(content))])
+                elif self.path == "/v1/embeddings":
+                    texts = request.get("input", "")
+                    texts = [texts] if isinstance(texts, str) else texts
+                    self.send_json({"data": [{"index": i, "embedding": vector}
+                                             for i, vector in enumerate(stub.embed(texts))]})
+                else:
+                    self.send_json({"error": "not found"}, 404)
+        
+        return Handler
+
+
+# =============================================================================
+# Synthetic Repositories
+# =============================================================================
+#
+# File i of a corpus is generated from seed and i alone, so a corpus can be
+# regenerated identically anywhere. Files in one directory share a topic
+# (a subset of the vocabulary), which gives search and similar clusters of
+# related files, and every 40th file is a near-copy of an earlier one.
+
+WORDS = (
+    "account", "address", "alert", "archive", "audit", "balance", "batch", "billing", "branch",
+    "buffer", "cache", "catalog", "channel", "checkout", "client", "cluster", "column", "commit",
+    "config", "connection", "consumer", "context", "cursor", "customer", "dashboard", "deploy",
+    "device", "digest", "document", "domain", "draft", "email", "encoder", "endpoint", "event",
+    "export", "feature", "filter", "folder", "gateway", "graph", "handler", "header", "history",
+    "image", "import", "index", "invoice", "job", "journal", "kernel", "label", "ledger", "limit",
+    "listener", "locale", "lock", "login", "mapping", "member", "message", "metric", "migration",
+    "module", "monitor", "node", "notice", "order", "owner", "packet", "page", "parser", "partner",
+    "payload", "payment", "permission", "pipeline", "plugin", "policy", "pool", "price", "profile",
+    "project", "queue", "quota", "record", "region", "registry", "release", "report", "request",
+    "resource", "response", "retry", "role", "route", "schedule", "schema", "search", "secret",
+    "segment", "session", "shard", "signal", "snapshot", "socket", "source", "stream", "subscriber",
+    "summary", "tag", "task", "template", "tenant", "thread", "ticket", "timer", "token", "topic",
+    "trace", "transaction", "upload", "user", "validator", "vendor", "version", "webhook", "worker",
+)
+VERBS = (
+    "add", "apply", "build", "check", "clear", "close", "collect", "compute", "create", "decode",
+    "delete", "encode", "fetch", "find", "flush", "format", "get", "handle", "load", "merge",
+    "open", "parse", "publish", "read", "refresh", "register", "remove", "render", "reset",
+    "resolve", "save", "schedule", "send", "set", "sort", "split", "start", "stop", "sync",
+    "update", "validate", "write",
+)
+FILLER = (
+    "the", "a", "when", "each", "is", "are", "not", "only", "before", "after", "with", "for",
+    "from", "into", "if", "then", "so", "any", "all", "its", "this", "every", "per", "once",
+)
+
+FILES_PER_DIR = 25
+DUPLICATE_EVERY = 40
+DUPLICATE_OFFSET = 17
+KINDS = ("py",) * 10 + ("ts",) * 3 + ("go",) * 2 + ("md",) * 3 + ("yaml",) * 2
+
+
+def file_kind(i: int) -> str:
+    return KINDS[source_index(i) * 7 % len(KINDS)]
+
+
+def source_index(i: int) -> int:
+    """The file whose content file i reuses: itself, or an earlier one for near-copies."""
+    if i >= DUPLICATE_OFFSET and i % DUPLICATE_EVERY == DUPLICATE_EVERY - 1:
+        return i - DUPLICATE_OFFSET
+    return i
+
+
+def corpus_path(i: int, memory_start: int) -> str:
+    """Relative path of file i; the last files of a corpus are memory and spec documents."""
+    if i >= memory_start:
+        k = i - memory_start
+        folder = "memory" if k % 2 == 0 else "specs"
+        return f".branch-flow/{folder}/{WORDS[k % len(WORDS)]}-{k}.md"
+    
+    directory = i // FILES_PER_DIR
+    top = "docs" if file_kind(i) == "md" else "src"
+    area = WORDS[directory % len(WORDS)]
+    name = f"{VERBS[i % len(VERBS)]}_{WORDS[(i * 31) % len(WORDS)]}_{i}"
+    return f"{top}/{area}_{directory // len(WORDS)}/{name}.{file_kind(i)}"
+
+
+def memory_count(files: int) -> int:
+    return files // 500
+
+
+class TextGenerator:
+    """Random identifiers and sentences drawn mostly from one topic."""
+    
+    def __init__(self, rng: random.Random, topic: List[str]):
+        self.rng = rng
+        self.topic = topic
+    
+    def word(self) -> str:
+        if self.rng.random() < 0.7:
+            return self.rng.choice(self.topic)
+        return self.rng.choice(WORDS)
+    
+    def identifier(self, parts: int = 2) -> str:
+        return "_".join([self.rng.choice(VERBS)] + [self.word() for _ in range(parts - 1)])
+    
+    def camel(self, parts: int = 2) -> str:
+        first, *rest = self.identifier(parts).split("_")
+        return first + "".join(part.capitalize() for part in rest)
+    
+    def sentence(self, words: int = 10) -> str:
+        tokens = [self.word() if self.rng.random() < 0.6 else self.rng.choice(FILLER) for _ in range(words)]
+        return " ".join(tokens).capitalize() + "."
+    
+    def units(self) -> int:
+        """Functions or sections in a file: mostly a few, sometimes dozens."""
+        return min(40, 1 + int(self.rng.expovariate(1 / 5)))
+
+
+def render_python(gen: TextGenerator) -> str:
+    rng = gen.rng
+    lines = [f'"""{gen.sentence(8)}"""', "", "import os", f"from .{gen.word()} import {gen.identifier()}", ""]
+    for _ in range(gen.units()):
+        args = ", ".join(gen.word() for _ in range(rng.randint(1, 3)))
+        lines += ["", f"def {gen.identifier(3)}({args}):", f'    """{gen.sentence()}"""']
+        for _ in range(rng.randint(2, 8)):
+            lines.append(f"    {gen.word()} = {gen.identifier()}({gen.word()}, {rng.randint(0, 100)})")
+        lines.append(f"    return {gen.word()}")
+    return "\n".join(lines) + "\n"
+
+
+def render_typescript(gen: TextGenerator) -> str:
+    rng = gen.rng
+    lines = [f"import {{ {gen.camel()} }} from './{gen.word()}';", ""]
+    for _ in range(gen.units()):
+        lines += [f"// {gen.sentence()}", f"export function {gen.camel(3)}({gen.word()}: string): number {{"]
+        for _ in range(rng.randint(2, 8)):
+            lines.append(f"  const {gen.camel()} = {gen.camel()}({gen.word()}, {rng.randint(0, 100)});")
+        lines += [f"  return {gen.word()}.length;", "}", ""]
+    return "\n".join(lines)
+
+
+def render_go(gen: TextGenerator) -> str:
+    rng = gen.rng
+    lines = [f"package {gen.word()}", "", 'import "fmt"', ""]
+    for _ in range(gen.units()):
+        name = gen.camel(3)
+        lines += [f"// {name[0].upper() + name[1:]} {gen.sentence().lower()}",
+                  f"func {name[0].upper() + name[1:]}({gen.word()} string) error {{"]
+        for _ in range(rng.randint(2, 8)):
+            lines.append(f"\t{gen.camel()} := {gen.camel()}({gen.word()}, {rng.randint(0, 100)})")
+        lines += [f'\treturn fmt.Errorf("{gen.sentence(5)}")', "}", ""]
+    return "\n".join(lines)
+
+
+def render_markdown(gen: TextGenerator) -> str:
+    rng = gen.rng
+    lines = [f"# {gen.sentence(4)[:-1]}", "", " ".join(gen.sentence() for _ in range(3)), ""]
+    for _ in range(gen.units()):
+        lines += [f"## {gen.sentence(3)[:-1]}", ""]
+        for _ in range(rng.randint(1, 3)):
+            lines += [" ".join(gen.sentence(rng.randint(6, 16)) for _ in range(rng.randint(2, 5))), ""]
+        if rng.random() < 0.3:
+            lines += ["```", f"{gen.identifier()}({gen.word()})", "```", ""]
+    return "\n".join(lines)
+
+
+def render_yaml(gen: TextGenerator) -> str:
+    rng = gen.rng
+    lines = [f"# {gen.sentence()}"]
+    for _ in range(gen.units()):
+        lines.append(f"{gen.word()}_{gen.word()}:")
+        for _ in range(rng.randint(2, 6)):
+            lines.append(f"  {gen.word()}: {gen.word()}-{rng.randint(0, 1000)}")
+    return "\n".join(lines) + "\n"
+
+
+COPY_MARKERS = {
+    "py": "\n# copied from file {source}\n",
+    "ts": "\n// copied from file {source}\n",
+    "go": "\n// copied from file {source}\n",
+    "md": "\n<!-- copied from file {source} -->\n",
+    "yaml": "\n# copied from file {source}\n",
+}
+
+RENDERERS = {
+    "py": render_python,
+    "ts": render_typescript,
+    "go": render_go,
+    "md": render_markdown,
+    "yaml": render_yaml,
+}
+
+
+def render_file(i: int, seed: int, memory_start: int) -> str:
+    """Content of file i of a corpus."""
+    source = source_index(i) if i < memory_start else i
+    directory = source // FILES_PER_DIR
+    topic = random.Random(f"{seed}:topic:{directory}").sample(WORDS, 12)
+    gen = TextGenerator(random.Random(f"{seed}:file:{source}"), topic)
+    content = RENDERERS["md" if i >= memory_start else file_kind(i)](gen)
+    if source != i:
+        # A near-copy: same content with one extra line
+        content += COPY_MARKERS[file_kind(i)].format(source=source)
+    return content
+
+
+def corpus_manifest_path(root: Path) -> Path:
+    return root.parent / f"{root.name}.json"
+
+
+def generate_corpus(root: Path, files: int, seed: int, verbose: bool = True) -> Dict:
+    """Write a synthetic repository of `files` files under root, reusing a matching one."""
+    manifest_path = corpus_manifest_path(root)
+    wanted = {"version": CORPUS_VERSION, "files": files, "seed": seed}
+    if manifest_path.exists() and root.exists():
+        manifest = json.loads(manifest_path.read_text())
+        if all(manifest.get(key) == value for key, value in wanted.items()):
+            return manifest
+    
+    if root.exists():
+        shutil.rmtree(root)
+    if verbose:
+        print(f"Generating {files} files in {root}...", file=sys.stderr)
+    
+    start = time.perf_counter()
+    memory_start = files - memory_count(files)
+    total_bytes = 0
+    made = set()
+    for i in range(files):
+        path = root / corpus_path(i, memory_start)
+        if path.parent not in made:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            made.add(path.parent)
+        data = render_file(i, seed, memory_start).encode("utf-8")
+        path.write_bytes(data)
+        total_bytes += len(data)
+    
+    manifest = dict(wanted, bytes=total_bytes, generate_seconds=round(time.perf_counter() - start, 3))
+    manifest_path.write_text(json.dumps(manifest, indent=2) + "\n")
+    return manifest
+
+
+def sample_queries(count: int, seed: int) -> List[str]:
+    """Search queries in the corpus vocabulary, with a few words each."""
+    rng = random.Random(f"{seed}:queries")
+    queries = []
+    for _ in range(count):
+        words = [rng.choice(VERBS)] + rng.sample(WORDS, rng.randint(1, 3))
+        queries.append(" ".join(words))
+    return queries
+
+
+def sample_code_files(files: int, count: int, seed: int) -> List[str]:
+    """Paths of code files spread over the corpus."""
+    memory_start = files - memory_count(files)
+    rng = random.Random(f"{seed}:similar")
+    picks = rng.sample(range(memory_start), min(count, memory_start))
+    return [corpus_path(i, memory_start) for i in picks]
+
+
+# =============================================================================
+# Running bf-search.py
+# =============================================================================
+
+class BenchmarkError(Exception):
+    """A bf-search.py command failed."""
+
+
+def latency_summary(samples: List[float]) -> Dict:
+    """Count, mean and nearest-rank percentiles, as in bf-search.py's metrics."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0}
+    
+    def percentile(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, max(0, -(-len(ordered) * p // 100) - 1))], 6)
+    
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 6),
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p99": percentile(99),
+        "max": round(ordered[-1], 6),
+    }
+
+
+def parse_metrics(stderr: str) -> Optional[Dict]:
+    """The JSON metrics object `--metrics json` prints last on stderr."""
+    lines = stderr.splitlines()
+    for i in range(len(lines) - 1, -1, -1):
+        if lines[i] == "{":
+            try:
+                return json.loads("\n".join(lines[i:]))
+            except ValueError:
+                return None
+    return None
+
+
+class Runner:
+    """Runs bf-search.py commands in a corpus and measures them."""
+    
+    def __init__(self, bf_search: Path, root: Path, stub: StubEmbeddingServer):
+        self.bf_search = bf_search
+        self.root = root
+        self.stub = stub
+        # BF_* variables would override the benchmark's config
+        self.env = {key: value for key, value in os.environ.items() if not key.startswith("BF_")}
+    
+    def run(self, *args: str) -> Dict:
+        """Run one command with --metrics json; its wall time, metrics and stub traffic."""
+        before = self.stub.stats()
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, str(self.bf_search), *args, "--metrics", "json"],
+            cwd=self.root, env=self.env, capture_output=True, text=True
+        )
+        wall = time.perf_counter() - start
+        if result.returncode != 0:
+            tail = "\n".join(result.stderr.strip().splitlines()[-10:])
+            raise BenchmarkError(f"bf-search.py {' '.join(args)} exited with {result.returncode}:\n{tail}")
+        
+        after = self.stub.stats()
+        return {
+            "wall_seconds": round(wall, 6),
+            "embed_requests": after["requests"] - before["requests"],
+            "embedded_texts": after["texts"] - before["texts"],
+            "metrics": parse_metrics(result.stderr) or {},
+            "stdout": result.stdout,
+        }
+    
+    def index(self) -> Dict:
+        run = self.run("index", "-q")
+        metrics = run["metrics"]
+        return {
+            "wall_seconds": run["wall_seconds"],
+            "embed_requests": run["embed_requests"],
+            "embedded_texts": run["embedded_texts"],
+            "stages": metrics.get("stages", {}),
+            "latency_seconds": metrics.get("latency_seconds", {}),
+            "caches": metrics.get("caches", {}),
+            "counters": metrics.get("counters", {}),
+        }
+    
+    def repeated(self, commands: List[List[str]]) -> Dict:
+        """Latency over many short commands, with their stage times summed."""
+        walls, in_process, empty = [], [], 0
+        stages: Dict[str, Dict[str, float]] = {}
+        requests = texts = 0
+        for args in commands:
+            run = self.run(*args, "--json")
+            walls.append(run["wall_seconds"])
+            requests += run["embed_requests"]
+            texts += run["embedded_texts"]
+            metrics = run["metrics"]
+            if "wall_seconds" in metrics:
+                in_process.append(metrics["wall_seconds"])
+            for stage, totals in metrics.get("stages", {}).items():
+                summed = stages.setdefault(stage, {"seconds": 0.0, "calls": 0, "bytes": 0, "items": 0})
+                for key in summed:
+                    summed[key] += totals.get(key, 0)
+            if not json.loads(run["stdout"] or "[]"):
+                empty += 1
+        
+        for summed in stages.values():
+            summed["seconds"] = round(summed["seconds"], 6)
+        return {
+            # Whole command, including interpreter start-up, as a shell or agent sees it
+            "latency_seconds": latency_summary(walls),
+            # From import to exit inside bf-search.py
+            "in_process_seconds": latency_summary(in_process),
+            "embed_requests": requests,
+            "embedded_texts": texts,
+            "empty_results": empty,
+            "stages": dict(sorted(stages.items())),
+        }
+
+
+# =============================================================================
+# Scenarios
+# =============================================================================
+
+SCENARIOS = ("cold_index", "noop_reindex", "edit_one_file", "search", "similar")
+
+
+def parse_scale(value: str) -> int:
+    """A file count such as 1000, 10k or 1m."""
+    match = re.fullmatch(r"(\d+)([km]?)", value.strip().lower())
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid scale {value!r} (examples: 1000, 10k, 1m)")
+    files = int(match.group(1)) * {"": 1, "k": 1000, "m": 1000000}[match.group(2)]
+    if files < 10:
+        raise argparse.ArgumentTypeError("a corpus needs at least 10 files")
+    return files
+
+
+def write_bench_config(root: Path, stub: StubEmbeddingServer, provider: str, overrides: Dict):
+    """Point the corpus at the stub server, with any config overrides on top."""
+    config = {
+        "embedding": {
+            "provider": provider,
+            "model": "bench-embed",
+            "dimensions": stub.dimensions,
+            # Endpoints are probed over HTTP instead of checking for a local Ollama install
+            "endpoints": [stub.url],
+        },
+        "index": {},
+    }
+    for section, values in overrides.items():
+        config.setdefault(section, {}).update(values)
+    path = root / ".branch-flow" / "config.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(config, indent=2) + "\n")
+
+
+def edit_target(files: int) -> str:
+    """A mid-corpus Python file for the single-file edit."""
+    memory_start = files - memory_count(files)
+    i = files // 2
+    while file_kind(i) != "py" or source_index(i) != i:
+        i += 1
+    return corpus_path(i, memory_start)
+
+
+def run_scale(files: int, args, stub: StubEmbeddingServer, overrides: Dict) -> Dict:
+    """Generate (or reuse) a corpus and run the selected scenarios on it."""
+    root = Path(args.workdir) / f"corpus-{files}-{args.seed}"
+    corpus = generate_corpus(root, files, args.seed, verbose=not args.quiet)
+    write_bench_config(root, stub, args.provider, overrides)
+    runner = Runner(Path(args.bf_search), root, stub)
+    result = {"files": files, "corpus": corpus, "scenarios": {}}
+    scenarios = result["scenarios"]
+    
+    def progress(message: str):
+        if not args.quiet:
+            print(f"[{files} files] {message}", file=sys.stderr)
+    
+    # Every run starts from an empty index, including the embedding cache
+    shutil.rmtree(root / ".branch-flow" / "index", ignore_errors=True)
+    target = root / edit_target(files)
+    original = target.read_bytes()
+    try:
+        progress("cold index")
+        scenarios["cold_index"] = runner.index()
+        if "noop_reindex" in args.scenarios:
+            progress("no-op re-index")
+            scenarios["noop_reindex"] = runner.index()
+        if "edit_one_file" in args.scenarios:
+            progress(f"edit {target.relative_to(root)}")
+            edit = TextGenerator(random.Random(f"{args.seed}:edit"), list(WORDS))
+            with open(target, "a", encoding="utf-8") as f:
+                f.write(f"\n\ndef {edit.identifier(3)}({edit.word()}):\n    \"\"\"{edit.sentence()}\"\"\"\n"
+                        f"    return {edit.identifier()}({edit.word()})\n")
+            scenarios["edit_one_file"] = dict(runner.index(), file=str(target.relative_to(root)))
+        if "search" in args.scenarios and args.queries:
+            progress(f"{args.queries} searches")
+            mode = ["--mode", args.mode] if args.mode else []
+            queries = sample_queries(args.queries, args.seed)
+            scenarios["search"] = dict(runner.repeated([["search", query, "-n", "10", *mode] for query in queries]),
+                                       mode=args.mode or "config")
+        if "similar" in args.scenarios and args.similar:
+            progress(f"{args.similar} similar lookups")
+            scenarios["similar"] = runner.repeated(
+                [["similar", path, "-n", "10"] for path in sample_code_files(files, args.similar, args.seed)]
+            )
+    except BenchmarkError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        result["error"] = str(e)
+    finally:
+        target.write_bytes(original)
+    
+    if "cold_index" not in args.scenarios:
+        scenarios.pop("cold_index", None)
+    return result
+
+
+def bf_search_version(path: Path) -> Dict:
+    """Where bf-search.py came from: its git commit, if any, and content hash."""
+    info = {"path": str(path), "sha256": hashlib.sha256(path.read_bytes()).hexdigest()[:16]}
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=path.parent,
+                                capture_output=True, text=True, timeout=10)
+        if commit.returncode == 0:
+            info["commit"] = commit.stdout.strip()
+    except (subprocess.TimeoutExpired, FileNotFoundError):
+        pass
+    return info
+
+
+def run_benchmarks(args) -> Dict:
+    overrides = {}
+    if args.config:
+        with open(args.config) as f:
+            overrides = json.load(f)
+    
+    stub = StubEmbeddingServer(dimensions=args.dimensions, latency=args.latency,
+                               per_text=args.per_text, parallel=args.parallel).start()
+    report = {
+        "version": BENCH_VERSION,
+        "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "bf_search": bf_search_version(Path(args.bf_search)),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            # bf-search.py runs on this interpreter
+            "numpy": importlib.util.find_spec("numpy") is not None,
+        },
+        "stub": {
+            "provider": args.provider,
+            "dimensions": args.dimensions,
+            "latency": args.latency,
+            "per_text": args.per_text,
+            "parallel": args.parallel,
+        },
+        "config": overrides,
+        "seed": args.seed,
+        "scales": [],
+    }
+    try:
+        for files in args.scales:
+            report["scales"].append(run_scale(files, args, stub, overrides))
+    finally:
+        stub.stop()
+    return report
+
+
+# =============================================================================
+# Comparing Results
+# =============================================================================
+
+def headline_numbers(report: Dict) -> Dict[Tuple[int, str], float]:
+    """The number to compare per scale and scenario: wall time, or p50/p99 latency."""
+    numbers = {}
+    for scale in report.get("scales", []):
+        for scenario, result in scale.get("scenarios", {}).items():
+            if "wall_seconds" in result:
+                numbers[(scale["files"], scenario)] = result["wall_seconds"]
+            for p in ("p50", "p99"):
+                if p in result.get("latency_seconds", {}) and scenario in ("search", "similar"):
+                    numbers[(scale["files"], f"{scenario} {p}")] = result["latency_seconds"][p]
+    return numbers
+
+
+def compare_reports(base: Dict, new: Dict, threshold: float) -> bool:
+    """Print the change of each headline number; False if any slowed down past threshold."""
+    before, after = headline_numbers(base), headline_numbers(new)
+    ok = True
+    print(f"{'files':>8}  {'scenario':<18} {'base':>10} {'new':>10} {'change':>8}")
+    for key in sorted(before.keys() & after.keys()):
+        old, current = before[key], after[key]
+        change = (current - old) / old if old else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  ⚠️  slower"
+            ok = False
+        print(f"{key[0]:>8}  {key[1]:<18} {old:>9.3f}s {current:>9.3f}s {change * 100:>+7.1f}%{flag}")
+    for key in sorted(before.keys() ^ after.keys()):
+        print(f"{key[0]:>8}  {key[1]:<18} only in {'base' if key in before else 'new'}")
+    return ok
+
+
+# =============================================================================
+# CLI
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Branch Flow search benchmarks")
+    subparsers = parser.add_subparsers(dest="command", help="Commands")
+    
+    def add_stub_arguments(p):
+        p.add_argument("--dimensions", type=int, default=768, help="Embedding dimensions (default: 768)")
+        p.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+        p.add_argument("--per-text", type=float, default=0.0, help="Seconds added per text in a request")
+        p.add_argument("--parallel", type=int, default=0,
+                       help="Requests processed at once, the rest queue (0 = unlimited)")
+    
+    # Run command
+    run_parser = subparsers.add_parser("run", help="Run the benchmark scenarios")
+    run_parser.add_argument("--scales", type=parse_scale, nargs="+", default=[1000, 10000],
+                            metavar="N", help="Corpus sizes, e.g. 1k 10k 100k (default: 1k 10k)")
+    run_parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS),
+                            metavar="SCENARIO",
+                            help=f"Scenarios to run: {', '.join(SCENARIOS)} (default: all). "
+                                 f"The index is always built cold first")
+    run_parser.add_argument("--queries", type=int, default=50, help="Searches to time (default: 50)")
+    run_parser.add_argument("--similar", type=int, default=20, help="Similar lookups to time (default: 20)")
+    run_parser.add_argument("--mode", choices=("semantic", "lexical", "hybrid"), help="Search ranking")
+    run_parser.add_argument("--provider", choices=("ollama", "llamacpp"), default="ollama",
+                            help="API the stub is spoken to with (default: ollama)")
+    run_parser.add_argument("--config", metavar="FILE",
+                            help="JSON merged into the corpus config, e.g. {\"embedding\": {\"batch_size\": 32}}")
+    run_parser.add_argument("--seed", type=int, default=0, help="Corpus and query seed")
+    run_parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "bf-bench"),
+                            help="Where corpora are generated and kept between runs")
+    run_parser.add_argument("--bf-search", default=str(Path(__file__).with_name("bf-search.py")),
+                            help="bf-search.py to benchmark (default: the one next to this script)")
+    run_parser.add_argument("-o", "--output", help="Write the JSON results to a file instead of stdout")
+    run_parser.add_argument("-q", "--quiet", action="store_true", help="No progress output")
+    add_stub_arguments(run_parser)
+    
+    # Stub command
+    stub_parser = subparsers.add_parser("stub", help="Serve stub embeddings for manual runs")
+    stub_parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    stub_parser.add_argument("--port", type=int, default=11434, help="Port (default: 11434, Ollama's)")
+    add_stub_arguments(stub_parser)
+    
+    # Generate command
+    generate_parser = subparsers.add_parser("generate", help="Write a synthetic repository")
+    generate_parser.add_argument("path", help="Directory to create")
+    generate_parser.add_argument("--files", type=parse_scale, default=1000, help="Number of files (default: 1k)")
+    generate_parser.add_argument("--seed", type=int, default=0, help="Content seed")
+    
+    # Compare command
+    compare_parser = subparsers.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("base", help="Earlier results")
+    compare_parser.add_argument("new", help="Later results")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="Slowdown that fails the comparison (default: 0.1 = 10%%)")
+    
+    args = parser.parse_args()
+    
+    if args.command == "run":
+        os.makedirs(args.workdir, exist_ok=True)
+        report = run_benchmarks(args)
+        output = json.dumps(report, indent=2) + "\n"
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(output)
+        else:
+            sys.stdout.write(output)
+        if any("error" in scale for scale in report["scales"]):
+            sys.exit(1)
+    
+    elif args.command == "stub":
+        stub = StubEmbeddingServer(args.host, args.port, args.dimensions, args.latency,
+                                   args.per_text, args.parallel).start()
+        print(f"Stub embedding server on {stub.url} ({args.dimensions} dimensions), Ctrl-C to stop",
+              file=sys.stderr)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            stub.stop()
+    
+    elif args.command == "generate":
+        manifest = generate_corpus(Path(args.path), args.files, args.seed)
+        print(f"✅ {manifest['files']} files, {manifest['bytes']} bytes in {args.path}")
+    
+    elif args.command == "compare":
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        if not compare_reports(base, new, args.threshold):
+            sys.exit(1)
+    
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -16,9 +16,21 @@ import hashlib
 import sqlite3
 import subprocess
 import sys
+import threading
+import time
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Set, Tuple
 import argparse
+import collections
+import contextlib
+import functools
+import unicodedata
+
+try:
+    import numpy as np
+except ImportError:
+    # NumPy is optional; search falls back to pure Python scoring
+    np = None
 
 # =============================================================================
 # Configuration
@@ -31,9 +43,15 @@ DEFAULT_CONFIG = {
         "dimensions": 768,
         "ollama_url": "http://localhost:11434",
         "llamacpp_url": "http://localhost:8080",
+        "endpoints": [],  # [{"url": ..., "weight": 1}, ...] to spread requests over several servers
         "batch_size": 10,
+        "concurrency": 4,  # embedding requests in flight at once (per endpoint)
+        "retries": 6,  # retries of a failed indexing request, with exponential backoff
+        "cache_max_entries": 100000,  # chunk embedding cache size, 0 disables
+        "query_cache_max_entries": 1000,  # query embedding cache size, 0 disables
         "chunk_size": 1000,
-        "chunk_overlap": 200
+        "chunk_overlap": 200,  # only where no structural boundary is in reach
+        "chunker": "auto"  # auto (by file type), python, markdown, indent or lines
     },
     "index": {
         "include_extensions": [
@@ -56,7 +74,23 @@ DEFAULT_CONFIG = {
         "max_file_size_kb": 500,
         "index_memory": True,
         "index_specs": True,
-        "index_codebase": True
+        "index_codebase": True,
+        "use_git": False,  # discover and diff files through git in a work tree
+        "respect_gitignore": False,  # skip paths ignored by .gitignore files
+        "walk_workers": 4,  # threads scanning directories
+        "read_workers": 0,  # processes reading, hashing and chunking files, 0 = up to 4 by CPU count
+        "vector_file": False,  # mmap-able copy of the embeddings for search
+        "vector_file_dtype": "float32",  # float32 or float16
+        "embedding_precision": "float32",  # stored vectors: float32, float16 or int8
+        "rescore_candidates": 0,  # re-rank this many at full precision (float16/int8), 0 = off; keeps float32 copies
+        "scan_batch": 4096,  # vectors read at a time by the exact scan
+        "ann": False,  # approximate nearest-neighbour (IVF) index
+        "ann_lists": 0,  # IVF lists, 0 = sqrt(number of chunks)
+        "ann_nprobe": 8,  # lists scanned per query
+        "binary_codes": False,  # 1-bit sign codes for a Hamming-distance prefilter
+        "binary_shortlist": 200,  # candidates kept by the prefilter for exact scoring
+        "search_mode": "semantic",  # semantic, lexical or hybrid
+        "lexical_prefilter": 0  # score only the top N full-text matches, 0 = off
     }
 }
 
@@ -118,6 +152,9 @@ LLAMACPP_PRESETS = {
     }
 }
 
+# Kinds of indexed documents; search results and vector partitions are per type
+DOC_TYPES = ("code", "memory", "spec", "plan")
+
 
 def get_config() -> dict:
     """Load configuration from file and environment variables."""
@@ -140,6 +177,7 @@ def get_config() -> dict:
         "BF_EMBEDDING_DIMENSIONS": ("embedding", "dimensions", int),
         "BF_OLLAMA_URL": ("embedding", "ollama_url"),
         "BF_CHUNK_SIZE": ("embedding", "chunk_size", int),
+        "BF_EMBEDDING_CONCURRENCY": ("embedding", "concurrency", int),
     }
     
     for env_var, mapping in env_mappings.items():
@@ -159,79 +197,577 @@ def get_config() -> dict:
     return config
 
 
+# =============================================================================
+# Metrics
+# =============================================================================
+#
+# Wall time, calls, bytes and items per stage of an index or search run, the
+# latency of each embedding request, and cache hits. A stage's time excludes
+# stages nested in it (decode inside file_vectors, say), so stage times add
+# up; stages that run in several threads or processes (read, hash, chunk,
+# embed) add up each one's time and can exceed the run's wall time.
+
+class Metrics:
+    """Thread-safe stage timers and counters for one CLI run."""
+    
+    LATENCY_SAMPLES = 10000  # most recent samples kept per latency, for long-running watch/serve
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.stages: Dict[str, List[float]] = {}  # stage -> [seconds, calls, bytes, items]
+        self.latencies: Dict[str, collections.deque] = {}
+        self.counters: Dict[str, int] = {}
+    
+    def add(self, stage: str, seconds: float, calls: int = 1, size: int = 0, items: int = 0):
+        """Count time spent in a stage."""
+        with self.lock:
+            totals = self.stages.setdefault(stage, [0.0, 0, 0, 0])
+            totals[0] += seconds
+            totals[1] += calls
+            totals[2] += size
+            totals[3] += items
+    
+    def observe(self, name: str, seconds: float):
+        """Record one latency sample."""
+        with self.lock:
+            if name not in self.latencies:
+                self.latencies[name] = collections.deque(maxlen=self.LATENCY_SAMPLES)
+            self.latencies[name].append(seconds)
+    
+    def count(self, name: str, n: int = 1):
+        """Increment a counter."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+    
+    def snapshot(self, command: str, config: dict) -> Dict:
+        """Everything measured so far, with the settings that most affect it."""
+        with self.lock:
+            stages = {
+                stage: {"seconds": round(seconds, 6), "calls": calls, "bytes": size, "items": items}
+                for stage, (seconds, calls, size, items) in sorted(self.stages.items())
+            }
+            latencies = {name: latency_summary(samples) for name, samples in sorted(self.latencies.items())}
+            counters = dict(sorted(self.counters.items()))
+        
+        caches = {}
+        for cache in ("embedding_cache", "query_cache"):
+            hits, misses = counters.get(f"{cache}_hits", 0), counters.get(f"{cache}_misses", 0)
+            if hits or misses:
+                caches[cache] = {"hits": hits, "misses": misses, "hit_rate": round(hits / (hits + misses), 4)}
+        
+        embedding = config["embedding"]
+        return {
+            "command": command,
+            "wall_seconds": round(time.perf_counter() - self.started, 6),
+            "stages": stages,
+            "latency_seconds": latencies,
+            "caches": caches,
+            "counters": counters,
+            "settings": {
+                "provider": embedding["provider"],
+                "model": embedding["model"],
+                "dimensions": embedding["dimensions"],
+                "chunk_size": embedding["chunk_size"],
+                "chunk_overlap": embedding["chunk_overlap"],
+                "batch_size": embedding["batch_size"],
+                "concurrency": embedding_concurrency(config),
+                "endpoints": len(embedding.get("endpoints") or []) or 1,
+                "embedding_precision": config["index"].get("embedding_precision", "float32"),
+                "numpy": np is not None,
+            },
+        }
+
+
+METRICS = Metrics()
+
+
+_metrics_local = threading.local()
+
+
+@contextlib.contextmanager
+def metrics_stage(stage: str, size: int = 0, items: int = 0):
+    """Add the time spent in a block, minus nested stages, to a metrics stage.
+    
+    Yields a dict whose "size" and "items" can be set once they are known.
+    """
+    frames = _metrics_local.__dict__.setdefault("frames", [])
+    frame = {"size": size, "items": items, "nested": 0.0}
+    frames.append(frame)
+    start = time.perf_counter()
+    try:
+        yield frame
+    finally:
+        elapsed = time.perf_counter() - start
+        frames.pop()
+        if frames:
+            frames[-1]["nested"] += elapsed
+        METRICS.add(stage, elapsed - frame["nested"], size=frame["size"], items=frame["items"])
+
+
+def timed(stage: str):
+    """Decorator adding a function's calls to a metrics stage."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with metrics_stage(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def latency_summary(samples) -> Dict:
+    """Count, mean and nearest-rank percentiles of latency samples."""
+    ordered = sorted(samples)
+    
+    def percentile(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, max(0, -(-len(ordered) * p // 100) - 1))], 6)
+    
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 6),
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p99": percentile(99),
+        "max": round(ordered[-1], 6),
+    }
+
+
+def prometheus_text(snapshot: Dict) -> str:
+    """Render a metrics snapshot in the Prometheus text exposition format."""
+    command = snapshot["command"]
+    lines = []
+    
+    def metric(name: str, kind: str, help_text: str, samples: List[Tuple[str, float]]):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{{command=\"{command}\"{labels}}} {value}")
+    
+    stages = snapshot["stages"]
+    for field, name, help_text in (
+        ("seconds", "bf_stage_seconds", "Time spent in each stage of the last run"),
+        ("calls", "bf_stage_calls", "Calls of each stage in the last run"),
+        ("bytes", "bf_stage_bytes", "Bytes processed by each stage in the last run"),
+        ("items", "bf_stage_items", "Files, chunks or rows processed by each stage in the last run"),
+    ):
+        metric(name, "gauge", help_text, [(f',stage="{stage}"', totals[field]) for stage, totals in stages.items()])
+    
+    for latency, summary in snapshot["latency_seconds"].items():
+        samples = [(f',quantile="{q}"', summary[key]) for q, key in (("0.5", "p50"), ("0.9", "p90"), ("0.99", "p99"))]
+        metric(f"bf_{latency}_latency_seconds", "summary", f"Latency of {latency} requests in the last run", samples)
+        lines.append(f'bf_{latency}_latency_seconds_sum{{command="{command}"}} '
+                     f'{round(summary["mean"] * summary["count"], 6)}')
+        lines.append(f'bf_{latency}_latency_seconds_count{{command="{command}"}} {summary["count"]}')
+    
+    metric("bf_cache_hit_ratio", "gauge", "Cache hit rate in the last run",
+           [(f',cache="{cache}"', totals["hit_rate"]) for cache, totals in snapshot["caches"].items()])
+    metric("bf_run_seconds", "gauge", "Wall time of the last run", [("", snapshot["wall_seconds"])])
+    metric("bf_run_timestamp_seconds", "gauge", "When the last run finished", [("", int(time.time()))])
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(command: str, config: dict, fmt: Optional[str] = None, textfile: Optional[str] = None,
+                  profiler=None, profile_path: Optional[str] = None):
+    """Report metrics and profile of the run; registered to run at exit."""
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+        print(f"Profile written to {profile_path} (python -m pstats {profile_path})", file=sys.stderr)
+    
+    snapshot = METRICS.snapshot(command, config)
+    if fmt == "json":
+        print(json.dumps(snapshot, indent=2), file=sys.stderr)
+    if textfile:
+        # Written whole and renamed, as node_exporter's textfile collector expects
+        tmp_path = f"{textfile}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(prometheus_text(snapshot))
+        os.replace(tmp_path, textfile)
+
+
 # =============================================================================
 # Embedding Providers
 # =============================================================================
 
-def get_ollama_embedding(text: str, config: dict) -> List[float]:
-    """Get embedding from Ollama."""
-    import urllib.request
+_http_local = threading.local()
+
+
+def post_json(url: str, payload, timeout: float = 30):
+    """POST a JSON payload over a pooled keep-alive connection.
+    
+    Each thread keeps one persistent connection per host, so repeated
+    embedding requests skip the TCP (and TLS) handshake. Errors are raised as
+    urllib.error.HTTPError / URLError, like urllib.request.urlopen.
+    """
+    import http.client
     import urllib.error
+    import urllib.parse
+    
+    parts = urllib.parse.urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    body = json.dumps(payload).encode('utf-8')
+    headers = {'Content-Type': 'application/json', 'Connection': 'keep-alive'}
     
-    url = f"{config['embedding']['ollama_url']}/api/embeddings"
-    data = json.dumps({
-        "model": config["embedding"]["model"],
-        "prompt": text
-    }).encode('utf-8')
+    if not hasattr(_http_local, "connections"):
+        _http_local.connections = {}
+    connections = _http_local.connections
     
-    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    # A pooled connection may have been closed by the server while idle, so
+    # retry once on a fresh connection before giving up
+    for attempt in range(2):
+        conn = connections.get(key)
+        reused = conn is not None
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+            conn = conn_class(parts.netloc, timeout=timeout)
+            connections[key] = conn
+        conn.timeout = timeout
+        
+        try:
+            conn.request("POST", path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            del connections[key]
+            if reused and attempt == 0:
+                continue
+            raise urllib.error.URLError(e)
+        
+        if response.will_close:
+            conn.close()
+            del connections[key]
+        
+        if response.status >= 400:
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+        
+        return json.loads(data.decode('utf-8'))
+
+
+def request_ollama_embeddings(url: str, texts: List[str], config: dict) -> List[List[float]]:
+    """Embed a batch on the Ollama server at `url`; connection errors are raised."""
+    import urllib.error
     
     try:
-        with urllib.request.urlopen(req, timeout=30) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            return result["embedding"]
-    except urllib.error.URLError as e:
-        print(f"Error connecting to Ollama: {e}", file=sys.stderr)
-        print(f"Make sure Ollama is running: ollama serve", file=sys.stderr)
-        sys.exit(1)
+        result = post_json(f"{url}/api/embed", {
+            "model": config["embedding"]["model"],
+            "input": texts
+        }, timeout=120)
+        return result["embeddings"]
+    except urllib.error.HTTPError as e:
+        if e.code != 404:
+            raise
+    
+    # Ollama < 0.3 has no /api/embed, fall back to one request per text
+    return [
+        post_json(f"{url}/api/embeddings", {"model": config["embedding"]["model"], "prompt": text},
+                  timeout=30)["embedding"]
+        for text in texts
+    ]
 
 
-def get_llamacpp_embedding(text: str, config: dict) -> List[float]:
-    """Get embedding from llama.cpp server."""
-    import urllib.request
+def request_llamacpp_embeddings(url: str, texts: List[str], config: dict) -> List[List[float]]:
+    """Embed a batch on the llama.cpp server at `url`; connection errors are raised."""
+    result = post_json(f"{url}/embedding", {"content": texts}, timeout=120)
+    
+    # llama.cpp returns [{"index": i, "embedding": [...]}, ...] for array content,
+    # or the OpenAI style {"data": [{"index": i, "embedding": [...]}, ...]}
+    if isinstance(result, dict) and "data" in result:
+        items = result["data"]
+    elif isinstance(result, list):
+        items = result
+    elif isinstance(result, dict) and "embedding" in result and len(texts) == 1:
+        items = [result]
+    else:
+        raise ValueError(f"Unexpected response format: {type(result).__name__}")
+    
+    if len(items) != len(texts):
+        raise ValueError(f"Expected {len(texts)} embeddings, got {len(items)}")
+    
+    embeddings = [None] * len(texts)
+    for position, item in enumerate(items):
+        embedding = item["embedding"]
+        # Newer servers wrap the pooled vector in an extra list
+        if embedding and isinstance(embedding[0], list):
+            embedding = embedding[0]
+        embeddings[item.get("index", position)] = embedding
+    return embeddings
+
+
+EMBEDDING_REQUESTS = {"ollama": request_ollama_embeddings, "llamacpp": request_llamacpp_embeddings}
+
+
+# =============================================================================
+# Embedding Endpoints
+# =============================================================================
+#
+# With `embedding.endpoints` set, requests are spread over several servers of
+# the configured provider. Each request goes to the healthy endpoint with the
+# fewest requests in flight per unit of weight. An endpoint that fails to
+# connect (or answers 5xx) is skipped for a backoff period and the request is
+# retried on the next one; a request only fails once every endpoint has been
+# tried. Before first use, each endpoint embeds a probe text, which must have
+# the configured dimensions and match the first verified endpoint's vector,
+# so all endpoints are known to serve the same model.
+
+ENDPOINT_PROBE = "branch-flow endpoint check"
+ENDPOINT_MATCH = 0.99  # min cosine similarity between endpoints' probe vectors
+ENDPOINT_BACKOFF_MAX = 60.0  # seconds a failing endpoint is skipped, at most
+
+_endpoint_pools: Dict[Tuple, "EndpointPool"] = {}
+_endpoint_pools_lock = threading.Lock()
+
+
+def parse_endpoints(config: dict) -> List[Tuple[str, float]]:
+    """(url, weight) for each configured endpoint; entries are URLs or {"url", "weight"} objects."""
+    endpoints = []
+    for entry in config["embedding"].get("endpoints") or []:
+        if isinstance(entry, str):
+            entry = {"url": entry}
+        weight = float(entry.get("weight", 1))
+        if not entry.get("url") or weight <= 0:
+            raise ValueError(f"Invalid embedding endpoint: {entry!r}")
+        endpoints.append((entry["url"].rstrip("/"), weight))
+    return endpoints
+
+
+def embedding_concurrency(config: dict) -> int:
+    """Embedding requests to keep in flight: `concurrency` per endpoint."""
+    concurrency = max(1, int(config["embedding"].get("concurrency", 4)))
+    return concurrency * max(1, len(config["embedding"].get("endpoints") or []))
+
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """Whether an error means the endpoint is down, rather than the request being bad."""
     import urllib.error
     
-    url = f"{config['embedding'].get('llamacpp_url', 'http://localhost:8080')}/embedding"
-    data = json.dumps({
-        "content": text
-    }).encode('utf-8')
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code >= 500
+    return isinstance(error, (urllib.error.URLError, OSError))
+
+
+class EndpointPool:
+    """Least-loaded dispatch with failover over weighted embedding endpoints."""
+    
+    def __init__(self, config: dict):
+        self.config = config
+        self.request = EMBEDDING_REQUESTS[config["embedding"]["provider"]]
+        self.dims = int(config["embedding"]["dimensions"])
+        self.endpoints = [
+            {"url": url, "weight": weight, "in_flight": 0, "failures": 0, "retry_at": 0.0,
+             "verified": False, "excluded": None, "requests": 0, "texts": 0}
+            for url, weight in parse_endpoints(config)
+        ]
+        self.reference: Optional[List[float]] = None
+        self.lock = threading.Lock()
     
-    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    def _acquire(self, tried: Set[str]) -> Optional[Dict]:
+        """Reserve the least-loaded untried endpoint, preferring ones not backing off."""
+        now = time.monotonic()
+        
+        def load(endpoint: Dict):
+            # Healthy endpoints by load per weight, then those backing off, soonest retry first
+            backing_off = endpoint["retry_at"] > now
+            return (backing_off, endpoint["retry_at"] if backing_off else 0.0,
+                    (endpoint["in_flight"] + 1) / endpoint["weight"])
+        
+        with self.lock:
+            candidates = [e for e in self.endpoints if e["url"] not in tried and not e["excluded"]]
+            if not candidates:
+                return None
+            endpoint = min(candidates, key=load)
+            endpoint["in_flight"] += 1
+            return endpoint
     
-    try:
-        with urllib.request.urlopen(req, timeout=30) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            # llama.cpp returns {"embedding": [...]} or {"data": [{"embedding": [...]}]}
-            if "embedding" in result:
-                return result["embedding"]
-            elif "data" in result and len(result["data"]) > 0:
-                return result["data"][0]["embedding"]
+    def _verify(self, endpoint: Dict):
+        """Check the endpoint's probe vector against the dimensions and the other endpoints.
+        
+        Connection failures are raised; an endpoint that answers but cannot
+        embed (such as a missing model) is excluded.
+        """
+        try:
+            probe = normalize_embedding(self.request(endpoint["url"], [ENDPOINT_PROBE], self.config)[0])
+        except Exception as e:
+            if is_endpoint_failure(e):
+                raise
+            probe = None
+            reason = f"cannot embed ({e})"
+        
+        with self.lock:
+            if probe is None:
+                endpoint["excluded"] = reason
+            elif len(probe) != self.dims:
+                endpoint["excluded"] = f"returns {len(probe)}-dimensional embeddings, expected {self.dims}"
+            elif self.reference is None:
+                self.reference = probe
+            elif sum(a * b for a, b in zip(probe, self.reference)) < ENDPOINT_MATCH:
+                endpoint["excluded"] = "serves a different model than the other endpoints"
+            endpoint["verified"] = True
+        if endpoint["excluded"]:
+            print(f"⚠️  Embedding endpoint {endpoint['url']} {endpoint['excluded']}; not using it", file=sys.stderr)
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed a batch on the least-loaded endpoint, failing over to the others."""
+        import urllib.error
+        
+        tried: Set[str] = set()
+        last_error = None
+        while True:
+            endpoint = self._acquire(tried)
+            if endpoint is None:
+                if last_error is None:
+                    raise urllib.error.URLError("no usable embedding endpoint")
+                raise urllib.error.URLError(f"no embedding endpoint reachable, last error: "
+                                            f"{getattr(last_error, 'reason', last_error)}")
+            tried.add(endpoint["url"])
+            try:
+                if not endpoint["verified"]:
+                    self._verify(endpoint)
+                    if endpoint["excluded"]:
+                        continue
+                embeddings = self.request(endpoint["url"], texts, self.config)
+            except Exception as e:
+                if not is_endpoint_failure(e):
+                    raise
+                last_error = e
+                with self.lock:
+                    endpoint["failures"] += 1
+                    backoff = min(ENDPOINT_BACKOFF_MAX, 2.0 ** (endpoint["failures"] - 1))
+                    endpoint["retry_at"] = time.monotonic() + backoff
+                continue
+            finally:
+                with self.lock:
+                    endpoint["in_flight"] -= 1
+            
+            with self.lock:
+                endpoint["failures"] = 0
+                endpoint["retry_at"] = 0.0
+                endpoint["requests"] += 1
+                endpoint["texts"] += len(texts)
+            return embeddings
+    
+    def check(self) -> bool:
+        """Verify every endpoint now; True if at least one is usable."""
+        for endpoint in self.endpoints:
+            if endpoint["verified"]:
+                continue
+            try:
+                self._verify(endpoint)
+            except Exception as e:
+                print(f"⚠️  Embedding endpoint {endpoint['url']} not available: {e}", file=sys.stderr)
+        return any(e["verified"] and not e["excluded"] for e in self.endpoints)
+    
+    def summary(self) -> List[Dict]:
+        """Per-endpoint request and text counts."""
+        with self.lock:
+            return [{"url": e["url"], "weight": e["weight"], "requests": e["requests"], "texts": e["texts"],
+                     "excluded": e["excluded"]} for e in self.endpoints]
+
+
+def endpoint_pool(config: dict) -> EndpointPool:
+    """The shared pool for the configured endpoints, so load and health are tracked across callers."""
+    emb = config["embedding"]
+    key = (emb["provider"], emb["model"], int(emb["dimensions"]), tuple(parse_endpoints(config)))
+    with _endpoint_pools_lock:
+        if key not in _endpoint_pools:
+            _endpoint_pools[key] = EndpointPool(config)
+        return _endpoint_pools[key]
+
+
+def embed_texts(texts: List[str], config: dict) -> List[List[float]]:
+    """Embed a batch of texts using configured provider; connection errors are raised."""
+    if not texts:
+        return []
+    
+    provider = config["embedding"]["provider"]
+    if provider not in EMBEDDING_REQUESTS:
+        raise ValueError(f"Unknown provider: {provider}. Use 'ollama' or 'llamacpp'.")
+    
+    start = time.perf_counter()
+    with metrics_stage("embed", sum(len(text.encode("utf-8")) for text in texts), len(texts)):
+        if config["embedding"].get("endpoints"):
+            embeddings = endpoint_pool(config).embed(texts)
+        else:
+            if provider == "ollama":
+                url = config["embedding"]["ollama_url"]
             else:
-                raise ValueError(f"Unexpected response format: {result.keys()}")
+                url = config["embedding"].get("llamacpp_url", "http://localhost:8080")
+            embeddings = EMBEDDING_REQUESTS[provider](url, texts, config)
+    METRICS.observe("embed", time.perf_counter() - start)
+    return embeddings
+
+
+def get_embeddings(texts: List[str], config: dict) -> List[List[float]]:
+    """Get embeddings for a batch of texts using configured provider, exiting if it can't be reached."""
+    import urllib.error
+    
+    try:
+        return embed_texts(texts, config)
+    except urllib.error.HTTPError:
+        raise
     except urllib.error.URLError as e:
-        print(f"Error connecting to llama.cpp server: {e}", file=sys.stderr)
-        print(f"Make sure llama-server is running with --embedding flag:", file=sys.stderr)
-        print(f"  llama-server -m <model.gguf> --embedding --port 8080", file=sys.stderr)
+        if config["embedding"].get("endpoints"):
+            print(f"Error connecting to the embedding endpoints: {e.reason}", file=sys.stderr)
+        elif config["embedding"]["provider"] == "ollama":
+            print(f"Error connecting to Ollama: {e}", file=sys.stderr)
+            print(f"Make sure Ollama is running: ollama serve", file=sys.stderr)
+        else:
+            print(f"Error connecting to llama.cpp server: {e}", file=sys.stderr)
+            print(f"Make sure llama-server is running with --embedding flag:", file=sys.stderr)
+            print(f"  llama-server -m <model.gguf> --embedding --port 8080", file=sys.stderr)
         sys.exit(1)
 
 
+RETRY_BACKOFF_MAX = 60.0  # seconds between retries of a failed indexing request, at most
+
+_retry_notice = {"quiet_until": 0.0}
+_retry_notice_lock = threading.Lock()
+
+
+def embed_with_retry(texts: List[str], config: dict) -> List[List[float]]:
+    """Embed a batch for indexing, riding out server restarts and network blips.
+    
+    Connection errors, timeouts and 5xx responses are retried up to
+    `retries` times after 1, 2, 4... seconds; the last error is raised.
+    """
+    retries = max(0, int(config["embedding"].get("retries", 6)))
+    for attempt in range(retries + 1):
+        try:
+            return embed_texts(texts, config)
+        except Exception as e:
+            if attempt == retries or not is_endpoint_failure(e):
+                raise
+            METRICS.count("embed_retries")
+            delay = min(RETRY_BACKOFF_MAX, 2.0 ** attempt)
+            # One line per retry round, however many requests are waiting
+            with _retry_notice_lock:
+                if time.monotonic() >= _retry_notice["quiet_until"]:
+                    _retry_notice["quiet_until"] = time.monotonic() + delay
+                    sys.stderr.write(f"⚠️  Embedding request failed ({getattr(e, 'reason', e)}), "
+                                     f"retry {attempt + 1}/{retries} in {delay:.0f}s\n")
+            time.sleep(delay)
+
+
 def get_embedding(text: str, config: dict) -> List[float]:
     """Get embedding using configured provider."""
-    provider = config["embedding"]["provider"]
-    
-    if provider == "ollama":
-        return get_ollama_embedding(text, config)
-    elif provider == "llamacpp":
-        return get_llamacpp_embedding(text, config)
-    else:
-        raise ValueError(f"Unknown provider: {provider}. Use 'ollama' or 'llamacpp'.")
+    return get_embeddings([text], config)[0]
 
 
 def ensure_model_available(config: dict) -> bool:
     """Check if the embedding model is available, pull if needed."""
     provider = config["embedding"]["provider"]
     
-    if provider == "llamacpp":
+    if config["embedding"].get("endpoints") and provider in EMBEDDING_REQUESTS:
+        # Remote servers: probe each one instead of checking a local install
+        if endpoint_pool(config).check():
+            return True
+        print("⚠️  None of the configured embedding endpoints is usable", file=sys.stderr)
+        return False
+    elif provider == "llamacpp":
         # For llama.cpp, check if server is running
         return ensure_llamacpp_server(config)
     elif provider == "ollama":
@@ -306,49 +842,198 @@ def ensure_ollama_model(config: dict) -> bool:
 # Text Chunking
 # =============================================================================
 
-def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[Dict]:
-    """Split text into overlapping chunks with metadata."""
-    chunks = []
-    lines = text.split('\n')
-    current_chunk = []
-    current_size = 0
-    start_line = 0
+# Chunks end at structural boundaries where possible: statement starts from
+# the Python ast, Markdown headings and paragraphs, or indentation for other
+# languages. A boundary chooser gives each line the depth of the boundary
+# starting there (lower is coarser, None for none). Each chunk is filled to
+# at least CHUNK_MIN_FILL of chunk_size and then ends at the coarsest
+# boundary that still fits, so chunks stay nearly full without splitting
+# functions or sections needlessly. Only text without any boundary in reach
+# is cut between lines, with chunk_overlap.
+CHUNKING_VERSION = 1  # bump when chunk boundaries change, to re-chunk indexes
+CHUNK_MIN_FILL = 0.8
+CHUNKER_EXTENSIONS = {".py": "python", ".md": "markdown", ".markdown": "markdown", ".txt": "lines"}
+CONTINUATION_LINE = r"^([}\)\]]|(end|fi|done|esac|else|elsif|elif|rescue|ensure|when|catch|finally|except)\b)"
+COMMENT_LINE = r"^(#|//|/\*|\*|--|;|@)"
+
+
+def attach_comments(lines: List[str], boundary: int, floor: int) -> int:
+    """Move a boundary up over the comment lines directly above it at its indentation (not to `floor`)."""
+    import re
+    
+    indent = len(lines[boundary]) - len(lines[boundary].lstrip())
+    while boundary - 1 > floor:
+        above = lines[boundary - 1]
+        if not re.match(COMMENT_LINE, above.lstrip()) or len(above) - len(above.lstrip()) != indent:
+            break
+        boundary -= 1
+    return boundary
+
+
+def python_boundaries(lines: List[str]) -> Optional[List[Optional[int]]]:
+    """Statement starts by nesting depth, with decorators and leading comments; None if it doesn't parse."""
+    import ast
     
+    try:
+        tree = ast.parse("\n".join(lines))
+    except (SyntaxError, ValueError):
+        return None
+    
+    depths: List[Optional[int]] = [None] * len(lines)
+    stack = [(tree.body, 0, -1)]
+    while stack:
+        nodes, depth, floor = stack.pop()
+        for node in nodes:
+            first = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])]) - 1
+            start = attach_comments(lines, first, floor)
+            if depths[start] is None or depth < depths[start]:
+                depths[start] = depth
+            floor = start
+            nested = [
+                child for field in ("body", "orelse", "finalbody", "handlers", "cases")
+                for child in getattr(node, field, None) or [] if hasattr(child, "lineno")
+            ]
+            if nested:
+                stack.append((nested, depth + 1, start))
+    return depths
+
+
+def markdown_boundaries(lines: List[str]) -> List[Optional[int]]:
+    """Headings by level, then paragraph starts (code fences are never split inside)."""
+    import re
+    
+    depths: List[Optional[int]] = [None] * len(lines)
+    fence = None
     for i, line in enumerate(lines):
-        line_size = len(line) + 1  # +1 for newline
-        
-        if current_size + line_size > chunk_size and current_chunk:
-            chunk_text = '\n'.join(current_chunk)
-            chunks.append({
-                "text": chunk_text,
-                "start_line": start_line,
-                "end_line": i - 1
-            })
-            
-            # Calculate overlap
-            overlap_lines = []
-            overlap_size = 0
-            for j in range(len(current_chunk) - 1, -1, -1):
-                if overlap_size + len(current_chunk[j]) > overlap:
-                    break
-                overlap_lines.insert(0, current_chunk[j])
-                overlap_size += len(current_chunk[j]) + 1
-            
-            current_chunk = overlap_lines
-            current_size = overlap_size
-            start_line = i - len(overlap_lines)
+        stripped = line.lstrip()
+        after_blank = i > 0 and not lines[i - 1].strip()
+        if stripped.startswith(("```", "~~~")):
+            if fence is None and after_blank:
+                depths[i] = 7
+            marker = stripped[:3]
+            fence = None if fence == marker else (fence or marker)
+        elif fence is None and stripped:
+            match = re.match(r"(#{1,6})\s", stripped)
+            if match and len(line) - len(stripped) < 4:
+                depths[i] = len(match.group(1))
+            elif after_blank:
+                depths[i] = 7
+    return depths
+
+
+def indent_boundaries(lines: List[str]) -> List[Optional[int]]:
+    """Lines starting a statement, by indentation, for brace and indentation languages alike.
+    
+    Closing and continuation lines (}, end, else, ...) never start a
+    chunk; comments and annotations directly above a statement go with it.
+    """
+    import re
+    
+    depths: List[Optional[int]] = [None] * len(lines)
+    for i, line in enumerate(lines):
+        stripped = line.lstrip()
+        if not stripped or re.match(CONTINUATION_LINE, stripped) or re.match(COMMENT_LINE, stripped):
+            continue
+        start = attach_comments(lines, i, -1)
+        depths[start] = len(line) - len(stripped)
+    return depths
+
+
+CHUNKERS = {
+    "python": python_boundaries,
+    "markdown": markdown_boundaries,
+    "indent": indent_boundaries,
+    "lines": None,  # fixed-size chunks with overlap, cut anywhere between lines
+}
+
+
+def pack_lines(lines: List[str], depths: List[Optional[int]], chunk_size: int,
+               overlap: int) -> List[Tuple[int, int]]:
+    """Cut lines into [start, end) ranges of up to chunk_size characters at the best boundaries.
+    
+    Linear in the number of lines: every line is looked at a constant
+    number of times.
+    """
+    import bisect
+    
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line) + 1)  # +1 for newline
+    min_fill = int(chunk_size * CHUNK_MIN_FILL)
+    
+    ranges = []
+    start = 0
+    while start < len(lines):
+        # Furthest end that fits (a single longer line is a chunk of its own)
+        end = max(start + 1, bisect.bisect_right(offsets, offsets[start] + chunk_size, start) - 1)
+        if end >= len(lines):
+            ranges.append((start, len(lines)))
+            break
+        
+        best = None
+        best_key = None
+        for i in range(end, start, -1):
+            if depths[i] is None:
+                continue
+            # Past the minimum fill, prefer coarse boundaries, then ones
+            # after a blank line; otherwise simply the furthest, unless that
+            # would leave the chunk less than half full
+            fill = offsets[i] - offsets[start]
+            if fill >= min_fill:
+                key = (1, -depths[i], not lines[i - 1].strip(), i)
+            elif fill >= chunk_size // 2:
+                key = (0, 0, False, i)
+            else:
+                break
+            if best_key is None or key > best_key:
+                best, best_key = i, key
+        if best is not None:
+            ranges.append((start, best))
+            start = best
+            continue
         
-        current_chunk.append(line)
-        current_size += line_size
+        # No usable boundary: cut here and carry the last lines that fit in
+        # `overlap` into the next chunk, always moving forward
+        ranges.append((start, end))
+        next_start = end
+        carried = 0
+        while next_start - 1 > start and carried + len(lines[next_start - 1]) <= overlap:
+            next_start -= 1
+            carried += len(lines[next_start]) + 1
+        start = next_start
+    return ranges
+
+
+def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200, chunker: Optional[str] = None) -> List[Dict]:
+    """Split text into chunks with metadata, using a chunker from CHUNKERS (lines by default)."""
+    lines = text.split('\n')
     
-    if current_chunk:
-        chunks.append({
-            "text": '\n'.join(current_chunk),
-            "start_line": start_line,
-            "end_line": len(lines) - 1
-        })
+    boundaries = CHUNKERS.get(chunker)
+    depths = boundaries(lines) if boundaries else None
+    if depths is None and chunker == "python":
+        depths = indent_boundaries(lines)  # not valid Python (e.g. templates)
     
-    return chunks
+    chunks = [
+        {"text": '\n'.join(lines[start:end]), "start_line": start, "end_line": end - 1}
+        for start, end in pack_lines(lines, depths or [None] * len(lines), chunk_size, overlap)
+    ]
+    # Keep whitespace-only chunks out of the index, but at least one chunk
+    return [chunk for chunk in chunks if chunk["text"].strip()] or chunks[:1]
+
+
+def file_chunker(path: Path, config: dict) -> str:
+    """The chunker for a file: the configured one, or with "auto" by extension."""
+    chunker = config["embedding"].get("chunker", "auto")
+    if chunker == "auto":
+        return CHUNKER_EXTENSIONS.get(path.suffix.lower(), "indent")
+    return chunker
+
+
+def chunking_signature(config: dict) -> str:
+    """Settings that determine chunk boundaries; a change means every file must be re-chunked."""
+    embedding = config["embedding"]
+    return json.dumps([CHUNKING_VERSION, embedding.get("chunker", "auto"),
+                       embedding["chunk_size"], embedding["chunk_overlap"]])
 
 
 # =============================================================================
@@ -360,6 +1045,9 @@ def init_database(db_path: Path, dimensions: int):
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
+    # WAL lets searches read while an index run is writing
+    cursor.execute("PRAGMA journal_mode=WAL")
+    
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS documents (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -391,10 +1079,229 @@ def init_database(db_path: Path, dimensions: int):
         CREATE INDEX IF NOT EXISTS idx_doc_type ON documents(doc_type)
     """)
     
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ivf_centroids (
+            list_id INTEGER PRIMARY KEY,
+            centroid BLOB NOT NULL
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ivf_assignments (
+            doc_id INTEGER PRIMARY KEY,
+            list_id INTEGER NOT NULL
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_ivf_list ON ivf_assignments(list_id)
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sign_codes (
+            doc_id INTEGER PRIMARY KEY,
+            code BLOB NOT NULL
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS file_vectors (
+            file_path TEXT PRIMARY KEY,
+            chunks INTEGER NOT NULL,
+            embedding BLOB NOT NULL
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rescore_vectors (
+            doc_id INTEGER PRIMARY KEY,
+            embedding BLOB NOT NULL
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            key TEXT PRIMARY KEY,
+            embedding BLOB NOT NULL,
+            last_used INTEGER NOT NULL
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_cache_last_used ON embedding_cache(last_used)
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS query_cache (
+            key TEXT PRIMARY KEY,
+            embedding BLOB NOT NULL,
+            last_used REAL NOT NULL
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS file_manifest (
+            file_path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            file_hash TEXT NOT NULL
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS index_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+    
+    # Files to (re-)index in the current or last index run, for --resume
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS index_jobs (
+            file_path TEXT PRIMARY KEY,
+            doc_type TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT
+        )
+    """)
+    
+    conn.commit()
+    
+    # Full-text index over chunk text, kept in sync with documents by triggers
+    try:
+        fts_exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'documents_fts'"
+        ).fetchone()
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts
+            USING fts5(content, content='documents', content_rowid='id')
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS documents_fts_insert AFTER INSERT ON documents BEGIN
+                INSERT INTO documents_fts (rowid, content) VALUES (new.id, new.content);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS documents_fts_delete AFTER DELETE ON documents BEGIN
+                INSERT INTO documents_fts (documents_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS documents_fts_update AFTER UPDATE OF content ON documents BEGIN
+                INSERT INTO documents_fts (documents_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                INSERT INTO documents_fts (rowid, content) VALUES (new.id, new.content);
+            END
+        """)
+        if not fts_exists:
+            # Index chunks stored before the full-text table existed
+            cursor.execute("INSERT INTO documents_fts (documents_fts) VALUES ('rebuild')")
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5: lexical search is unavailable
+        conn.rollback()
+    
     conn.commit()
+    
+    if get_index_meta(conn, "normalized") != "1":
+        normalize_stored_embeddings(conn)
+    
     return conn
 
 
+def get_index_meta(conn: sqlite3.Connection, key: str, default: Optional[str] = None) -> Optional[str]:
+    """Read a value from the index_meta table."""
+    try:
+        row = conn.execute("SELECT value FROM index_meta WHERE key = ?", (key,)).fetchone()
+    except sqlite3.OperationalError:
+        # Index created before index_meta existed
+        return default
+    return row[0] if row else default
+
+
+def set_index_meta(conn: sqlite3.Connection, key: str, value: str):
+    """Write a value to the index_meta table (caller commits)."""
+    conn.execute(
+        "INSERT OR REPLACE INTO index_meta (key, value) VALUES (?, ?)",
+        (key, str(value))
+    )
+
+
+def configure_bulk_writes(conn: sqlite3.Connection):
+    """Tune a connection for long indexing runs.
+    
+    With WAL, synchronous=NORMAL only syncs at checkpoints: a power loss can
+    drop the last transactions but never corrupts the index.
+    """
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-65536")  # 64 MB
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+
+def delete_file_rows(conn: sqlite3.Connection, file_paths: List[str]):
+    """Remove every row belonging to the given files (caller commits)."""
+    for path in file_paths:
+        conn.execute(
+            "DELETE FROM embeddings WHERE doc_id IN (SELECT id FROM documents WHERE file_path = ?)",
+            (path,)
+        )
+        conn.execute(
+            "DELETE FROM ivf_assignments WHERE doc_id IN (SELECT id FROM documents WHERE file_path = ?)",
+            (path,)
+        )
+        conn.execute(
+            "DELETE FROM sign_codes WHERE doc_id IN (SELECT id FROM documents WHERE file_path = ?)",
+            (path,)
+        )
+        conn.execute(
+            "DELETE FROM rescore_vectors WHERE doc_id IN (SELECT id FROM documents WHERE file_path = ?)",
+            (path,)
+        )
+    conn.executemany("DELETE FROM documents WHERE file_path = ?", [(path,) for path in file_paths])
+    conn.executemany("DELETE FROM file_manifest WHERE file_path = ?", [(path,) for path in file_paths])
+    conn.executemany("DELETE FROM file_vectors WHERE file_path = ?", [(path,) for path in file_paths])
+
+
+def prune_stale_files(conn: sqlite3.Connection, keep: Set[str]) -> int:
+    """Delete rows of files that were removed, renamed or are no longer indexed."""
+    indexed = {row[0] for row in conn.execute("SELECT DISTINCT file_path FROM documents")}
+    indexed.update(row[0] for row in conn.execute("SELECT file_path FROM file_manifest"))
+    stale = sorted(indexed - keep)
+    if stale:
+        delete_file_rows(conn, stale)
+        bump_index_generation(conn)
+        conn.commit()
+    return len(stale)
+
+
+def reset_index(conn: sqlite3.Connection, index_dir: Path):
+    """Empty the index for a full rebuild.
+    
+    The chunk embedding cache is kept: it is keyed by model, so unchanged
+    chunks are not re-embedded.
+    """
+    for table in ("embeddings", "ivf_assignments", "ivf_centroids", "sign_codes", "rescore_vectors", "documents",
+                  "file_manifest", "file_vectors", "index_jobs"):
+        conn.execute(f"DELETE FROM {table}")
+    conn.execute("DELETE FROM index_meta WHERE key IN ('git_head', 'git_dirty', 'ann_trained_count')")
+    bump_index_generation(conn)
+    conn.commit()
+    
+    remove_vector_files(index_dir)
+
+
+def normalize_stored_embeddings(conn: sqlite3.Connection):
+    """Migrate embeddings written before vectors were L2-normalized at index time."""
+    rows = conn.execute("SELECT doc_id, embedding FROM embeddings").fetchall()
+    conn.executemany(
+        "UPDATE embeddings SET embedding = ? WHERE doc_id = ?",
+        [(serialize_embedding(normalize_embedding(deserialize_embedding(blob))), doc_id)
+         for doc_id, blob in rows]
+    )
+    set_index_meta(conn, "normalized", "1")
+    conn.commit()
+
+
 def file_hash(path: Path) -> str:
     """Calculate file hash for change detection."""
     return hashlib.md5(path.read_bytes()).hexdigest()
@@ -410,23 +1317,948 @@ def cosine_similarity(a: List[float], b: List[float]) -> float:
     return dot_product / (norm_a * norm_b)
 
 
-def serialize_embedding(embedding: List[float]) -> bytes:
+def normalize_embedding(embedding: List[float]) -> List[float]:
+    """Scale a vector to unit length so cosine similarity is a dot product."""
+    norm = sum(x * x for x in embedding) ** 0.5
+    if norm == 0:
+        return list(embedding)
+    return [x / norm for x in embedding]
+
+
+# Stored embedding formats: bytes per dimension and per-vector header bytes.
+# int8 vectors carry their own float32 scale (max |x| / 127) in the header.
+EMBEDDING_PRECISIONS = {"float32": (4, 0), "float16": (2, 0), "int8": (1, 4)}
+
+
+def embedding_blob_size(dims: int, precision: str = "float32") -> int:
+    """Size in bytes of one stored embedding."""
+    per_dim, header = EMBEDDING_PRECISIONS[precision]
+    return dims * per_dim + header
+
+
+def get_embedding_precision(conn: sqlite3.Connection) -> str:
+    """Precision of the vectors in the embeddings table."""
+    return get_index_meta(conn, "embedding_precision", "float32")
+
+
+def serialize_embedding(embedding: List[float], precision: str = "float32") -> bytes:
     """Serialize embedding to bytes for storage."""
     import struct
+    if precision == "float16":
+        return struct.pack(f'{len(embedding)}e', *embedding)
+    if precision == "int8":
+        scale = max((abs(x) for x in embedding), default=0.0) / 127 or 1.0
+        return struct.pack(f'f{len(embedding)}b', scale, *(round(x / scale) for x in embedding))
     return struct.pack(f'{len(embedding)}f', *embedding)
 
 
-def deserialize_embedding(data: bytes) -> List[float]:
+def deserialize_embedding(data: bytes, precision: str = "float32") -> List[float]:
     """Deserialize embedding from bytes."""
     import struct
+    if precision == "float16":
+        return list(struct.unpack(f'{len(data) // 2}e', data))
+    if precision == "int8":
+        scale, *values = struct.unpack(f'f{len(data) - 4}b', data)
+        return [x * scale for x in values]
     count = len(data) // 4
     return list(struct.unpack(f'{count}f', data))
 
 
+@timed("decode")
+def decode_embedding_matrix(blobs: List[bytes], dims: int, precision: str = "float32"):
+    """Stack stored embeddings into a float32 NumPy matrix."""
+    data = b"".join(blobs)
+    if precision == "float16":
+        return np.frombuffer(data, dtype=np.float16).reshape(len(blobs), dims).astype(np.float32)
+    if precision == "int8":
+        rows = np.frombuffer(data, dtype=np.uint8).reshape(len(blobs), dims + 4)
+        scales = rows[:, :4].copy().view(np.float32)
+        return rows[:, 4:].view(np.int8).astype(np.float32) * scales
+    return np.frombuffer(data, dtype=np.float32).reshape(len(blobs), dims)
+
+
+# =============================================================================
+# Memory-mapped Vector File
+# =============================================================================
+
+# Optional flat copy of the embeddings table that search can mmap instead of
+# reading every BLOB out of SQLite, partitioned by doc_type so a typed search
+# only maps its own partition:
+#   vectors-<type>.bin  128-byte header + `count` rows of `dimensions` float32/float16
+#   vectors-<type>.ids  `count` little-endian int64 doc ids (-1 marks a deleted row)
+VECTOR_FILE_MAGIC = b"BFVECS01"
+VECTOR_HEADER_FORMAT = "<8sIIQQ64s"
+VECTOR_HEADER_SIZE = 128
+VECTOR_DTYPES = {"float32": ("f", 4), "float16": ("e", 2)}
+VECTOR_COMPACT_RATIO = 0.25  # rewrite once this fraction of rows is deleted
+
+
+def bump_index_generation(conn: sqlite3.Connection):
+    """Record that documents/embeddings changed (caller commits)."""
+    generation = int(get_index_meta(conn, "generation", "0"))
+    set_index_meta(conn, "generation", str(generation + 1))
+
+
+def vector_file_paths(index_dir: Path, doc_type: str) -> Tuple[Path, Path]:
+    """Return the (vectors, ids) paths of a doc_type's vector file partition."""
+    return index_dir / f"vectors-{doc_type}.bin", index_dir / f"vectors-{doc_type}.ids"
+
+
+def remove_vector_files(index_dir: Path):
+    """Delete every vector file partition, and the unpartitioned file of older versions."""
+    paths = [index_dir / "vectors.bin", index_dir / "vectors.ids"]
+    for doc_type in DOC_TYPES:
+        paths.extend(vector_file_paths(index_dir, doc_type))
+    for path in paths:
+        if path.exists():
+            path.unlink()
+
+
+def read_vector_header(index_dir: Path, doc_type: str) -> Optional[Dict]:
+    """Read and validate a vector file header, or None if unusable."""
+    import struct
+    
+    vectors_path, ids_path = vector_file_paths(index_dir, doc_type)
+    try:
+        with open(vectors_path, "rb") as f:
+            raw = f.read(VECTOR_HEADER_SIZE)
+        ids_size = ids_path.stat().st_size
+        vectors_size = vectors_path.stat().st_size
+    except OSError:
+        return None
+    
+    if len(raw) < VECTOR_HEADER_SIZE:
+        return None
+    magic, dims, itemsize, count, generation, model = struct.unpack_from(VECTOR_HEADER_FORMAT, raw)
+    if magic != VECTOR_FILE_MAGIC:
+        return None
+    
+    dtype = next((name for name, (_, size) in VECTOR_DTYPES.items() if size == itemsize), None)
+    header = {
+        "dimensions": dims,
+        "dtype": dtype,
+        "count": count,
+        "generation": str(generation),
+        "model": model.rstrip(b"\0").decode("utf-8", errors="ignore")
+    }
+    
+    # Both files must agree with the header, or a sync was interrupted
+    if (dtype is None or ids_size != count * 8
+            or vectors_size != VECTOR_HEADER_SIZE + count * dims * itemsize):
+        return None
+    return header
+
+
+def write_vector_header(f, dims: int, dtype: str, count: int, generation: str, model: str):
+    """Write the vector file header at the start of an open file."""
+    import struct
+    
+    f.seek(0)
+    f.write(struct.pack(
+        VECTOR_HEADER_FORMAT, VECTOR_FILE_MAGIC, dims, VECTOR_DTYPES[dtype][1],
+        count, int(generation), model.encode("utf-8")[:64]
+    ).ljust(VECTOR_HEADER_SIZE, b"\0"))
+
+
+def encode_vector_rows(blobs: List[bytes], dtype: str, precision: str = "float32") -> bytes:
+    """Convert stored embedding blobs to the vector file dtype."""
+    if dtype == precision:
+        return b"".join(blobs)
+    import struct
+    
+    fmt = VECTOR_DTYPES[dtype][0]
+    out = []
+    for blob in blobs:
+        values = deserialize_embedding(blob, precision)
+        out.append(struct.pack(f"<{len(values)}{fmt}", *values))
+    return b"".join(out)
+
+
+def iter_embedding_rows(conn: sqlite3.Connection, doc_ids: List[int], batch: int = 500):
+    """Yield (doc_id, embedding) for doc_ids in batches."""
+    for start in range(0, len(doc_ids), batch):
+        chunk = doc_ids[start:start + batch]
+        placeholders = ",".join("?" * len(chunk))
+        with metrics_stage("load") as frame:
+            rows = dict(conn.execute(
+                f"SELECT doc_id, embedding FROM embeddings WHERE doc_id IN ({placeholders})", chunk
+            ).fetchall())
+            frame.update(size=sum(map(len, rows.values())), items=len(rows))
+        for doc_id in chunk:
+            if doc_id in rows:
+                yield doc_id, rows[doc_id]
+
+
+def partition_embeddings_sql(columns: str) -> str:
+    """SELECT `columns` of one doc_type's current embeddings (params: blob size, doc_type)."""
+    return f"""
+        SELECT {columns} FROM embeddings e JOIN documents d ON d.id = e.doc_id
+        WHERE length(e.embedding) = ? AND d.doc_type = ?
+    """
+
+
+def rewrite_vector_file(conn: sqlite3.Connection, index_dir: Path, config: dict, generation: str,
+                        doc_type: str):
+    """Write a vector file partition from scratch, dropping deleted rows."""
+    from array import array
+    
+    dims = config["embedding"]["dimensions"]
+    dtype = config["index"].get("vector_file_dtype", "float32")
+    precision = get_embedding_precision(conn)
+    vectors_path, ids_path = vector_file_paths(index_dir, doc_type)
+    tmp_vectors = vectors_path.with_suffix(".bin.tmp")
+    tmp_ids = ids_path.with_suffix(".ids.tmp")
+    
+    cursor = conn.execute(
+        partition_embeddings_sql("e.doc_id, e.embedding") + " ORDER BY e.doc_id",
+        (embedding_blob_size(dims, precision), doc_type)
+    )
+    ids = array("q")
+    with open(tmp_vectors, "wb") as f:
+        write_vector_header(f, dims, dtype, 0, generation, config["embedding"]["model"])
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            ids.extend(doc_id for doc_id, _ in rows)
+            f.write(encode_vector_rows([blob for _, blob in rows], dtype, precision))
+        write_vector_header(f, dims, dtype, len(ids), generation, config["embedding"]["model"])
+    
+    if sys.byteorder != "little":
+        ids.byteswap()
+    with open(tmp_ids, "wb") as f:
+        ids.tofile(f)
+    
+    os.replace(tmp_ids, ids_path)
+    os.replace(tmp_vectors, vectors_path)
+
+
+def sync_vector_file(conn: sqlite3.Connection, index_dir: Path, config: dict):
+    """Bring every vector file partition up to date with the embeddings table."""
+    for path in (index_dir / "vectors.bin", index_dir / "vectors.ids"):
+        if path.exists():
+            path.unlink()  # unpartitioned file of older versions
+    for doc_type in DOC_TYPES:
+        sync_vector_partition(conn, index_dir, config, doc_type)
+
+
+def sync_vector_partition(conn: sqlite3.Connection, index_dir: Path, config: dict, doc_type: str):
+    """Bring one doc_type's vector file up to date.
+    
+    New embeddings are appended and removed ones are marked with a -1 doc id;
+    the file is compacted once too many rows are dead, or rewritten if it was
+    built for another model, dimension or dtype.
+    """
+    from array import array
+    
+    generation = get_index_meta(conn, "generation", "0")
+    dims = config["embedding"]["dimensions"]
+    dtype = config["index"].get("vector_file_dtype", "float32")
+    precision = get_embedding_precision(conn)
+    model = config["embedding"]["model"]
+    header = read_vector_header(index_dir, doc_type)
+    
+    if (header is None or header["dimensions"] != dims
+            or header["dtype"] != dtype or header["model"] != model[:64]):
+        rewrite_vector_file(conn, index_dir, config, generation, doc_type)
+        return
+    if header["generation"] == generation:
+        return
+    
+    vectors_path, ids_path = vector_file_paths(index_dir, doc_type)
+    ids = array("q")
+    with open(ids_path, "rb") as f:
+        ids.fromfile(f, header["count"])
+    if sys.byteorder != "little":
+        ids.byteswap()
+    
+    current = {row[0] for row in conn.execute(
+        partition_embeddings_sql("e.doc_id"), (embedding_blob_size(dims, precision), doc_type)
+    )}
+    stored = set(ids) - {-1}
+    added = sorted(current - stored)
+    removed = stored - current
+    
+    dead = sum(1 for doc_id in ids if doc_id == -1) + len(removed)
+    if dead > VECTOR_COMPACT_RATIO * (len(ids) + len(added)):
+        rewrite_vector_file(conn, index_dir, config, generation, doc_type)
+        return
+    
+    for position, doc_id in enumerate(ids):
+        if doc_id in removed:
+            ids[position] = -1
+    
+    with open(vectors_path, "r+b") as f:
+        f.seek(VECTOR_HEADER_SIZE + header["count"] * dims * VECTOR_DTYPES[dtype][1])
+        pending = []
+        for doc_id, blob in iter_embedding_rows(conn, added):
+            ids.append(doc_id)
+            pending.append(blob)
+            if len(pending) >= 1000:
+                f.write(encode_vector_rows(pending, dtype, precision))
+                pending = []
+        f.write(encode_vector_rows(pending, dtype, precision))
+        
+        if sys.byteorder != "little":
+            ids.byteswap()
+        with open(ids_path, "wb") as ids_file:
+            ids.tofile(ids_file)
+        
+        # Header last: a crash before this point leaves a size mismatch that
+        # read_vector_header rejects, and the next sync rewrites the file
+        f.flush()
+        write_vector_header(f, dims, dtype, len(ids), generation, model)
+
+
+def load_vector_file(conn: sqlite3.Connection, index_dir: Path, config: dict, doc_type: str):
+    """Memory-map a vector file partition if it is current, returning (ids, matrix) or None."""
+    header = read_vector_header(index_dir, doc_type)
+    if (np is None or header is None
+            or header["generation"] != get_index_meta(conn, "generation", "0")
+            or header["model"] != config["embedding"]["model"][:64]):
+        return None
+    
+    vectors_path, ids_path = vector_file_paths(index_dir, doc_type)
+    if header["count"] == 0:
+        return np.empty(0, dtype=np.int64), np.empty((0, header["dimensions"]), dtype=np.float32)
+    
+    ids = np.memmap(ids_path, dtype="<i8", mode="r", shape=(header["count"],))
+    matrix = np.memmap(
+        vectors_path, dtype="<f4" if header["dtype"] == "float32" else "<f2", mode="r",
+        offset=VECTOR_HEADER_SIZE, shape=(header["count"], header["dimensions"])
+    )
+    return ids, matrix
+
+
+# =============================================================================
+# Approximate Nearest Neighbour Index (IVF)
+# =============================================================================
+
+# Opt-in IVF-flat index: k-means centroids over the normalized embeddings, and
+# each chunk assigned to its nearest centroid ("list"). A query scores the
+# centroids, then only the chunks in the `nprobe` closest lists. Both tables
+# live in search.db so index_file updates them in the same transaction as the
+# chunks themselves. Requires NumPy.
+ANN_RETRAIN_GROWTH = 4  # retrain once the index is this many times larger
+ANN_TRAIN_SAMPLE = 256  # training vectors per list
+ANN_TRAIN_ITERATIONS = 10
+
+
+def load_ann_centroids(conn: sqlite3.Connection):
+    """Return the IVF centroid matrix, or None if there is no ANN index."""
+    if np is None:
+        return None
+    try:
+        rows = conn.execute("SELECT centroid FROM ivf_centroids ORDER BY list_id").fetchall()
+    except sqlite3.OperationalError:
+        # Index created before the ANN tables existed
+        return None
+    if not rows:
+        return None
+    matrix = np.frombuffer(b"".join(row[0] for row in rows), dtype=np.float32)
+    return matrix.reshape(len(rows), -1)
+
+
+def assign_ann_lists(centroids, vectors, block: int = 8192):
+    """Return the nearest centroid index for each row of `vectors`."""
+    lists = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block):
+        lists[start:start + block] = np.argmax(vectors[start:start + block] @ centroids.T, axis=1)
+    return lists
+
+
+def train_ann_centroids(vectors, n_lists: int, seed: int = 0):
+    """Spherical k-means on normalized vectors."""
+    rng = np.random.default_rng(seed)
+    n_lists = min(n_lists, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    
+    for _ in range(ANN_TRAIN_ITERATIONS):
+        lists = assign_ann_lists(centroids, vectors)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, lists, vectors)
+        counts = np.bincount(lists, minlength=n_lists)
+        
+        # Re-seed empty lists from random vectors
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        centroids = (sums / norms).astype(np.float32)
+    
+    return centroids
+
+
+def clear_ann_index(conn: sqlite3.Connection):
+    """Drop the ANN index (caller commits)."""
+    conn.execute("DELETE FROM ivf_assignments")
+    conn.execute("DELETE FROM ivf_centroids")
+
+
+def update_ann_index(conn: sqlite3.Connection, config: dict, verbose: bool = False):
+    """Train the IVF index if needed, then assign any unassigned chunks."""
+    dims = config["embedding"]["dimensions"]
+    precision = get_embedding_precision(conn)
+    blob_size = embedding_blob_size(dims, precision)
+    total = conn.execute(
+        "SELECT COUNT(*) FROM embeddings WHERE length(embedding) = ?", (blob_size,)
+    ).fetchone()[0]
+    if total == 0:
+        return
+    
+    centroids = load_ann_centroids(conn)
+    trained_count = int(get_index_meta(conn, "ann_trained_count", "0"))
+    n_lists = int(config["index"].get("ann_lists") or 0) or max(1, int(total ** 0.5))
+    
+    if (centroids is None or centroids.shape[1] != dims
+            or total > trained_count * ANN_RETRAIN_GROWTH):
+        rng = np.random.default_rng(0)
+        ids = np.array([row[0] for row in conn.execute(
+            "SELECT doc_id FROM embeddings WHERE length(embedding) = ?", (blob_size,)
+        )], dtype=np.int64)
+        sample = ids[rng.choice(len(ids), min(len(ids), n_lists * ANN_TRAIN_SAMPLE), replace=False)]
+        blobs = [blob for _, blob in iter_embedding_rows(conn, sorted(int(i) for i in sample))]
+        vectors = decode_embedding_matrix(blobs, dims, precision)
+        
+        if verbose:
+            print(f"Training ANN index: {n_lists} lists from {len(blobs)} vectors...")
+        centroids = train_ann_centroids(vectors, n_lists)
+        
+        clear_ann_index(conn)
+        conn.executemany(
+            "INSERT INTO ivf_centroids (list_id, centroid) VALUES (?, ?)",
+            [(i, centroid.tobytes()) for i, centroid in enumerate(centroids)]
+        )
+        set_index_meta(conn, "ann_trained_count", str(total))
+    
+    cursor = conn.execute("""
+        SELECT e.doc_id, e.embedding FROM embeddings e
+        LEFT JOIN ivf_assignments a ON a.doc_id = e.doc_id
+        WHERE a.doc_id IS NULL AND length(e.embedding) = ?
+    """, (blob_size,))
+    while True:
+        rows = cursor.fetchmany(8192)
+        if not rows:
+            break
+        vectors = decode_embedding_matrix([blob for _, blob in rows], dims, precision)
+        lists = assign_ann_lists(centroids, vectors)
+        conn.executemany(
+            "INSERT INTO ivf_assignments (doc_id, list_id) VALUES (?, ?)",
+            [(doc_id, int(list_id)) for (doc_id, _), list_id in zip(rows, lists)]
+        )
+    conn.commit()
+
+
+def score_ivf(conn: sqlite3.Connection, query_embedding: List[float], limit: int, nprobe: int,
+              doc_type: Optional[str] = None, filters: Optional[Dict] = None) -> Optional[List[Tuple[int, float]]]:
+    """Score only the chunks in the `nprobe` lists nearest the query, or None without an ANN index."""
+    centroids = load_ann_centroids(conn)
+    if centroids is None or centroids.shape[1] != len(query_embedding):
+        return None
+    
+    query = np.asarray(query_embedding, dtype=np.float32)
+    nprobe = max(1, min(nprobe, len(centroids)))
+    probe = np.argpartition(centroids @ query, -nprobe)[-nprobe:]
+    
+    placeholders = ",".join("?" * len(probe))
+    sql = f"""
+        SELECT a.doc_id, e.embedding
+        FROM ivf_assignments a
+        JOIN embeddings e ON e.doc_id = a.doc_id
+        WHERE a.list_id IN ({placeholders})
+    """
+    params = [int(list_id) for list_id in probe]
+    clause, clause_params = filter_clause(doc_type, filters)
+    if clause:
+        sql += f" AND a.doc_id IN (SELECT d.id FROM documents d WHERE {clause})"
+        params.extend(clause_params)
+    
+    return score_numpy(conn.execute(sql, params).fetchall(), query_embedding, limit,
+                       get_embedding_precision(conn))
+
+
+def ann_recall(config: dict, k: int = 10, queries: int = 100, nprobes: Optional[List[int]] = None) -> Optional[List[Dict]]:
+    """Measure recall@k of the IVF index against the exact scan.
+    
+    Stored chunk vectors are used as queries, so no embedding server is
+    needed; each query's own chunk is excluded from both result lists.
+    """
+    import random
+    import time
+    
+    db_path = Path(".branch-flow/index/search.db")
+    if not db_path.exists():
+        print("Index not found. Run: /bf:index", file=sys.stderr)
+        return None
+    if np is None:
+        print("The ANN index requires NumPy: pip install numpy", file=sys.stderr)
+        return None
+    
+    conn = sqlite3.connect(db_path)
+    if load_ann_centroids(conn) is None:
+        print("No ANN index. Set \"ann\": true in the index config and run: /bf:index", file=sys.stderr)
+        conn.close()
+        return None
+    
+    dims = config["embedding"]["dimensions"]
+    precision = get_embedding_precision(conn)
+    rows = conn.execute(
+        "SELECT doc_id, embedding FROM embeddings WHERE length(embedding) = ?",
+        (embedding_blob_size(dims, precision),)
+    ).fetchall()
+    sample = random.Random(0).sample(rows, min(queries, len(rows)))
+    nprobes = nprobes or [1, 2, 4, 8, 16, 32]
+    
+    def without_self(scored, doc_id):
+        return [item_id for item_id, _ in scored if item_id != doc_id][:k]
+    
+    exact = []
+    start = time.perf_counter()
+    for doc_id, blob in sample:
+        query = deserialize_embedding(blob, precision)
+        exact.append(without_self(score_numpy(rows, query, k + 1, precision), doc_id))
+    exact_ms = (time.perf_counter() - start) * 1000 / max(1, len(sample))
+    
+    report = []
+    for nprobe in nprobes:
+        hits = 0
+        wanted = 0
+        start = time.perf_counter()
+        for (doc_id, blob), truth in zip(sample, exact):
+            found = without_self(score_ivf(conn, deserialize_embedding(blob, precision), k + 1, nprobe), doc_id)
+            hits += len(set(found) & set(truth))
+            wanted += len(truth)
+        report.append({
+            "nprobe": nprobe,
+            "recall": hits / wanted if wanted else 0.0,
+            "latency_ms": (time.perf_counter() - start) * 1000 / max(1, len(sample)),
+            "exact_latency_ms": exact_ms
+        })
+    
+    conn.close()
+    return report
+
+
+# =============================================================================
+# Binary Sign Codes
+# =============================================================================
+
+# Opt-in prefilter: one bit per dimension (set where the component is
+# positive), packed most significant bit first like numpy.packbits. The
+# Hamming distance between codes approximates the angle between vectors, so a
+# query scans dims/8 bytes per chunk to pick a shortlist, and only the
+# shortlist is scored with the stored vectors.
+POPCOUNT_TABLE = bytes(bin(i).count("1") for i in range(256))
+
+
+def sign_code(embedding: List[float]) -> bytes:
+    """Pack the signs of a vector into a bit string."""
+    code = bytearray((len(embedding) + 7) // 8)
+    for i, x in enumerate(embedding):
+        if x > 0:
+            code[i // 8] |= 0x80 >> (i % 8)
+    return bytes(code)
+
+
+def update_sign_codes(conn: sqlite3.Connection, config: dict):
+    """Compute sign codes for chunks that don't have one (caller commits)."""
+    dims = config["embedding"]["dimensions"]
+    precision = get_embedding_precision(conn)
+    cursor = conn.execute("""
+        SELECT e.doc_id, e.embedding FROM embeddings e
+        LEFT JOIN sign_codes c ON c.doc_id = e.doc_id
+        WHERE c.doc_id IS NULL AND length(e.embedding) = ?
+    """, (embedding_blob_size(dims, precision),))
+    while True:
+        rows = cursor.fetchmany(8192)
+        if not rows:
+            break
+        if np is not None:
+            codes = np.packbits(decode_embedding_matrix([blob for _, blob in rows], dims, precision) > 0, axis=1)
+            values = [(doc_id, code.tobytes()) for (doc_id, _), code in zip(rows, codes)]
+        else:
+            values = [(doc_id, sign_code(deserialize_embedding(blob, precision))) for doc_id, blob in rows]
+        conn.executemany("INSERT INTO sign_codes (doc_id, code) VALUES (?, ?)", values)
+    set_index_meta(conn, "sign_codes", "1")
+
+
+def clear_sign_codes(conn: sqlite3.Connection):
+    """Drop the sign codes (caller commits)."""
+    conn.execute("DELETE FROM sign_codes")
+    conn.execute("DELETE FROM index_meta WHERE key = 'sign_codes'")
+
+
+def hamming_shortlist(rows: List[Tuple[int, bytes]], query_code: bytes, shortlist: int) -> List[int]:
+    """Doc ids of the `shortlist` codes nearest the query code."""
+    import heapq
+    
+    if not rows:
+        return []
+    if np is None:
+        query = int.from_bytes(query_code, "big")
+        distances = ((bin(int.from_bytes(code, "big") ^ query).count("1"), doc_id) for doc_id, code in rows)
+        return [doc_id for _, doc_id in heapq.nsmallest(shortlist, distances)]
+    
+    ids = np.fromiter((doc_id for doc_id, _ in rows), dtype=np.int64, count=len(rows))
+    codes = np.frombuffer(b"".join(code for _, code in rows), dtype=np.uint8).reshape(len(rows), -1)
+    query = np.frombuffer(query_code, dtype=np.uint8)
+    table = np.frombuffer(POPCOUNT_TABLE, dtype=np.uint8)
+    distances = np.empty(len(rows), dtype=np.int32)
+    block = 65536
+    for start in range(0, len(rows), block):
+        distances[start:start + block] = table[codes[start:start + block] ^ query].sum(axis=1, dtype=np.int32)
+    if shortlist < len(distances):
+        return ids[np.argpartition(distances, shortlist)[:shortlist]].tolist()
+    return ids.tolist()
+
+
+def score_sign_codes(conn: sqlite3.Connection, query_embedding: List[float], limit: int, shortlist: int,
+                     doc_type: Optional[str] = None, filters: Optional[Dict] = None
+                     ) -> Optional[List[Tuple[int, float]]]:
+    """Shortlist by Hamming distance, then score the shortlist exactly; None without codes."""
+    if get_index_meta(conn, "sign_codes") != "1":
+        return None
+    
+    sql = "SELECT doc_id, code FROM sign_codes"
+    clause, params = filter_clause(doc_type, filters)
+    if clause:
+        sql += f" WHERE doc_id IN (SELECT d.id FROM documents d WHERE {clause})"
+    query_code = sign_code(query_embedding)
+    rows = [row for row in conn.execute(sql, params) if len(row[1]) == len(query_code)]
+    
+    precision = get_embedding_precision(conn)
+    size = embedding_blob_size(len(query_embedding), precision)
+    candidates = [
+        (doc_id, blob) for doc_id, blob in
+        iter_embedding_rows(conn, sorted(hamming_shortlist(rows, query_code, max(limit, shortlist))))
+        if len(blob) == size
+    ]
+    if np is not None:
+        return score_numpy(candidates, query_embedding, limit, precision)
+    return score_python(candidates, query_embedding, limit, precision)
+
+
+# =============================================================================
+# Storage Precision
+# =============================================================================
+
+def migrate_embedding_precision(conn: sqlite3.Connection, dims: int, precision: str,
+                                verbose: bool = False) -> bool:
+    """Re-encode the embeddings table in place at `precision`; True if it changed.
+    
+    Narrowing is lossy, but going back to float32 restores the exact
+    vectors of chunks that have a rescoring copy. Others keep the rounded
+    values until they are re-embedded (or found in the embedding cache by
+    a rebuild).
+    """
+    current = get_embedding_precision(conn)
+    if current == precision:
+        return False
+    
+    doc_ids = [row[0] for row in conn.execute(
+        "SELECT doc_id FROM embeddings WHERE length(embedding) = ?", (embedding_blob_size(dims, current),)
+    )]
+    if verbose and doc_ids:
+        print(f"Converting {len(doc_ids)} embeddings from {current} to {precision}...")
+    
+    updates = []
+    for doc_id, blob in iter_embedding_rows(conn, doc_ids):
+        updates.append((serialize_embedding(deserialize_embedding(blob, current), precision), doc_id))
+        if len(updates) >= 1000:
+            conn.executemany("UPDATE embeddings SET embedding = ? WHERE doc_id = ?", updates)
+            updates = []
+    conn.executemany("UPDATE embeddings SET embedding = ? WHERE doc_id = ?", updates)
+    if precision == "float32":
+        # The full-precision copies become the stored vectors again
+        conn.execute("""
+            UPDATE embeddings SET embedding = (
+                SELECT r.embedding FROM rescore_vectors r WHERE r.doc_id = embeddings.doc_id
+            ) WHERE doc_id IN (SELECT doc_id FROM rescore_vectors WHERE length(embedding) = ?)
+        """, (embedding_blob_size(dims),))
+        conn.execute("DELETE FROM rescore_vectors")
+    set_index_meta(conn, "embedding_precision", precision)
+    bump_index_generation(conn)
+    conn.commit()
+    
+    if doc_ids and embedding_blob_size(dims, precision) < embedding_blob_size(dims, current):
+        # Return the freed pages to the file system
+        conn.execute("VACUUM")
+    return True
+
+
+def keeps_rescore_vectors(config: dict, precision: str) -> bool:
+    """Whether float32 copies are kept next to `precision` embeddings for rescoring."""
+    return precision != "float32" and int(config["index"].get("rescore_candidates", 0)) > 0
+
+
+def missing_rescore_vectors(conn: sqlite3.Connection) -> int:
+    """Number of embeddings without a full-precision copy."""
+    return conn.execute("""
+        SELECT COUNT(*) FROM embeddings e
+        WHERE NOT EXISTS (SELECT 1 FROM rescore_vectors r WHERE r.doc_id = e.doc_id)
+    """).fetchone()[0]
+
+
+def sync_rescore_vectors(conn: sqlite3.Connection, config: dict) -> int:
+    """Add or drop float32 rescoring copies for the configured precision.
+    
+    Runs before the embeddings table is converted: copies are taken from
+    float32 embeddings while they still exist, otherwise from the chunk
+    embedding cache. Returns the number of copies added (caller commits).
+    """
+    precision = config["index"].get("embedding_precision", "float32")
+    current = get_embedding_precision(conn)
+    if not keeps_rescore_vectors(config, precision):
+        # Converting back to float32 restores vectors from the copies first
+        if precision != "float32" or current == "float32":
+            conn.execute("DELETE FROM rescore_vectors")
+        return 0
+    
+    full_size = embedding_blob_size(config["embedding"]["dimensions"])
+    if current == "float32":
+        return conn.execute("""
+            INSERT OR REPLACE INTO rescore_vectors (doc_id, embedding)
+            SELECT e.doc_id, e.embedding FROM embeddings e
+            WHERE length(e.embedding) = ?
+              AND NOT EXISTS (SELECT 1 FROM rescore_vectors r WHERE r.doc_id = e.doc_id)
+        """, (full_size,)).rowcount
+    
+    rows = cached_full_vectors(conn, config, """
+        SELECT d.id, d.content FROM documents d JOIN embeddings e ON e.doc_id = d.id
+        WHERE NOT EXISTS (SELECT 1 FROM rescore_vectors r WHERE r.doc_id = d.id)
+    """)
+    conn.executemany("INSERT OR REPLACE INTO rescore_vectors (doc_id, embedding) VALUES (?, ?)", rows)
+    return len(rows)
+
+
+def cached_full_vectors(conn: sqlite3.Connection, config: dict, documents_sql: str) -> List[Tuple[int, bytes]]:
+    """(doc_id, float32 blob) from the embedding cache for the (id, content) rows of a query."""
+    identity = embedding_identity(config)
+    full_size = embedding_blob_size(config["embedding"]["dimensions"])
+    documents = conn.execute(documents_sql).fetchall()
+    rows = []
+    for start in range(0, len(documents), 500):
+        keys = {chunk_cache_key(identity, content): doc_id for doc_id, content in documents[start:start + 500]}
+        placeholders = ",".join("?" * len(keys))
+        rows.extend(
+            (keys[key], blob) for key, blob in conn.execute(
+                f"SELECT key, embedding FROM embedding_cache WHERE key IN ({placeholders})", list(keys)
+            ) if len(blob) == full_size
+        )
+    return rows
+
+
+_rescore_warning_shown = False
+
+
+@timed("rescore")
+def rescore_candidates(conn: sqlite3.Connection, config: dict, query_embedding: List[float],
+                       scored: List[Tuple[int, float]], limit: int) -> List[Tuple[int, float]]:
+    """Re-rank candidates from a reduced-precision scan with their float32 copies.
+    
+    A candidate without a copy (an index converted while rescoring was off,
+    say) keeps its scanned score; this is reported once per process.
+    """
+    global _rescore_warning_shown
+    
+    if not scored:
+        return scored
+    
+    placeholders = ",".join("?" * len(scored))
+    vectors = dict(conn.execute(
+        f"SELECT doc_id, embedding FROM rescore_vectors WHERE doc_id IN ({placeholders})",
+        [doc_id for doc_id, _ in scored]
+    ))
+    
+    rescored = []
+    missing = 0
+    full_size = embedding_blob_size(len(query_embedding))
+    for doc_id, similarity in scored:
+        blob = vectors.get(doc_id)
+        if blob is not None and len(blob) == full_size:
+            similarity = cosine_similarity(query_embedding, deserialize_embedding(blob))
+        else:
+            missing += 1
+        rescored.append((doc_id, similarity))
+    
+    if missing:
+        METRICS.count("rescore_missing", missing)
+        if not _rescore_warning_shown:
+            _rescore_warning_shown = True
+            print(f"⚠️  {missing} of {len(scored)} rescoring candidates have no full-precision vector and keep "
+                  f"their {get_embedding_precision(conn)} scores. Run /bf:index to restore them "
+                  f"(index --rebuild if they remain)", file=sys.stderr)
+    rescored.sort(key=lambda item: item[1], reverse=True)
+    return rescored[:limit]
+
+
+def full_precision_vectors(conn: sqlite3.Connection, config: dict):
+    """(doc_ids, float32 matrix) of every chunk whose float32 vector is available.
+    
+    A reduced-precision index reads its rescoring copies, and the embedding
+    cache for chunks without one (rescoring off).
+    """
+    dims = config["embedding"]["dimensions"]
+    precision = get_embedding_precision(conn)
+    table = "embeddings" if precision == "float32" else "rescore_vectors"
+    rows = conn.execute(
+        f"SELECT doc_id, embedding FROM {table} WHERE length(embedding) = ?", (dims * 4,)
+    ).fetchall()
+    if precision != "float32":
+        rows += cached_full_vectors(conn, config, """
+            SELECT d.id, d.content FROM documents d JOIN embeddings e ON e.doc_id = d.id
+            WHERE NOT EXISTS (SELECT 1 FROM rescore_vectors r WHERE r.doc_id = d.id)
+        """)
+    ids = np.array([doc_id for doc_id, _ in rows], dtype=np.int64)
+    return ids, decode_embedding_matrix([blob for _, blob in rows], dims)
+
+
+def quantize_matrix(matrix, precision: str):
+    """Round-trip a float32 matrix through a storage precision (as serialize_embedding does)."""
+    if precision == "float16":
+        return matrix.astype(np.float16).astype(np.float32)
+    if precision == "int8":
+        scales = np.abs(matrix).max(axis=1, keepdims=True) / 127
+        scales[scales == 0] = 1.0
+        return np.round(matrix / scales).astype(np.int8).astype(np.float32) * scales
+    return matrix
+
+
+def precision_report(config: dict, k: int = 10, queries: int = 100,
+                     candidates: Optional[int] = None) -> Optional[Dict]:
+    """Compare storage precisions on this index: size and recall@k.
+    
+    Each precision is simulated in memory from the float32 vectors, with
+    stored vectors as queries (each query's own chunk excluded). Recall is
+    reported for the plain scan and after rescoring `candidates` results.
+    Sizes count the vectors a search scans and, separately, everything kept
+    on disk: the scanned vectors plus the float32 copies used for rescoring.
+    """
+    import random
+    
+    db_path = Path(".branch-flow/index/search.db")
+    if not db_path.exists():
+        print("Index not found. Run: /bf:index", file=sys.stderr)
+        return None
+    if np is None:
+        print("The precision report requires NumPy: pip install numpy", file=sys.stderr)
+        return None
+    
+    conn = sqlite3.connect(db_path)
+    dims = config["embedding"]["dimensions"]
+    current = get_embedding_precision(conn)
+    stored_bytes = conn.execute(
+        "SELECT COALESCE(SUM(length(embedding)), 0) FROM embeddings WHERE length(embedding) = ?",
+        (embedding_blob_size(dims, current),)
+    ).fetchone()[0]
+    rescore_bytes, cache_bytes = (
+        conn.execute(f"SELECT COALESCE(SUM(length(embedding)), 0) FROM {table}").fetchone()[0]
+        for table in ("rescore_vectors", "embedding_cache")
+    )
+    ids, exact = full_precision_vectors(conn, config)
+    conn.close()
+    if len(ids) == 0:
+        print("No full-precision vectors available (embedding cache empty?)", file=sys.stderr)
+        return None
+    
+    candidates = candidates or int(config["index"].get("rescore_candidates", 0)) or 50
+    sample = random.Random(0).sample(range(len(ids)), min(queries, len(ids)))
+    
+    def top(scores, n, skip):
+        scores = scores.copy()
+        scores[skip] = -np.inf
+        n = min(n, len(scores) - 1)
+        best = np.argpartition(scores, -n)[-n:] if n > 0 else np.empty(0, dtype=np.int64)
+        return best[np.argsort(scores[best])[::-1]]
+    
+    truth = [set(top(exact @ exact[row], k, row)) for row in sample]
+    report = {"current": current, "stored_bytes": stored_bytes, "rescore_bytes": rescore_bytes,
+              "cache_bytes": cache_bytes, "db_bytes": db_path.stat().st_size, "vectors": len(ids), "k": k,
+              "candidates": candidates, "precisions": []}
+    full_bytes = embedding_blob_size(dims) * len(ids)
+    for precision in EMBEDDING_PRECISIONS:
+        quantized = quantize_matrix(exact, precision)
+        hits = rescored_hits = wanted = 0
+        for row, expected in zip(sample, truth):
+            scores = quantized @ exact[row]
+            found = top(scores, max(k, candidates), row)
+            hits += len(set(found[:k]) & expected)
+            reranked = found[np.argsort((exact[found] @ exact[row]))[::-1]][:k]
+            rescored_hits += len(set(reranked) & expected)
+            wanted += len(expected)
+        size = embedding_blob_size(dims, precision)
+        copies = full_bytes if keeps_rescore_vectors(config, precision) else 0
+        report["precisions"].append({
+            "precision": precision,
+            "bytes_per_vector": size,
+            "ratio": embedding_blob_size(dims) / size,
+            "scan_bytes": size * len(ids),
+            "rescore_bytes": copies,
+            "index_bytes": size * len(ids) + copies,
+            "index_ratio": full_bytes / (size * len(ids) + copies),
+            "recall": hits / wanted if wanted else 0.0,
+            "recall_rescored": rescored_hits / wanted if wanted else 0.0
+        })
+    return report
+
+
 # =============================================================================
 # Indexing
 # =============================================================================
 
+@functools.lru_cache(maxsize=None)
+def compile_exclude_patterns(patterns: Tuple[str, ...]):
+    """Compile exclude_patterns into (component regex, [path regexes]).
+    
+    A pattern without a slash (e.g. "node_modules", "*.egg-info") matches any
+    single path component. A pattern with a slash (e.g. ".branch-flow/index")
+    is a glob anchored at the project root that matches a leading part of
+    the path.
+    """
+    import fnmatch
+    import re
+    
+    component = []
+    anchored = []
+    for pattern in patterns:
+        pattern = pattern.strip().strip("/")
+        if pattern.startswith("./"):
+            pattern = pattern[2:]
+        if not pattern:
+            continue
+        if "/" in pattern:
+            anchored.append(re.compile(fnmatch.translate(pattern)))
+        else:
+            component.append(fnmatch.translate(pattern))
+    
+    return (re.compile("|".join(component)) if component else None), anchored
+
+
+def is_excluded_path(rel_path: str, config: dict) -> bool:
+    """Check a project-relative POSIX path against exclude_patterns."""
+    component, anchored = compile_exclude_patterns(tuple(config["index"]["exclude_patterns"]))
+    parts = rel_path.split("/")
+    
+    if component is not None and any(component.match(part) for part in parts):
+        return True
+    for regex in anchored:
+        for end in range(1, len(parts) + 1):
+            if regex.match("/".join(parts[:end])):
+                return True
+    return False
+
+
+def is_excluded_name(name: str, config: dict) -> bool:
+    """Check a file name against exclude_files (exact names or globs)."""
+    import fnmatch
+    
+    return any(
+        name == pattern or fnmatch.fnmatch(name, pattern)
+        for pattern in config["index"].get("exclude_files", [])
+    )
+
+
 def should_index_file(path: Path, config: dict) -> bool:
     """Check if file should be indexed."""
     # Check extension
@@ -434,241 +2266,2738 @@ def should_index_file(path: Path, config: dict) -> bool:
         return False
     
     # Check excluded filenames
-    exclude_files = config["index"].get("exclude_files", [])
-    if path.name in exclude_files:
+    if is_excluded_name(path.name, config):
         return False
     
     # Check exclude patterns
-    path_str = str(path)
-    for pattern in config["index"]["exclude_patterns"]:
-        if pattern in path_str:
+    if is_excluded_path(path.as_posix(), config):
+        return False
+    
+    # Check file size
+    try:
+        size_kb = path.stat().st_size / 1024
+        if size_kb > config["index"]["max_file_size_kb"]:
             return False
+    except OSError:
+        return False
+    
+    return True
+
+
+def gitignore_regex(pattern: str) -> str:
+    """Translate a .gitignore glob (relative to its directory) to a regex."""
+    import re
+    
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("/**", i) and i + 3 == len(pattern):
+            out.append("/.*")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                out.append("[" + pattern[i + 1:end].replace("!", "^", 1) + "]")
+                i = end
+        elif c == "\\" and i + 1 < len(pattern):
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    
+    body = "".join(out)
+    # Without a slash the pattern matches a name at any depth
+    return ("" if anchored else "(?:.*/)?") + body + r"\Z"
+
+
+def load_gitignore(dir_path: Path, rel_dir: str) -> List[Tuple[str, object, bool, bool]]:
+    """Read a directory's .gitignore into (base, regex, negate, dir_only) rules."""
+    import re
+    
+    try:
+        lines = (dir_path / ".gitignore").read_text(encoding="utf-8", errors="ignore").splitlines()
+    except OSError:
+        return []
+    
+    rules = []
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if line:
+            rules.append((rel_dir, re.compile(gitignore_regex(line)), negate, dir_only))
+    return rules
+
+
+def is_gitignored(rel_path: str, is_dir: bool, rules: List[Tuple[str, object, bool, bool]]) -> bool:
+    """Apply .gitignore rules in order; the last matching rule wins."""
+    ignored = False
+    for base, regex, negate, dir_only in rules:
+        if dir_only and not is_dir:
+            continue
+        if base:
+            if not rel_path.startswith(base + "/"):
+                continue
+            candidate = rel_path[len(base) + 1:]
+        else:
+            candidate = rel_path
+        if regex.match(candidate):
+            ignored = not negate
+    return ignored
+
+
+def walk_files(root: Path, config: dict, skip: Optional[Set[str]] = None,
+               directories: Optional[List[str]] = None) -> List[Path]:
+    """Find indexable files under root, pruning excluded directories.
+    
+    Excluded (and, with respect_gitignore, git-ignored) directories are
+    never descended into. Directories are scanned on `walk_workers` threads;
+    if `directories` is given, every scanned directory is appended to it.
+    """
+    from concurrent import futures
+    
+    index_config = config["index"]
+    extensions = set(index_config["include_extensions"])
+    max_size = index_config["max_file_size_kb"] * 1024
+    use_gitignore = index_config.get("respect_gitignore", False)
+    workers = max(1, int(index_config.get("walk_workers", 4)))
+    skip = skip or set()
+    
+    def scan(rel_dir: str, rules):
+        dir_path = root / rel_dir if rel_dir else root
+        if use_gitignore:
+            rules = rules + load_gitignore(dir_path, rel_dir)
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not (is_excluded_path(rel, config)
+                                    or (use_gitignore and is_gitignored(rel, True, rules))):
+                                subdirs.append(rel)
+                            continue
+                        if (not entry.is_file()
+                                or os.path.splitext(entry.name)[1] not in extensions
+                                or rel in skip
+                                or is_excluded_name(entry.name, config)
+                                or is_excluded_path(rel, config)
+                                or (use_gitignore and is_gitignored(rel, False, rules))
+                                or entry.stat().st_size > max_size):
+                            continue
+                    except OSError:
+                        continue
+                    files.append(rel)
+        except OSError:
+            pass
+        return files, [(subdir, rules) for subdir in subdirs]
+    
+    found = []
+    if workers == 1:
+        stack = [("", [])]
+        while stack:
+            rel_dir, rules = stack.pop()
+            if directories is not None:
+                directories.append(rel_dir)
+            files, subdirs = scan(rel_dir, rules)
+            found.extend(files)
+            stack.extend(subdirs)
+    else:
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            running = {executor.submit(scan, "", [])}
+            if directories is not None:
+                directories.append("")
+            while running:
+                done, running = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    files, subdirs = future.result()
+                    found.extend(files)
+                    running.update(executor.submit(scan, *subdir) for subdir in subdirs)
+                    if directories is not None:
+                        directories.extend(subdir for subdir, _ in subdirs)
+    
+    return [Path(rel) for rel in sorted(found)]
+
+
+def run_git(*args: str) -> Optional[str]:
+    """Run a git command in the current directory, or None if it fails."""
+    try:
+        result = subprocess.run(
+            ["git", *args], capture_output=True, text=True, timeout=60
+        )
+    except (subprocess.TimeoutExpired, FileNotFoundError):
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout
+
+
+def git_ls_files() -> Optional[Tuple[Set[str], Set[str]]]:
+    """Return (tracked, untracked-not-ignored) paths, or None outside a git work tree."""
+    tracked = run_git("ls-files", "-z", "--cached")
+    untracked = run_git("ls-files", "-z", "--others", "--exclude-standard")
+    if tracked is None or untracked is None:
+        return None
+    return set(filter(None, tracked.split("\0"))), set(filter(None, untracked.split("\0")))
+
+
+def git_changed_files(since: str) -> Optional[Set[str]]:
+    """Paths whose working tree content may differ from commit `since`."""
+    changed = run_git("diff", "--name-only", "--relative", "-z", since)
+    if changed is None:
+        return None
+    return set(filter(None, changed.split("\0")))
+
+
+def get_files_to_index(config: dict) -> List[Tuple[Path, str]]:
+    """Get list of files to index with their types."""
+    files = []
+    root = Path(".")
+    
+    # Index memory
+    if config["index"]["index_memory"]:
+        memory_dir = root / ".branch-flow" / "memory"
+        if memory_dir.exists():
+            for path in memory_dir.glob("*.md"):
+                files.append((path, "memory"))
+    
+    # Index specs
+    if config["index"]["index_specs"]:
+        specs_dir = root / ".branch-flow" / "specs"
+        if specs_dir.exists():
+            for path in specs_dir.glob("*.md"):
+                files.append((path, "spec"))
+        
+        plans_dir = root / ".branch-flow" / "plans"
+        if plans_dir.exists():
+            for path in plans_dir.glob("*.md"):
+                files.append((path, "plan"))
+    
+    # Index codebase, leaving out files already indexed with their own type
+    typed = {path.as_posix() for path, _ in files}
+    code_files = []
+    git_files = git_ls_files() if config["index"].get("use_git") else None
+    if config["index"]["index_codebase"] and git_files is not None:
+        tracked, untracked = git_files
+        for name in sorted(tracked | untracked):
+            path = Path(name)
+            if name not in typed and should_index_file(path, config):
+                code_files.append((path, "code"))
+    elif config["index"]["index_codebase"]:
+        code_files = [(path, "code") for path in walk_files(root, config, typed)]
+    
+    return code_files + files
+
+
+def embedding_identity(config: dict) -> str:
+    """Identify the embedding space: vectors are only comparable within one."""
+    embedding = config["embedding"]
+    return f"{embedding['provider']}/{embedding['model']}/{embedding['dimensions']}"
+
+
+def chunk_cache_key(identity: str, text: str) -> str:
+    """Content address of a chunk's embedding in a given embedding space."""
+    return hashlib.sha256(f"{identity}\0{text}".encode("utf-8", errors="surrogatepass")).hexdigest()
+
+
+def prune_embedding_cache(conn: sqlite3.Connection, max_entries: int):
+    """Evict least recently used chunk embeddings beyond `max_entries`."""
+    count = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+    if count > max_entries:
+        conn.execute("""
+            DELETE FROM embedding_cache WHERE key IN (
+                SELECT key FROM embedding_cache ORDER BY last_used ASC LIMIT ?
+            )
+        """, (count - max_entries,))
+        conn.commit()
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a query for caching: NFC, whitespace collapsed."""
+    return " ".join(unicodedata.normalize("NFC", query).split())
+
+
+def get_query_embedding(conn: sqlite3.Connection, query: str, config: dict,
+                        stats: Optional[Dict] = None) -> List[float]:
+    """Embed a search query, through the LRU query cache in search.db.
+    
+    A hit never contacts the embedding server. Cumulative hit and miss
+    counts are kept in index_meta and copied into `stats` if given.
+    Cache writes are skipped rather than waited for while an index run
+    holds the write lock.
+    """
+    return get_query_embeddings(conn, [query], config, stats)[0]
+
+
+@timed("query_embedding")
+def get_query_embeddings(conn: sqlite3.Connection, queries: List[str], config: dict,
+                         stats: Optional[Dict] = None) -> List[List[float]]:
+    """Embed several queries through the query cache, sending the misses in `batch_size` requests."""
+    max_entries = int(config["embedding"].get("query_cache_max_entries", 1000))
+    keys = [chunk_cache_key(embedding_identity(config), normalize_query(query)) for query in queries]
+    cached: Dict[str, List[float]] = {}
+    if max_entries > 0:
+        try:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                cached.update(
+                    (key, deserialize_embedding(blob)) for key, blob in conn.execute(
+                        f"SELECT key, embedding FROM query_cache WHERE key IN ({','.join('?' * len(chunk))})",
+                        chunk
+                    )
+                )
+        except sqlite3.OperationalError:
+            # Index created before query_cache existed
+            max_entries = 0
+    
+    # Repeated queries in one batch are embedded once
+    missing = {key: query for key, query in zip(keys, queries) if key not in cached}
+    fresh: Dict[str, List[float]] = {}
+    batch_size = max(1, int(config["embedding"].get("batch_size", 10)))
+    missing_keys = list(missing)
+    for start in range(0, len(missing_keys), batch_size):
+        batch = missing_keys[start:start + batch_size]
+        fresh.update(zip(batch, get_embeddings([missing[key] for key in batch], config)))
+    if max_entries <= 0:
+        return [fresh[key] for key in keys]
+    
+    hit_count = len(keys) - len(missing)
+    METRICS.count("query_cache_hits", hit_count)
+    METRICS.count("query_cache_misses", len(missing))
+    hits = int(get_index_meta(conn, "query_cache_hits", "0")) + hit_count
+    misses = int(get_index_meta(conn, "query_cache_misses", "0")) + len(missing)
+    if stats is not None:
+        if len(keys) == 1:
+            summary = "hit" if hit_count else "miss"
+        else:
+            summary = f"{hit_count}/{len(keys)} hits"
+        stats.update({"query_cache": summary, "query_cache_hits": hits, "query_cache_misses": misses})
+    
+    conn.execute("PRAGMA busy_timeout = 100")
+    try:
+        now = time.time()
+        conn.executemany("UPDATE query_cache SET last_used = ? WHERE key = ?", [(now, key) for key in cached])
+        if fresh:
+            conn.executemany(
+                "INSERT OR REPLACE INTO query_cache (key, embedding, last_used) VALUES (?, ?, ?)",
+                [(key, serialize_embedding(embedding), now) for key, embedding in fresh.items()]
+            )
+            conn.execute("""
+                DELETE FROM query_cache WHERE key NOT IN (
+                    SELECT key FROM query_cache ORDER BY last_used DESC LIMIT ?
+                )
+            """, (max_entries,))
+        set_index_meta(conn, "query_cache_hits", hits)
+        set_index_meta(conn, "query_cache_misses", misses)
+        conn.commit()
+    except sqlite3.OperationalError:
+        conn.rollback()
+    return [cached.get(key) or fresh[key] for key in keys]
+
+
+class EmbeddingBatcher:
+    """Queue chunks across files and embed them in requests of `batch_size`.
+    
+    Full batches are sent on a pool of `concurrency` worker threads (per
+    configured endpoint), each reusing a keep-alive connection. Rows in
+    `documents` are inserted immediately; embeddings are written back on
+    the calling thread as requests complete. The connection is only
+    committed once nothing is queued or in flight, so a file is never
+    committed without all of its embeddings, and at most every
+    COMMIT_INTERVAL seconds. While the pool stays busy, the queue is
+    drained every CHECKPOINT_INTERVAL seconds so that a failure late in a
+    long run loses little work.
+    
+    Chunk texts already embedded in this embedding space (in an earlier run,
+    another file, or earlier in this batch) are taken from the chunk cache
+    instead of being sent again. Chunks are queued with add and sent once
+    their file is complete (finish_file), so commits fall between files;
+    finished files get their file vector recomputed in the same transaction.
+    """
+    
+    COMMIT_INTERVAL = 5.0
+    CHECKPOINT_INTERVAL = 30.0
+    
+    def __init__(self, conn: sqlite3.Connection, config: dict):
+        from concurrent.futures import ThreadPoolExecutor
+        
+        self.conn = conn
+        self.config = config
+        self.batch_size = max(1, int(config["embedding"].get("batch_size", 10)))
+        self.concurrency = embedding_concurrency(config)
+        self.use_cache = int(config["embedding"].get("cache_max_entries", 100000)) > 0
+        self.identity = embedding_identity(config)
+        self.precision = get_embedding_precision(conn)
+        self.rescore_copies = keeps_rescore_vectors(config, self.precision)
+        self.pending: List[Tuple[str, str]] = []
+        # Cache key -> doc ids waiting for that embedding
+        self.waiting: Dict[str, List[int]] = {}
+        self.in_flight = collections.deque()
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        # New chunks join the ANN index as they are written
+        self.ann_centroids = load_ann_centroids(conn) if config["index"].get("ann") else None
+        self.sign_codes = bool(config["index"].get("binary_codes"))
+        self.files: Set[str] = set()  # files whose file vector is out of date
+        self.failed_files: List[str] = []  # files with chunks in the request that last failed
+        self.cache_hits = 0
+        self.embedded = 0
+        self.last_commit = time.monotonic()
+    
+    def add(self, doc_id: int, text: str):
+        """Queue a document chunk; it is sent once its file is finished."""
+        key = chunk_cache_key(self.identity, text)
+        
+        if key in self.waiting:
+            self.waiting[key].append(doc_id)
+            self.cache_hits += 1
+            METRICS.count("embedding_cache_hits")
+            return
+        
+        if self.use_cache:
+            row = self.conn.execute(
+                "SELECT embedding FROM embedding_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row:
+                self.conn.execute(
+                    "UPDATE embedding_cache SET last_used = ? WHERE key = ?", (int(time.time()), key)
+                )
+                self._store([doc_id], [row[0]])
+                self.cache_hits += 1
+                METRICS.count("embedding_cache_hits")
+                return
+        
+        METRICS.count("embedding_cache_misses")
+        self.waiting[key] = [doc_id]
+        self.pending.append((key, text))
+    
+    def finish_file(self, file_path: str):
+        """Send full batches once all of a file's chunks are queued.
+        
+        The file's vector is recomputed at the next commit, when all its
+        chunks are embedded.
+        """
+        self.files.add(file_path)
+        self.flush(force=False)
+    
+    def _submit(self, batch: List[Tuple[str, str]]):
+        future = self.executor.submit(embed_with_retry, [text for _, text in batch], self.config)
+        self.in_flight.append((batch, future))
+    
+    @timed("write")
+    def _store(self, doc_ids: List[int], blobs: List[bytes]):
+        """Write serialized normalized float32 embeddings for doc ids."""
+        stored = blobs
+        if self.precision != "float32":
+            stored = [serialize_embedding(deserialize_embedding(blob), self.precision) for blob in blobs]
+        self.conn.executemany(
+            "INSERT INTO embeddings (doc_id, embedding) VALUES (?, ?)",
+            list(zip(doc_ids, stored))
+        )
+        if self.rescore_copies:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO rescore_vectors (doc_id, embedding) VALUES (?, ?)",
+                list(zip(doc_ids, blobs))
+            )
+        
+        if self.sign_codes:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO sign_codes (doc_id, code) VALUES (?, ?)",
+                [(doc_id, sign_code(deserialize_embedding(blob))) for doc_id, blob in zip(doc_ids, blobs)]
+            )
+        
+        dims = self.ann_centroids.shape[1] if self.ann_centroids is not None else None
+        if dims and all(len(blob) == dims * 4 for blob in blobs):
+            vectors = np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(len(blobs), dims)
+            lists = assign_ann_lists(self.ann_centroids, vectors)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO ivf_assignments (doc_id, list_id) VALUES (?, ?)",
+                [(doc_id, int(list_id)) for doc_id, list_id in zip(doc_ids, lists)]
+            )
+    
+    def _write_completed(self, wait: bool):
+        """Store results of finished requests, oldest first."""
+        while self.in_flight and (wait or self.in_flight[0][1].done()):
+            batch, future = self.in_flight.popleft()
+            try:
+                with metrics_stage("embed_wait"):
+                    embeddings = future.result()
+            except Exception:
+                doc_ids = [doc_id for key, _ in batch for doc_id in self.waiting.get(key, [])]
+                placeholders = ",".join("?" * len(doc_ids))
+                self.failed_files = sorted(row[0] for row in self.conn.execute(
+                    f"SELECT DISTINCT file_path FROM documents WHERE id IN ({placeholders})", doc_ids
+                ))
+                raise
+            self.embedded += len(batch)
+            
+            doc_ids = []
+            blobs = []
+            cache_rows = []
+            now = int(time.time())
+            for (key, _), embedding in zip(batch, embeddings):
+                blob = serialize_embedding(normalize_embedding(embedding))
+                for doc_id in self.waiting.pop(key):
+                    doc_ids.append(doc_id)
+                    blobs.append(blob)
+                cache_rows.append((key, blob, now))
+            
+            self._store(doc_ids, blobs)
+            if self.use_cache:
+                with metrics_stage("write"):
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO embedding_cache (key, embedding, last_used) VALUES (?, ?, ?)",
+                        cache_rows
+                    )
+    
+    def flush(self, force: bool = True):
+        """Send queued chunks; with force=False only full batches are sent.
+        
+        A forced flush also waits for every request in flight.
+        """
+        from concurrent import futures
+        
+        if time.monotonic() - self.last_commit >= self.CHECKPOINT_INTERVAL:
+            force = True
+        
+        while self.pending and (force or len(self.pending) >= self.batch_size):
+            batch = self.pending[:self.batch_size]
+            del self.pending[:len(batch)]
+            # Keep at most two requests per worker outstanding so memory
+            # stays bounded while the pool is saturated
+            while len(self.in_flight) >= self.concurrency * 2:
+                with metrics_stage("embed_wait"):
+                    futures.wait([self.in_flight[0][1]])
+                self._write_completed(wait=False)
+            self._submit(batch)
+        
+        self._write_completed(wait=force)
+        
+        # Commit in large transactions: only when nothing is outstanding, and
+        # at most every COMMIT_INTERVAL seconds until the final flush
+        if (not self.pending and not self.in_flight
+                and (force or time.monotonic() - self.last_commit >= self.COMMIT_INTERVAL)):
+            update_file_vectors(self.conn, sorted(self.files), self.config["embedding"]["dimensions"],
+                                self.precision)
+            self.files.clear()
+            with metrics_stage("commit"):
+                self.conn.commit()
+            self.last_commit = time.monotonic()
+    
+    def discard(self) -> List[str]:
+        """Drop queued chunks and roll back everything not yet committed.
+        
+        Returns the files whose rows were rolled back: every file finished
+        since the last commit.
+        """
+        rolled_back = sorted(self.files)
+        for _, future in self.in_flight:
+            future.cancel()
+        for _, future in self.in_flight:
+            try:
+                future.result()
+            except BaseException:
+                pass
+        self.in_flight.clear()
+        self.pending.clear()
+        self.waiting.clear()
+        self.files.clear()
+        self.failed_files = []
+        self.conn.rollback()
+        return rolled_back
+    
+    def close(self):
+        """Shut down the worker pool."""
+        self.executor.shutdown(wait=True)
+
+
+def record_file_manifest(conn: sqlite3.Connection, path: Path, stat: os.stat_result, digest: str):
+    """Remember the stat signature a file had when it was hashed (caller commits)."""
+    # A file modified again within the filesystem's timestamp granularity
+    # would keep the same mtime, so don't trust very recent mtimes
+    mtime_ns = stat.st_mtime_ns
+    if time.time_ns() - mtime_ns < 2_000_000_000:
+        mtime_ns = -1
+    conn.execute("""
+        INSERT OR REPLACE INTO file_manifest (file_path, size, mtime_ns, inode, file_hash)
+        VALUES (?, ?, ?, ?, ?)
+    """, (str(path), stat.st_size, mtime_ns, stat.st_ino, digest))
+
+
+def start_index_journal(conn: sqlite3.Connection, candidates: List[Tuple[Path, str, os.stat_result]],
+                        failed: List[Tuple[Path, str, str]]):
+    """Replace the journal with this run's files: candidates pending, stat failures failed."""
+    conn.execute("DELETE FROM index_jobs")
+    conn.executemany(
+        "INSERT INTO index_jobs (file_path, doc_type, size, status) VALUES (?, ?, ?, 'pending')",
+        [(str(path), doc_type, stat.st_size) for path, doc_type, stat in candidates]
+    )
+    conn.executemany(
+        "INSERT INTO index_jobs (file_path, doc_type, size, status, error) VALUES (?, ?, 0, 'failed', ?)",
+        [(str(path), doc_type, error) for path, doc_type, error in failed]
+    )
+    conn.commit()
+
+
+def finish_index_job(conn: sqlite3.Connection, path: Path, error: Optional[str] = None):
+    """Mark a journal entry done, or failed with an error (caller commits).
+    
+    Marked in the same transaction as the file's rows, so an entry is only
+    done once the file is fully indexed.
+    """
+    conn.execute(
+        "UPDATE index_jobs SET status = ?, error = ? WHERE file_path = ?",
+        ("failed" if error else "done", error, str(path))
+    )
+
+
+def unfinished_index_jobs(conn: sqlite3.Connection) -> List[Tuple[Path, str]]:
+    """Files the last index run did not finish, pending or failed."""
+    return [(Path(file_path), doc_type) for file_path, doc_type in conn.execute(
+        "SELECT file_path, doc_type FROM index_jobs WHERE status != 'done' ORDER BY file_path"
+    )]
+
+
+def format_bytes(count: float) -> str:
+    """Human-readable byte count."""
+    for unit in ("B", "KB", "MB", "GB"):
+        if count < 1024 or unit == "GB":
+            return f"{count:.0f} {unit}" if unit == "B" else f"{count:.1f} {unit}"
+        count /= 1024
+
+
+def format_duration(seconds: float) -> str:
+    """Duration as 42s, 3m05s or 2h14m."""
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+
+class IndexProgress:
+    """Throughput and remaining time of an index run.
+    
+    Rates are measured from the start of the run; the ETA assumes the
+    remaining bytes go at the same rate.
+    """
+    
+    INTERVAL = 5.0  # seconds between progress lines
+    
+    def __init__(self, total_files: int, total_bytes: int):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self.last_report = self.started
+    
+    def advance(self, size: int):
+        """Count a processed file."""
+        self.files += 1
+        self.bytes += size
+    
+    def due(self) -> bool:
+        """Whether a progress line is due, resetting the interval if so."""
+        now = time.monotonic()
+        if now - self.last_report < self.INTERVAL:
+            return False
+        self.last_report = now
+        return True
+    
+    def rates(self, chunks: int) -> str:
+        """chunks/s and bytes/s so far."""
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return f"{chunks / elapsed:.1f} chunks/s, {format_bytes(self.bytes / elapsed)}/s"
+    
+    def line(self, chunks: int) -> str:
+        """Progress line with counts, rates and ETA."""
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        remaining = max(self.total_bytes - self.bytes, 0)
+        eta = format_duration(remaining * elapsed / self.bytes) if self.bytes else "?"
+        return (f"  ⏱️  {self.files}/{self.total_files} files, {self.rates(chunks)}, ETA {eta}")
+
+
+PREPARE_WINDOW = 4  # prepared files buffered per read worker
+
+
+def chunk_settings(path: Path, config: dict) -> Tuple[int, int, str]:
+    """chunk_size, chunk_overlap and chunker for a file."""
+    return config["embedding"]["chunk_size"], config["embedding"]["chunk_overlap"], file_chunker(path, config)
+
+
+def prepare_file(path: str, known_hash: Optional[str], chunk_size: int, overlap: int,
+                 chunker: str) -> Tuple[str, Optional[str], Optional[List[Dict]], Tuple]:
+    """Read, hash and chunk a file without touching the index; safe to run in a worker process.
+    
+    Returns (status, hash, chunks, timings): "unchanged" when the hash
+    equals `known_hash`, "changed" with the chunks, or "error" with the
+    message in place of the hash. `timings` is (read, hash, chunk seconds,
+    bytes) for record_prepare_metrics, as a worker process can't update
+    METRICS itself.
+    """
+    start = time.perf_counter()
+    try:
+        data = Path(path).read_bytes()
+    except OSError as e:
+        return "error", str(e), None, (time.perf_counter() - start, 0.0, 0.0, 0)
+    read = time.perf_counter()
+    
+    digest = hashlib.md5(data).hexdigest()
+    hashed = time.perf_counter()
+    if digest == known_hash:
+        return "unchanged", digest, None, (read - start, hashed - read, 0.0, len(data))
+    # As Path.read_text(errors="ignore") would decode it, newlines included
+    text = data.decode("utf-8", errors="ignore").replace("\r\n", "\n").replace("\r", "\n")
+    chunks = chunk_text(text, chunk_size, overlap, chunker)
+    return "changed", digest, chunks, (read - start, hashed - read, time.perf_counter() - hashed, len(data))
+
+
+def record_prepare_metrics(status: str, timings: Tuple, chunks: Optional[List[Dict]]):
+    """Add prepare_file's timings to the read, hash and chunk stages."""
+    read, hashed, chunked, size = timings
+    METRICS.add("read", read, size=size, items=1)
+    if status != "error":
+        METRICS.add("hash", hashed, size=size, items=1)
+    if chunks is not None:
+        METRICS.add("chunk", chunked, size=size, items=len(chunks))
+
+
+def prepare_files(candidates: List[Tuple[Path, str, os.stat_result]], known_hashes: Dict[str, str],
+                  config: dict, workers: int):
+    """Yield (path, doc_type, stat, prepare_file result) for candidates, in order.
+    
+    With several workers, files are prepared in a process pool, at most
+    PREPARE_WINDOW per worker ahead of the consumer, so memory stays
+    bounded however far the embedding stage falls behind.
+    """
+    def arguments(path: Path):
+        return (str(path), known_hashes.get(str(path))) + chunk_settings(path, config)
+    
+    if workers <= 1 or len(candidates) < 2:
+        for path, doc_type, stat in candidates:
+            yield path, doc_type, stat, prepare_file(*arguments(path))
+        return
+    
+    from concurrent.futures import ProcessPoolExecutor
+    
+    window = collections.deque()
+    
+    def oldest():
+        path, doc_type, stat, future = window.popleft()
+        try:
+            prepared = future.result()
+        except Exception as e:
+            # A crashed worker or chunker fails this file only
+            prepared = ("error", str(e) or type(e).__name__, None, (0.0, 0.0, 0.0, 0))
+        return path, doc_type, stat, prepared
+    
+    # Workers are all started while the first window is submitted, before
+    # the consumer starts any embedding threads
+    with ProcessPoolExecutor(max_workers=min(workers, len(candidates))) as pool:
+        for path, doc_type, stat in candidates:
+            window.append((path, doc_type, stat, pool.submit(prepare_file, *arguments(path))))
+            if len(window) >= workers * PREPARE_WINDOW:
+                yield oldest()
+        while window:
+            yield oldest()
+
+
+def store_file_chunks(conn: sqlite3.Connection, path: Path, doc_type: str, stat: os.stat_result,
+                      digest: str, chunks: List[Dict], batcher: EmbeddingBatcher):
+    """Replace a file's rows with new chunks and queue their embeddings (caller commits)."""
+    with metrics_stage("write", stat.st_size, len(chunks)):
+        delete_file_rows(conn, [str(path)])
+        bump_index_generation(conn)
+        record_file_manifest(conn, path, stat, digest)
+        
+        # Insert all chunks, then queue their embeddings
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT INTO documents (file_path, chunk_index, content, start_line, end_line, file_hash, doc_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [(str(path), i, chunk["text"], chunk["start_line"], chunk["end_line"], digest, doc_type)
+              for i, chunk in enumerate(chunks)])
+        
+        cursor.execute(
+            "SELECT id FROM documents WHERE file_path = ? ORDER BY chunk_index",
+            (str(path),)
+        )
+        doc_ids = cursor.fetchall()
+    for (doc_id,), chunk in zip(doc_ids, chunks):
+        batcher.add(doc_id, chunk["text"])
+    batcher.finish_file(str(path))
+
+
+def index_file(conn: sqlite3.Connection, path: Path, doc_type: str, config: dict,
+               batcher: Optional[EmbeddingBatcher] = None):
+    """Index a single file.
+    
+    When a batcher is given, chunk embeddings are queued on it and may be sent
+    together with chunks from other files; otherwise they are embedded and
+    committed before returning.
+    """
+    cursor = conn.cursor()
+    
+    # Check if file has changed: unchanged size, mtime and inode since it
+    # was last hashed means it can be skipped without reading it
+    try:
+        stat = path.stat()
+    except OSError as e:
+        print(f"  Error reading {path}: {e}", file=sys.stderr)
+        return False
+    
+    cursor.execute(
+        "SELECT size, mtime_ns, inode FROM file_manifest WHERE file_path = ?",
+        (str(path),)
+    )
+    if cursor.fetchone() == (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+        return False  # No change
+    
+    cursor.execute(
+        "SELECT file_hash FROM documents WHERE file_path = ? LIMIT 1",
+        (str(path),)
+    )
+    row = cursor.fetchone()
+    status, digest, chunks, timings = prepare_file(str(path), row[0] if row else None,
+                                                   *chunk_settings(path, config))
+    record_prepare_metrics(status, timings, chunks)
+    
+    if status == "error":
+        print(f"  Error reading {path}: {digest}", file=sys.stderr)
+        return False
+    if status == "unchanged":
+        record_file_manifest(conn, path, stat, digest)
+        return False  # No change
+    
+    own_batcher = batcher is None
+    if own_batcher:
+        batcher = EmbeddingBatcher(conn, config)
+    
+    store_file_chunks(conn, path, doc_type, stat, digest, chunks, batcher)
+    
+    if own_batcher:
+        try:
+            batcher.flush()
+        finally:
+            batcher.close()
+    return True
+
+
+def build_index(config: dict, verbose: bool = True, rebuild: bool = False, resume: bool = False):
+    """Build or update the search index.
+    
+    Rows of files that no longer exist (or are no longer indexed) are
+    removed; with rebuild=True the index is emptied first.
+    
+    The files to index are journaled in index_jobs, each marked done in
+    the transaction that commits it. If the embedding server stays
+    unreachable through its retries, the run stops, and resume=True later
+    indexes just the files left unfinished, skipping discovery.
+    
+    Indexing is a pipeline: files are discovered (walk_workers threads)
+    and stat-checked against the manifest; changed ones are read, hashed
+    and chunked in `read_workers` processes; chunks are embedded by the
+    batcher's `concurrency` threads; and this thread is the only SQLite
+    writer. Each stage hands over through a bounded buffer, so the run
+    takes about as long as its slowest stage.
+    """
+    # Ensure index directory exists
+    index_dir = Path(".branch-flow/index")
+    index_dir.mkdir(parents=True, exist_ok=True)
+    
+    db_path = index_dir / "search.db"
+    
+    # Ensure model is available
+    if not ensure_model_available(config):
+        return False
+    
+    # Initialize database
+    conn = init_database(db_path, config["embedding"]["dimensions"])
+    configure_bulk_writes(conn)
+    if rebuild:
+        if verbose:
+            print("Rebuilding index from scratch...")
+        reset_index(conn, index_dir)
+    # Rescoring copies come from the float32 vectors before they are narrowed
+    sync_rescore_vectors(conn, config)
+    conn.commit()
+    if migrate_embedding_precision(conn, config["embedding"]["dimensions"],
+                                   config["index"].get("embedding_precision", "float32"), verbose):
+        remove_vector_files(index_dir)
+    batcher = EmbeddingBatcher(conn, config)
+    
+    # Get files to index: the unfinished ones from the journal when resuming
+    files = unfinished_index_jobs(conn) if resume and not rebuild else []
+    resuming = bool(files)
+    if resume and verbose:
+        print("Resuming the last index run..." if resuming else "Nothing to resume, checking all files...")
+    removed = 0
+    if not resuming:
+        with metrics_stage("walk") as frame:
+            files = get_files_to_index(config)
+            frame["items"] = len(files)
+        removed = prune_stale_files(conn, {str(path) for path, _ in files})
+    
+    # New chunk boundaries: re-chunk every file (unchanged chunk texts
+    # still come from the embedding cache)
+    signature = chunking_signature(config)
+    if get_index_meta(conn, "chunking") != signature:
+        if verbose and conn.execute("SELECT 1 FROM documents LIMIT 1").fetchone():
+            print("Chunking settings changed, re-chunking all files...")
+        conn.execute("DELETE FROM file_manifest")
+        conn.execute("UPDATE documents SET file_hash = ''")
+        set_index_meta(conn, "chunking", signature)
+        conn.commit()
+    
+    # Memory, spec and plan files used to be indexed as code first
+    conn.executemany(
+        "UPDATE documents SET doc_type = ? WHERE file_path = ? AND doc_type != ?",
+        [(doc_type, str(path), doc_type) for path, doc_type in files if doc_type != "code"]
+    )
+    conn.commit()
+    
+    # In a git work tree, tracked files that git reports as identical to the
+    # commit of the last run (and weren't dirty then) need no stat at all
+    git_unchanged: Set[str] = set()
+    git_head = None
+    if config["index"].get("use_git") and not resuming:
+        git_head = (run_git("rev-parse", "HEAD") or "").strip() or None
+        git_files = git_ls_files()
+        last_head = get_index_meta(conn, "git_head")
+        changed = git_changed_files(last_head) if last_head and git_files else None
+        if changed is not None:
+            tracked, _ = git_files
+            last_dirty = set(json.loads(get_index_meta(conn, "git_dirty", "[]")))
+            known = {row[0] for row in conn.execute("SELECT file_path FROM file_manifest")}
+            git_unchanged = (known & tracked) - changed - last_dirty
+    
+    if verbose:
+        print(f"Indexing {len(files)} files...")
+    
+    indexed = 0
+    errors = 0
+    
+    # Unchanged size, mtime and inode since a file was last hashed means it
+    # can be skipped without reading it
+    manifest = {
+        file_path: signature for file_path, *signature in
+        conn.execute("SELECT file_path, size, mtime_ns, inode FROM file_manifest")
+    }
+    candidates = []
+    unreadable = []
+    with metrics_stage("stat", items=len(files)):
+        for path, doc_type in files:
+            if str(path) in git_unchanged:
+                continue
+            try:
+                stat = path.stat()
+            except OSError as e:
+                errors += 1
+                unreadable.append((path, doc_type, str(e)))
+                if verbose:
+                    print(f"  {path} ✗ Error: {e}")
+                continue
+            if manifest.get(str(path)) == [stat.st_size, stat.st_mtime_ns, stat.st_ino]:
+                if verbose:
+                    print(f"  {path} (unchanged)")
+                continue
+            candidates.append((path, doc_type, stat))
+    del manifest
+    start_index_journal(conn, candidates, unreadable)
+    
+    progress = IndexProgress(len(candidates), sum(stat.st_size for _, _, stat in candidates))
+    stopped = None
+    known_hashes = dict(conn.execute("SELECT file_path, file_hash FROM documents WHERE chunk_index = 0"))
+    read_workers = int(config["index"].get("read_workers", 0)) or min(4, os.cpu_count() or 1)
+    prepared = prepare_files(candidates, known_hashes, config, read_workers)
+    for path, doc_type, stat, (status, digest, chunks, timings) in prepared:
+        record_prepare_metrics(status, timings, chunks)
+        if verbose:
+            print(f"  {path}", end="", flush=True)
+        
+        try:
+            if status == "error":
+                raise OSError(digest)
+            # Done in the same transaction as the file's rows (the batcher
+            # may commit as the file is finished)
+            finish_index_job(conn, path)
+            if status == "unchanged":
+                record_file_manifest(conn, path, stat, digest)
+            else:
+                store_file_chunks(conn, path, doc_type, stat, digest, chunks, batcher)
+                indexed += 1
+            
+            if verbose:
+                print(" ✓" if status == "changed" else " (unchanged)")
+        except Exception as e:
+            failed = [str(path)]
+            rolled_back = []
+            if status != "error":
+                # The error belongs to the files whose chunks were in the failed
+                # request, which need not include this one. Every file since
+                # the last commit is rolled back; their journal entries are
+                # pending again, for the next run or --resume
+                failed = batcher.failed_files or failed
+                rolled_back = [file_path for file_path in batcher.discard() if file_path != str(path)]
+                indexed -= len(rolled_back)
+            if verbose:
+                print(f" ✗ Error: {e}")
+                if failed != [str(path)] and not is_endpoint_failure(e):
+                    print(f"  ✗ The failed request held chunks of: {', '.join(failed)}")
+                if rolled_back:
+                    print(f"  ↩️  {len(rolled_back)} earlier files of the same batch rolled back (not indexed)")
+            if is_endpoint_failure(e) and status != "error":
+                # Out of retries: the server is down, so every later file would fail too
+                errors += 1
+                stopped = e
+                break
+            errors += len(failed)
+            for file_path in failed:
+                finish_index_job(conn, Path(file_path), str(e))
+            # Continue with next file instead of stopping
+            continue
+        finally:
+            progress.advance(stat.st_size)
+        
+        if verbose and progress.due():
+            print(progress.line(batcher.embedded + batcher.cache_hits))
+    prepared.close()
+    
+    try:
+        batcher.flush()
+    except Exception as e:
+        failed = batcher.failed_files
+        rolled_back = batcher.discard()
+        indexed -= len(rolled_back)
+        if verbose:
+            print(f"  ✗ Error embedding final batch: {e}")
+            print(f"  ↩️  {len(rolled_back)} files of the batch rolled back (not indexed)")
+        if is_endpoint_failure(e):
+            errors += 1
+            stopped = e
+        else:
+            errors += len(failed) or 1
+            for file_path in failed:
+                finish_index_job(conn, Path(file_path), str(e))
+            conn.commit()
+    
+    batcher.close()
+    unfinished = conn.execute("SELECT COUNT(*) FROM index_jobs WHERE status != 'done'").fetchone()[0]
+    
+    # Files indexed before file vectors existed, or by another model
+    if backfill_file_vectors(conn, config["embedding"]["dimensions"], batcher.precision):
+        conn.commit()
+    
+    # Only move the git baseline forward after a clean run, so files that
+    # failed are diffed again next time
+    if git_head and errors == 0:
+        dirty = git_changed_files(git_head)
+        git_files = git_ls_files()
+        if dirty is not None and git_files is not None:
+            set_index_meta(conn, "git_head", git_head)
+            set_index_meta(conn, "git_dirty", json.dumps(sorted(dirty | git_files[1])))
+            conn.commit()
+    
+    prune_embedding_cache(conn, int(config["embedding"].get("cache_max_entries", 100000)))
+    
+    missing = missing_rescore_vectors(conn) if batcher.rescore_copies else 0
+    if missing:
+        print(f"⚠️  {missing} chunks have no full-precision vector, so rescoring keeps their "
+              f"{batcher.precision} scores. Run 'bf-search.py index --rebuild' to re-embed them", file=sys.stderr)
+    
+    if config["index"].get("ann") and np is not None:
+        with metrics_stage("ann"):
+            update_ann_index(conn, config, verbose)
+    elif load_ann_centroids(conn) is not None or np is None:
+        # Disabled (or can't be maintained without NumPy), so drop it
+        # rather than let search use stale lists
+        clear_ann_index(conn)
+        conn.commit()
+        if verbose and config["index"].get("ann"):
+            print("⚠️  The ANN index requires NumPy: pip install numpy")
+    
+    if config["index"].get("binary_codes"):
+        with metrics_stage("sign_codes"):
+            update_sign_codes(conn, config)
+            conn.commit()
+    elif get_index_meta(conn, "sign_codes"):
+        clear_sign_codes(conn)
+        conn.commit()
+    
+    if config["index"].get("vector_file"):
+        with metrics_stage("vector_file"):
+            sync_vector_file(conn, index_dir, config)
+    
+    conn.close()
+    
+    if verbose:
+        if stopped is not None:
+            print(f"\n⏸️  Stopped: the embedding server could not be reached ({getattr(stopped, 'reason', stopped)})")
+        print(f"\n✅ Indexed {indexed} files ({len(files)} total)")
+        if progress.bytes:
+            print(f"⏱️  {format_duration(time.monotonic() - progress.started)} at "
+                  f"{progress.rates(batcher.embedded + batcher.cache_hits)}")
+        if removed:
+            print(f"🗑️  Removed {removed} deleted or excluded files from the index")
+        if batcher.cache_hits:
+            print(f"♻️  Reused {batcher.cache_hits} cached chunk embeddings, embedded {batcher.embedded} new")
+        if config["embedding"].get("endpoints") and batcher.embedded:
+            for endpoint in endpoint_pool(config).summary():
+                state = f" (not used: {endpoint['excluded']})" if endpoint["excluded"] else ""
+                print(f"   {endpoint['url']}: {endpoint['texts']} chunks in {endpoint['requests']} requests{state}")
+        if errors > 0:
+            print(f"⚠️  {errors} files had errors (skipped)")
+        if unfinished:
+            print(f"⏭️  {unfinished} files not indexed, run `bf-search.py index --resume` to retry them")
+    
+    return stopped is None
+
+
+# =============================================================================
+# Search
+# =============================================================================
+
+def parse_since(value: str) -> int:
+    """Parse a --since value into a time in ns: 30m, 12h, 7d, 2w, an ISO date or epoch seconds."""
+    import re
+    from datetime import datetime
+    
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhdw])", value.strip())
+    if match:
+        seconds = float(match.group(1)) * {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}[match.group(2)]
+        return time.time_ns() - int(seconds * 1e9)
+    try:
+        return int(float(value) * 1e9)
+    except ValueError:
+        pass
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1e9)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a duration (7d), date (2024-05-01) or timestamp: {value}")
+
+
+def search_filters(paths=None, dirs=None, exts=None, since=None) -> Optional[Dict]:
+    """Build search filters from option values (a single string is one value); None if there are none."""
+    def as_list(value):
+        return [value] if isinstance(value, str) else list(value or [])
+    
+    filters = {"paths": as_list(paths), "dirs": as_list(dirs), "exts": as_list(exts)}
+    if since is not None:
+        filters["since"] = parse_since(since) if isinstance(since, str) else int(since)
+    filters = {key: value for key, value in filters.items() if value or key == "since"}
+    return filters or None
+
+
+def filter_clause(doc_type: Optional[str] = None, filters: Optional[Dict] = None) -> Tuple[str, List]:
+    """SQL condition on `documents d` for a doc_type and metadata filters ("" if none).
+    
+    filters: "paths" (globs, where * also matches /), "dirs" (directory
+    prefixes), "exts" (file extensions) and "since" (ns; files whose
+    recorded mtime is older are excluded). Each list is ORed; the kinds
+    are ANDed.
+    """
+    conditions = []
+    params: List = []
+    if doc_type:
+        conditions.append("d.doc_type = ?")
+        params.append(doc_type)
+    
+    filters = filters or {}
+    dirs = [d.strip("/") for d in filters.get("dirs") or [] if d.strip("/") not in ("", ".")]
+    if dirs:
+        # A range on file_path can use its index: "dir/" <= path < "dir0"
+        conditions.append("(" + " OR ".join("(d.file_path >= ? AND d.file_path < ?)" for _ in dirs) + ")")
+        for prefix in dirs:
+            params.extend([f"{prefix}/", f"{prefix}0"])
+    if filters.get("paths"):
+        conditions.append("(" + " OR ".join("d.file_path GLOB ?" for _ in filters["paths"]) + ")")
+        params.extend(filters["paths"])
+    if filters.get("exts"):
+        exts = ["." + ext.lstrip(".") for ext in filters["exts"]]
+        conditions.append("(" + " OR ".join("d.file_path LIKE ? ESCAPE '\\'" for _ in exts) + ")")
+        params.extend("%" + ext.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") for ext in exts)
+    if filters.get("since") is not None:
+        # mtime_ns < 0 marks files modified within the racy window, i.e. just now
+        conditions.append("d.file_path IN (SELECT file_path FROM file_manifest WHERE mtime_ns >= ? OR mtime_ns < 0)")
+        params.append(int(filters["since"]))
+    return " AND ".join(conditions), params
+
+
+def filtered_doc_ids(conn: sqlite3.Connection, filters: Optional[Dict] = None):
+    """Doc ids matching the metadata filters (as a NumPy array with NumPy), or None if unfiltered."""
+    clause, params = filter_clause(None, filters)
+    if not clause:
+        return None
+    doc_ids = [row[0] for row in conn.execute(f"SELECT d.id FROM documents d WHERE {clause}", params)]
+    return np.array(doc_ids, dtype=np.int64) if np is not None else set(doc_ids)
+
+
+@timed("score")
+def top_k_matrix(ids, matrix, query_embedding: List[float], limit: int, mask=None) -> List[Tuple[int, float]]:
+    """Score rows of a normalized embedding matrix against a query and keep the top `limit`.
+    
+    Float16 matrices are upcast block by block so a memory-mapped file is
+    never copied whole. Rows where `mask` is False are skipped; a mask that
+    keeps at most half the rows is applied before scoring, so only those
+    rows are read.
+    """
+    if len(ids) == 0 or limit <= 0:
+        return []
+    
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norm = np.linalg.norm(query)
+    if norm == 0:
+        return []
+    query /= norm
+    
+    candidates = None
+    if mask is not None:
+        candidates = np.flatnonzero(mask)
+        if len(candidates) == 0:
+            return []
+        if len(candidates) <= len(ids) // 2:
+            # Selective filter: read and score only the matching rows
+            ids, matrix, candidates = ids[candidates], matrix[candidates], None
+    
+    if matrix.dtype == np.float32:
+        scores = matrix @ query
+    else:
+        block = 65536
+        scores = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), block):
+            scores[start:start + block] = matrix[start:start + block].astype(np.float32) @ query
+    
+    if candidates is not None:
+        scores = scores[candidates]
+    
+    # Partial selection of the top `limit`, then sort only those
+    if limit < len(scores):
+        top = np.argpartition(scores, -limit)[-limit:]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.argsort(scores[top])[::-1]]
+    rows = candidates[top] if candidates is not None else top
+    return [(int(ids[row]), float(score)) for row, score in zip(rows, scores[top])]
+
+
+def score_numpy(rows: List[Tuple[int, bytes]], query_embedding: List[float], limit: int,
+                precision: str = "float32") -> List[Tuple[int, float]]:
+    """Score normalized embeddings with one matrix-vector product and keep the top `limit`."""
+    if not rows:
+        return []
+    
+    ids = np.fromiter((doc_id for doc_id, _ in rows), dtype=np.int64, count=len(rows))
+    matrix = decode_embedding_matrix([blob for _, blob in rows], len(query_embedding), precision)
+    return top_k_matrix(ids, matrix, query_embedding, limit)
+
+
+def score_vector_file(conn: sqlite3.Connection, config: dict, query_embedding: List[float], limit: int,
+                      doc_type: Optional[str] = None, filters: Optional[Dict] = None
+                      ) -> Optional[List[Tuple[int, float]]]:
+    """Score against the memory-mapped vector file partitions, or None if they can't be used.
+    
+    Only the doc_type's partition is mapped when one is given.
+    """
+    import heapq
+    
+    partitions = []
+    for partition_type in ([doc_type] if doc_type else DOC_TYPES):
+        loaded = load_vector_file(conn, Path(".branch-flow/index"), config, partition_type)
+        if loaded is None or loaded[1].shape[1] != len(query_embedding):
+            return None
+        partitions.append(loaded)
+    
+    allowed = filtered_doc_ids(conn, filters)
+    scored = []
+    for ids, matrix in partitions:
+        mask = ids >= 0
+        if allowed is not None:
+            mask &= np.isin(ids, allowed)
+        scored.extend(top_k_matrix(ids, matrix, query_embedding, limit, mask))
+    return heapq.nlargest(limit, scored, key=lambda item: item[1])
+
+
+@timed("score")
+def score_python(rows: List[Tuple[int, bytes]], query_embedding: List[float], limit: int,
+                 precision: str = "float32") -> List[Tuple[int, float]]:
+    """Pure Python fallback for score_numpy (its time includes reading and decoding rows)."""
+    import heapq
+    
+    scored = (
+        (doc_id, cosine_similarity(query_embedding, deserialize_embedding(blob, precision)))
+        for doc_id, blob in rows
+    )
+    return heapq.nlargest(limit, scored, key=lambda item: item[1])
+
+
+@timed("hydrate")
+def hydrate_results(conn: sqlite3.Connection, scored: List[Tuple[int, float]]) -> List[Dict]:
+    """Load document fields for scored doc ids, preserving score order."""
+    if not scored:
+        return []
+    
+    placeholders = ",".join("?" * len(scored))
+    cursor = conn.execute(f"""
+        SELECT id, file_path, content, start_line, end_line, doc_type
+        FROM documents WHERE id IN ({placeholders})
+    """, [doc_id for doc_id, _ in scored])
+    documents = {row[0]: row for row in cursor.fetchall()}
+    
+    results = []
+    for doc_id, similarity in scored:
+        if doc_id not in documents:
+            continue
+        _, file_path, content, start_line, end_line, dtype = documents[doc_id]
+        results.append({
+            "file_path": file_path,
+            "content": content,
+            "start_line": start_line,
+            "end_line": end_line,
+            "doc_type": dtype,
+            "similarity": similarity
+        })
+    return results
+
+
+def score_embeddings(conn: sqlite3.Connection, query_embedding: List[float], limit: int,
+                     doc_type: Optional[str] = None, precision: str = "float32",
+                     filters: Optional[Dict] = None, batch: int = 4096) -> List[Tuple[int, float]]:
+    """Exact scan of the embeddings table.
+    
+    Rows are streamed `batch` at a time and only the running top `limit`
+    is kept, so memory does not grow with the index.
+    """
+    import heapq
+    
+    # Only ids and vectors are loaded for scoring; vectors from a different
+    # model (not yet re-indexed) are skipped by their byte length
+    sql = """
+        SELECT d.id, e.embedding
+        FROM documents d
+        JOIN embeddings e ON d.id = e.doc_id
+        WHERE length(e.embedding) = ?
+    """
+    params = [embedding_blob_size(len(query_embedding), precision)]
+    clause, clause_params = filter_clause(doc_type, filters)
+    if clause:
+        sql += f" AND {clause}"
+        params.extend(clause_params)
+    
+    cursor = conn.execute(sql, params)
+    
+    if np is None:
+        # score_python consumes the cursor lazily
+        return score_python(cursor, query_embedding, limit, precision)
+    
+    top: List[Tuple[int, float]] = []
+    while True:
+        with metrics_stage("load") as frame:
+            rows = cursor.fetchmany(max(1, batch))
+            frame.update(size=sum(len(blob) for _, blob in rows), items=len(rows))
+        if not rows:
+            return top
+        scored = score_numpy(rows, query_embedding, limit, precision)
+        top = heapq.nlargest(limit, top + scored, key=lambda item: item[1])
+
+
+SEARCH_MODES = ("semantic", "lexical", "hybrid")
+HYBRID_DEPTH = 50  # results taken from each ranking before fusion
+RRF_K = 60  # reciprocal rank fusion constant
+
+
+def fts_query(query: str) -> str:
+    """Turn free text into an FTS5 query: each term (or "quoted phrase") as a phrase, ORed.
+    
+    Phrases are tokenized like the index, so an identifier such as
+    get_embedding matches the adjacent tokens get, embedding.
+    """
+    import re
+    
+    terms = []
+    for term in re.findall(r'"[^"]+"|\S+', query):
+        term = term.replace('"', " ").strip()
+        if re.search(r"\w", term):
+            terms.append(f'"{term}"')
+    return " OR ".join(terms)
+
+
+@timed("lexical")
+def lexical_scores(conn: sqlite3.Connection, query: str, limit: int, doc_type: Optional[str] = None,
+                   filters: Optional[Dict] = None) -> Optional[List[Tuple[int, float]]]:
+    """BM25 ranking from the full-text index, or None if it is unavailable."""
+    match = fts_query(query)
+    if not match:
+        return []
+    
+    sql = "SELECT rowid, bm25(documents_fts) AS rank FROM documents_fts WHERE documents_fts MATCH ?"
+    params = [match]
+    clause, clause_params = filter_clause(doc_type, filters)
+    if clause:
+        sql += f" AND rowid IN (SELECT d.id FROM documents d WHERE {clause})"
+        params.extend(clause_params)
+    sql += " ORDER BY rank LIMIT ?"
+    params.append(limit)
+    
+    try:
+        # bm25() is lower for better matches
+        return [(doc_id, -rank) for doc_id, rank in conn.execute(sql, params)]
+    except sqlite3.OperationalError:
+        return None
+
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[int, float]]], limit: int) -> List[Tuple[int, float]]:
+    """Merge rankings by summing 1 / (RRF_K + rank) for each document."""
+    import heapq
+    
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking, 1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (RRF_K + rank)
+    return heapq.nlargest(limit, fused.items(), key=lambda item: item[1])
+
+
+def score_doc_ids(conn: sqlite3.Connection, query_embedding: List[float], limit: int,
+                  doc_ids: List[int], precision: str = "float32") -> List[Tuple[int, float]]:
+    """Score only the given chunks."""
+    size = embedding_blob_size(len(query_embedding), precision)
+    rows = [(doc_id, blob) for doc_id, blob in iter_embedding_rows(conn, sorted(doc_ids)) if len(blob) == size]
+    if np is not None:
+        return score_numpy(rows, query_embedding, limit, precision)
+    return score_python(rows, query_embedding, limit, precision)
+
+
+def semantic_scores(conn: sqlite3.Connection, config: dict, query_embedding: List[float], limit: int,
+                    doc_type: Optional[str] = None, nprobe: int = 0, shortlist: int = 0,
+                    doc_ids: Optional[List[int]] = None, filters: Optional[Dict] = None
+                    ) -> List[Tuple[int, float]]:
+    """Rank chunks by cosine similarity with the fastest available scan.
+    
+    `doc_ids` restricts scoring to those chunks (the lexical prefilter,
+    already filtered); otherwise doc_type and `filters` are applied by
+    each scan before any vector is scored.
+    """
+    precision = get_embedding_precision(conn)
+    candidates = limit
+    if precision != "float32":
+        candidates = max(limit, int(config["index"].get("rescore_candidates", 0)))
+    
+    scored = None
+    if doc_ids is not None:
+        scored = score_doc_ids(conn, query_embedding, candidates, doc_ids, precision)
+    if scored is None and nprobe > 0 and np is not None:
+        scored = score_ivf(conn, query_embedding, candidates, nprobe, doc_type, filters)
+    if scored is None and shortlist > 0:
+        scored = score_sign_codes(conn, query_embedding, candidates, shortlist, doc_type, filters)
+    if scored is None and config["index"].get("vector_file"):
+        scored = score_vector_file(conn, config, query_embedding, candidates, doc_type, filters)
+    if scored is None:
+        scored = score_embeddings(conn, query_embedding, candidates, doc_type, precision, filters,
+                                  int(config["index"].get("scan_batch", 4096)))
+    
+    if candidates > limit:
+        scored = rescore_candidates(conn, config, query_embedding, scored, limit)
+    return scored
+
+
+def search(query: str, config: dict, limit: int = 10, doc_type: Optional[str] = None,
+           nprobe: Optional[int] = None, stats: Optional[Dict] = None,
+           shortlist: Optional[int] = None, mode: Optional[str] = None,
+           prefilter: Optional[int] = None, filters: Optional[Dict] = None) -> List[Dict]:
+    """Search the index for relevant documents.
+    
+    Results can be restricted by `doc_type` and by path, directory,
+    extension and modification time `filters` (see filter_clause); these
+    are applied before scoring.
+    
+    `mode` is semantic (embeddings), lexical (BM25 over the full-text
+    index, no embedding server needed) or hybrid (both, merged by
+    reciprocal rank fusion); the default is `search_mode`. With
+    `prefilter` > 0, only the top full-text matches are scored by vector.
+    
+    With an ANN index, only the `nprobe` nearest IVF lists are scanned
+    (default `ann_nprobe` when the index is enabled); nprobe=0 forces an
+    exact scan. With sign codes, the `shortlist` chunks nearest in Hamming
+    distance (default `binary_shortlist`; 0 disables the prefilter) are
+    scored exactly. A float16/int8 index is scanned for `rescore_candidates`
+    results, which are re-ranked at full precision. Query cache counters
+    are written to `stats` if given.
+    """
+    db_path = Path(".branch-flow/index/search.db")
+    
+    if not db_path.exists():
+        print("Index not found. Run: /bf:index", file=sys.stderr)
+        return []
+    
+    conn = sqlite3.connect(db_path)
+    
+    if get_index_meta(conn, "normalized") != "1":
+        init_database(db_path, config["embedding"]["dimensions"]).close()
+    
+    index_config = config["index"]
+    mode = mode or index_config.get("search_mode", "semantic")
+    if prefilter is None:
+        prefilter = int(index_config.get("lexical_prefilter", 0))
+    
+    lexical = None
+    if mode != "semantic" or prefilter > 0:
+        lexical = lexical_scores(conn, query, max(limit, HYBRID_DEPTH, prefilter), doc_type, filters)
+        if lexical is None and mode == "lexical":
+            print("Full-text index not available. Run: /bf:index (requires SQLite with FTS5)", file=sys.stderr)
+            conn.close()
+            return []
+    
+    if mode == "lexical":
+        scored = lexical[:limit]
+    else:
+        # Get query embedding
+        query_embedding = get_query_embedding(conn, query, config, stats)
+        
+        if nprobe is None:
+            nprobe = int(index_config.get("ann_nprobe", 8)) if index_config.get("ann") else 0
+        if shortlist is None:
+            shortlist = int(index_config.get("binary_shortlist", 200)) if index_config.get("binary_codes") else 0
+        
+        # Too few full-text matches to fill the results: scan everything
+        doc_ids = None
+        if prefilter > 0 and lexical and len(lexical) >= limit:
+            doc_ids = [doc_id for doc_id, _ in lexical[:prefilter]]
+        
+        depth = max(limit, HYBRID_DEPTH) if mode == "hybrid" else limit
+        scored = semantic_scores(conn, config, query_embedding, depth, doc_type, nprobe, shortlist,
+                                 doc_ids, filters)
+        if mode == "hybrid" and lexical is not None:
+            scored = reciprocal_rank_fusion([scored, lexical], limit)
+        scored = scored[:limit]
+    
+    results = hydrate_results(conn, scored)
+    conn.close()
+    return results
+
+
+def iter_vector_blocks(conn: sqlite3.Connection, config: dict, dims: int, precision: str, batch: int):
+    """Yield (ids, doc_types, matrix) blocks covering every stored vector once.
+    
+    Blocks come from the vector file partitions when they are all current,
+    otherwise they are streamed from search.db. Dead vector file rows have
+    negative ids.
+    """
+    if config["index"].get("vector_file") and np is not None:
+        partitions = [
+            (doc_type, load_vector_file(conn, Path(".branch-flow/index"), config, doc_type))
+            for doc_type in DOC_TYPES
+        ]
+        if all(loaded is not None and loaded[1].shape[1] == dims for _, loaded in partitions):
+            for doc_type, (ids, matrix) in partitions:
+                for start in range(0, len(ids), batch):
+                    block_ids = np.asarray(ids[start:start + batch])
+                    yield block_ids, np.full(len(block_ids), doc_type, dtype=object), matrix[start:start + batch]
+            return
+    
+    cursor = conn.execute("""
+        SELECT d.id, d.doc_type, e.embedding
+        FROM documents d
+        JOIN embeddings e ON d.id = e.doc_id
+        WHERE length(e.embedding) = ?
+    """, (embedding_blob_size(dims, precision),))
+    while True:
+        rows = cursor.fetchmany(batch)
+        if not rows:
+            return
+        if np is None:
+            yield rows
+            continue
+        yield (np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)),
+               np.array([row[1] for row in rows], dtype=object),
+               decode_embedding_matrix([row[2] for row in rows], dims, precision))
+
+
+def score_query_batch(conn: sqlite3.Connection, config: dict, query_embeddings: List[List[float]],
+                      limits: List[int], doc_types: List[Optional[str]], allowed: List,
+                      precision: str) -> List[List[Tuple[int, float]]]:
+    """Exact top `limits[i]` for each query in one pass over the index.
+    
+    Each block of vectors is scored against all queries with one
+    matrix-matrix product; `doc_types` and `allowed` (doc ids from
+    filtered_doc_ids, or None) mask the scores per query.
+    """
+    import heapq
+    
+    dims = len(query_embeddings[0])
+    batch = max(1, int(config["index"].get("scan_batch", 4096)))
+    
+    if np is None:
+        queries = [normalize_embedding(embedding) for embedding in query_embeddings]
+        heaps: List[List[Tuple[float, int]]] = [[] for _ in queries]
+        for rows in iter_vector_blocks(conn, config, dims, precision, batch):
+            for doc_id, doc_type, blob in rows:
+                vector = None
+                for i, query in enumerate(queries):
+                    if limits[i] <= 0 or (doc_types[i] and doc_type != doc_types[i]):
+                        continue
+                    if allowed[i] is not None and doc_id not in allowed[i]:
+                        continue
+                    if vector is None:
+                        vector = deserialize_embedding(blob, precision)
+                    item = (sum(a * b for a, b in zip(query, vector)), doc_id)
+                    if len(heaps[i]) < limits[i]:
+                        heapq.heappush(heaps[i], item)
+                    elif item > heaps[i][0]:
+                        heapq.heapreplace(heaps[i], item)
+        return [[(doc_id, score) for score, doc_id in sorted(heap, reverse=True)] for heap in heaps]
+    
+    queries = np.asarray(query_embeddings, dtype=np.float32)
+    norms = np.linalg.norm(queries, axis=1, keepdims=True)
+    queries /= np.where(norms == 0, 1, norms)
+    tops: List[List[Tuple[int, float]]] = [[] for _ in query_embeddings]
+    for ids, types, matrix in iter_vector_blocks(conn, config, dims, precision, batch):
+        scores = np.asarray(matrix, dtype=np.float32) @ queries.T
+        live = ids >= 0
+        for i in range(len(query_embeddings)):
+            mask = live
+            if doc_types[i]:
+                mask = mask & (types == doc_types[i])
+            if allowed[i] is not None:
+                mask = mask & np.isin(ids, allowed[i])
+            rows = np.flatnonzero(mask)
+            if len(rows) == 0:
+                continue
+            column = scores[rows, i]
+            if limits[i] < len(rows):
+                best = np.argpartition(column, -limits[i])[-limits[i]:]
+            else:
+                best = np.arange(len(rows))
+            tops[i] = heapq.nlargest(
+                limits[i], tops[i] + [(int(ids[rows[j]]), float(column[j])) for j in best],
+                key=lambda item: item[1]
+            )
+    return tops
+
+
+def search_batch(requests: List[Dict], config: dict, limit: int = 10, doc_type: Optional[str] = None,
+                 mode: Optional[str] = None, filters: Optional[Dict] = None,
+                 stats: Optional[Dict] = None) -> List[Dict]:
+    """Run many searches with batched query embedding and a single scan of the index.
+    
+    Each request has a "query" and optionally an "id" (echoed back),
+    "doc_type" (or "type"), "limit", "mode" and path/dir/ext/since filters
+    overriding the defaults given here. Returns one record per request with
+    its "results", or an "error". Semantic scores are always exact: the
+    ANN and sign-code prefilters are not used, as one pass serves every
+    query anyway.
+    """
+    db_path = Path(".branch-flow/index/search.db")
+    if not db_path.exists():
+        print("Index not found. Run: /bf:index", file=sys.stderr)
+        return []
+    
+    conn = sqlite3.connect(db_path)
+    if get_index_meta(conn, "normalized") != "1":
+        init_database(db_path, config["embedding"]["dimensions"]).close()
+    
+    default_mode = mode or config["index"].get("search_mode", "semantic")
+    records = []
+    jobs = []  # (record, query, limit, doc_type, mode, filters)
+    for request in requests:
+        record = {"id": request["id"]} if "id" in request else {}
+        records.append(record)
+        try:
+            query = request["query"]
+            if not isinstance(query, str):
+                raise ValueError("query must be a string")
+            request_type = request.get("doc_type", request.get("type", doc_type))
+            if request_type is not None and request_type not in DOC_TYPES:
+                raise ValueError(f"unknown doc_type: {request_type}")
+            request_mode = request.get("mode") or default_mode
+            if request_mode not in SEARCH_MODES:
+                raise ValueError(f"unknown mode: {request_mode}")
+            request_filters = filters
+            if any(key in request for key in ("path", "dir", "ext", "since")):
+                request_filters = search_filters(request.get("path"), request.get("dir"),
+                                                 request.get("ext"), request.get("since"))
+            jobs.append((record, query, int(request.get("limit", limit)), request_type, request_mode,
+                         request_filters))
+            record["query"] = query
+        except (KeyError, ValueError, TypeError, argparse.ArgumentTypeError) as e:
+            record["error"] = f"missing {e}" if isinstance(e, KeyError) else str(e)
+    
+    precision = get_embedding_precision(conn)
+    dims = config["embedding"]["dimensions"]
+    semantic = [i for i, job in enumerate(jobs) if job[4] != "lexical"]
+    semantic_results: Dict[int, List[Tuple[int, float]]] = {}
+    if semantic:
+        query_embeddings = get_query_embeddings(conn, [jobs[i][1] for i in semantic], config, stats)
+        scan = [(i, embedding) for i, embedding in zip(semantic, query_embeddings) if len(embedding) == dims]
+        
+        # Filtered doc ids are looked up once per distinct filter set
+        allowed_by_filters: Dict[str, object] = {}
+        depths, allowed = [], []
+        for i, _ in scan:
+            _, _, job_limit, _, job_mode, job_filters = jobs[i]
+            key = json.dumps(job_filters, sort_keys=True)
+            if key not in allowed_by_filters:
+                allowed_by_filters[key] = filtered_doc_ids(conn, job_filters)
+            allowed.append(allowed_by_filters[key])
+            depths.append(max(job_limit, HYBRID_DEPTH) if job_mode == "hybrid" else job_limit)
+        
+        candidates = depths
+        if precision != "float32":
+            rescore = int(config["index"].get("rescore_candidates", 0))
+            candidates = [max(depth, rescore) for depth in depths]
+        if scan:
+            scored = score_query_batch(conn, config, [embedding for _, embedding in scan], candidates,
+                                       [jobs[i][3] for i, _ in scan], allowed, precision)
+            for (i, embedding), results, depth, count in zip(scan, scored, depths, candidates):
+                if count > depth:
+                    results = rescore_candidates(conn, config, embedding, results, depth)
+                semantic_results[i] = results
+    
+    for i, (record, query, job_limit, job_type, job_mode, job_filters) in enumerate(jobs):
+        lexical = None
+        if job_mode != "semantic":
+            lexical = lexical_scores(conn, query, max(job_limit, HYBRID_DEPTH), job_type, job_filters)
+            if lexical is None and job_mode == "lexical":
+                record["error"] = "Full-text index not available"
+                continue
+        if job_mode == "lexical":
+            scored = lexical
+        else:
+            scored = semantic_results.get(i, [])
+            if job_mode == "hybrid" and lexical is not None:
+                scored = reciprocal_rank_fusion([scored, lexical], job_limit)
+        record["results"] = hydrate_results(conn, scored[:job_limit])
+    
+    conn.close()
+    return records
+
+
+def find_similar(file_path: str, config: dict, limit: int = 10,
+                 stats: Optional[Dict] = None) -> List[Dict]:
+    """Find files similar to the given file.
+    
+    An indexed file is compared by its file vector, without contacting the
+    embedding server. Other files fall back to searching with their first
+    `chunk_size` characters.
+    """
+    path = Path(file_path)
+    
+    if not path.exists():
+        print(f"File not found: {file_path}", file=sys.stderr)
+        return []
+    
+    db_path = Path(".branch-flow/index/search.db")
+    if db_path.exists():
+        conn = sqlite3.connect(db_path)
+        try:
+            results = similar_files(conn, config, index_path(file_path), limit)
+        finally:
+            conn.close()
+        if results is not None:
+            return results
+    
+    content = path.read_text(encoding='utf-8', errors='ignore')
+    
+    # Use file content as query
+    return search(content[:config["embedding"]["chunk_size"]], config, limit + 1, stats=stats)
+
+
+# =============================================================================
+# File Vectors
+# =============================================================================
+
+# Each indexed file has a vector: the normalized mean of its normalized chunk
+# vectors, stored as float32 in file_vectors. The batcher recomputes it when
+# it commits a re-indexed file, so `similar` and the near-duplicate report
+# read stored vectors only.
+DUPLICATE_THRESHOLD = 0.95
+DUPLICATE_BLOCK = 2048  # files per side of each block of the all-pairs product
+
+
+def index_path(file_path: str) -> str:
+    """The path a file is stored under in the index (relative to the project root)."""
+    return os.path.relpath(os.path.abspath(file_path))
+
+
+def mean_vector(blobs: List[bytes], dims: int, precision: str) -> List[float]:
+    """Normalized mean of stored (normalized) chunk vectors."""
+    if np is not None:
+        return normalize_embedding(decode_embedding_matrix(blobs, dims, precision).mean(axis=0).tolist())
+    total = [0.0] * dims
+    for blob in blobs:
+        for i, value in enumerate(deserialize_embedding(blob, precision)):
+            total[i] += value
+    return normalize_embedding(total)
+
+
+@timed("file_vectors")
+def update_file_vectors(conn: sqlite3.Connection, file_paths: List[str], dims: int, precision: str):
+    """Recompute the file vectors of files from their chunk embeddings (caller commits)."""
+    for file_path in file_paths:
+        blobs = [row[0] for row in conn.execute("""
+            SELECT e.embedding FROM documents d JOIN embeddings e ON d.id = e.doc_id
+            WHERE d.file_path = ? AND length(e.embedding) = ?
+        """, (file_path, embedding_blob_size(dims, precision)))]
+        if not blobs:
+            conn.execute("DELETE FROM file_vectors WHERE file_path = ?", (file_path,))
+            continue
+        conn.execute(
+            "INSERT OR REPLACE INTO file_vectors (file_path, chunks, embedding) VALUES (?, ?, ?)",
+            (file_path, len(blobs), serialize_embedding(mean_vector(blobs, dims, precision)))
+        )
+
+
+def backfill_file_vectors(conn: sqlite3.Connection, dims: int, precision: str) -> int:
+    """Compute missing or wrong-sized file vectors; returns how many (caller commits)."""
+    missing = [row[0] for row in conn.execute("""
+        SELECT DISTINCT file_path FROM documents WHERE file_path NOT IN (
+            SELECT file_path FROM file_vectors WHERE length(embedding) = ?
+        )
+    """, (dims * 4,))]
+    update_file_vectors(conn, missing, dims, precision)
+    return len(missing)
+
+
+def similar_files(conn: sqlite3.Connection, config: dict, file_path: str, limit: int = 10) -> Optional[List[Dict]]:
+    """Files nearest to an indexed file by file vector, or None if it has no vector.
+    
+    Each result carries the other file's chunk closest to this file's
+    vector as its content and line range.
+    """
+    dims = config["embedding"]["dimensions"]
+    try:
+        row = conn.execute(
+            "SELECT embedding FROM file_vectors WHERE file_path = ? AND length(embedding) = ?",
+            (file_path, dims * 4)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None  # index created before file vectors existed
+    if row is None:
+        return None
+    
+    query = deserialize_embedding(row[0])
+    rows = conn.execute(
+        "SELECT rowid, embedding FROM file_vectors WHERE file_path != ? AND length(embedding) = ?",
+        (file_path, dims * 4)
+    )
+    scored = score_numpy(rows.fetchall(), query, limit) if np is not None else score_python(rows, query, limit)
+    
+    precision = get_embedding_precision(conn)
+    results = []
+    for rowid, similarity in scored:
+        (other_path,) = conn.execute("SELECT file_path FROM file_vectors WHERE rowid = ?", (rowid,)).fetchone()
+        chunks = conn.execute("""
+            SELECT d.id, e.embedding FROM documents d JOIN embeddings e ON d.id = e.doc_id
+            WHERE d.file_path = ? AND length(e.embedding) = ?
+        """, (other_path, embedding_blob_size(dims, precision))).fetchall()
+        best = score_python(chunks, query, 1, precision)
+        for result in hydrate_results(conn, best):
+            result["similarity"] = similarity
+            results.append(result)
+    return results
+
+
+def duplicate_clusters(conn: sqlite3.Connection, config: dict,
+                       threshold: float = DUPLICATE_THRESHOLD) -> List[Dict]:
+    """Group files whose file vectors have cosine similarity >= threshold.
+    
+    Pairs are found with a blocked matrix product over the upper triangle,
+    so memory stays at DUPLICATE_BLOCK² scores; clusters are the connected
+    components of those pairs, largest (then closest) first.
+    """
+    dims = config["embedding"]["dimensions"]
+    rows = conn.execute(
+        "SELECT file_path, embedding FROM file_vectors WHERE length(embedding) = ? ORDER BY file_path",
+        (dims * 4,)
+    ).fetchall()
+    paths = [file_path for file_path, _ in rows]
+    
+    pairs = []
+    if np is not None and rows:
+        matrix = decode_embedding_matrix([blob for _, blob in rows], dims)
+        block = DUPLICATE_BLOCK
+        for start in range(0, len(paths), block):
+            left = matrix[start:start + block]
+            for other in range(start, len(paths), block):
+                scores = left @ matrix[other:other + block].T
+                for i, j in zip(*np.nonzero(scores >= threshold)):
+                    if other + j > start + i:
+                        pairs.append((start + i, other + j, float(scores[i, j])))
+    else:
+        vectors = [deserialize_embedding(blob) for _, blob in rows]
+        for i, a in enumerate(vectors):
+            for j in range(i + 1, len(vectors)):
+                similarity = sum(x * y for x, y in zip(a, vectors[j]))
+                if similarity >= threshold:
+                    pairs.append((i, j, similarity))
+    
+    # Union-find over the pairs
+    parent = list(range(len(paths)))
+    
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    for i, j, _ in pairs:
+        parent[find(i)] = find(j)
     
-    # Check file size
-    try:
-        size_kb = path.stat().st_size / 1024
-        if size_kb > config["index"]["max_file_size_kb"]:
-            return False
-    except OSError:
-        return False
+    clusters: Dict[int, Dict] = {}
+    for i, j, similarity in pairs:
+        cluster = clusters.setdefault(find(i), {"files": set(), "pairs": []})
+        cluster["files"].update((paths[i], paths[j]))
+        cluster["pairs"].append({"a": paths[int(i)], "b": paths[int(j)], "similarity": similarity})
     
-    return True
+    result = []
+    for cluster in clusters.values():
+        cluster["pairs"].sort(key=lambda pair: pair["similarity"], reverse=True)
+        result.append({"files": sorted(cluster["files"]), "pairs": cluster["pairs"]})
+    result.sort(key=lambda cluster: (-len(cluster["files"]), -cluster["pairs"][0]["similarity"]))
+    return result
 
 
-def get_files_to_index(config: dict) -> List[Tuple[Path, str]]:
-    """Get list of files to index with their types."""
-    files = []
-    root = Path(".")
+# =============================================================================
+# Search Daemon
+# =============================================================================
+
+DAEMON_SOCKET = Path(".branch-flow/index/search.sock")
+
+
+class VectorPartition:
+    """The in-memory vectors of one doc_type, with incremental add and remove.
     
-    # Index codebase
-    if config["index"]["index_codebase"]:
-        for path in root.rglob("*"):
-            if path.is_file() and should_index_file(path, config):
-                files.append((path, "code"))
+    Removed rows are masked out and compacted away once they pass
+    VECTOR_COMPACT_RATIO. Without NumPy, vectors are kept as stored blobs.
+    """
     
-    # Index memory
-    if config["index"]["index_memory"]:
-        memory_dir = root / ".branch-flow" / "memory"
-        if memory_dir.exists():
-            for path in memory_dir.glob("*.md"):
-                files.append((path, "memory"))
+    def __init__(self, dims: int):
+        self.dims = dims
+        self.positions: Dict[int, int] = {}  # doc_id -> row
+        self.size = 0
+        self.dead = 0
+        if np is not None:
+            self.ids = np.empty(0, dtype=np.int64)
+            self.matrix = np.empty((0, dims), dtype=np.float32)
+            self.live = np.empty(0, dtype=bool)
+        else:
+            self.rows: Dict[int, bytes] = {}
     
-    # Index specs
-    if config["index"]["index_specs"]:
-        specs_dir = root / ".branch-flow" / "specs"
-        if specs_dir.exists():
-            for path in specs_dir.glob("*.md"):
-                files.append((path, "spec"))
+    def __len__(self):
+        return len(self.positions) if np is not None else len(self.rows)
+    
+    def remove(self, doc_ids: Set[int]):
+        if np is None:
+            for doc_id in doc_ids:
+                self.rows.pop(doc_id, None)
+            return
         
-        plans_dir = root / ".branch-flow" / "plans"
-        if plans_dir.exists():
-            for path in plans_dir.glob("*.md"):
-                files.append((path, "plan"))
+        for doc_id in doc_ids:
+            self.live[self.positions.pop(doc_id)] = False
+        self.dead += len(doc_ids)
+        
+        if self.dead > VECTOR_COMPACT_RATIO * max(1, self.size):
+            keep = np.flatnonzero(self.live[:self.size])
+            self.ids = self.ids[keep]
+            self.matrix = self.matrix[keep]
+            self.live = np.ones(len(keep), dtype=bool)
+            self.size = len(keep)
+            self.dead = 0
+            self.positions = {int(doc_id): row for row, doc_id in enumerate(self.ids)}
     
-    return files
+    def add(self, rows: List[Tuple[int, bytes]], precision: str):
+        if np is None:
+            self.rows.update(rows)
+            return
+        if not rows:
+            return
+        
+        needed = self.size + len(rows)
+        if needed > len(self.ids):
+            # Grow geometrically so repeated small refreshes stay cheap
+            capacity = max(needed, 2 * len(self.ids), 1024)
+            grow = capacity - len(self.ids)
+            self.ids = np.concatenate([self.ids, np.empty(grow, dtype=np.int64)])
+            self.matrix = np.concatenate([self.matrix, np.empty((grow, self.dims), dtype=np.float32)])
+            self.live = np.concatenate([self.live, np.zeros(grow, dtype=bool)])
+        
+        end = self.size + len(rows)
+        self.ids[self.size:end] = [doc_id for doc_id, _ in rows]
+        self.matrix[self.size:end] = decode_embedding_matrix([blob for _, blob in rows], self.dims, precision)
+        self.live[self.size:end] = True
+        for row, (doc_id, _) in enumerate(rows, self.size):
+            self.positions[doc_id] = row
+        self.size = end
+    
+    def score(self, query_embedding: List[float], limit: int, precision: str,
+              allowed=None) -> List[Tuple[int, float]]:
+        """Top `limit` (doc_id, similarity) pairs, restricted to `allowed` doc ids if given."""
+        if np is None:
+            rows = [
+                (doc_id, blob) for doc_id, blob in self.rows.items()
+                if allowed is None or doc_id in allowed
+            ]
+            return score_python(rows, query_embedding, limit, precision)
+        
+        size = self.size
+        mask = self.live[:size].copy()
+        if allowed is not None:
+            mask &= np.isin(self.ids[:size], allowed)
+        return top_k_matrix(self.ids[:size], self.matrix[:size], query_embedding, limit, mask)
 
 
-def index_file(conn: sqlite3.Connection, path: Path, doc_type: str, config: dict):
-    """Index a single file."""
-    cursor = conn.cursor()
-    
-    # Check if file has changed
-    current_hash = file_hash(path)
-    cursor.execute(
-        "SELECT file_hash FROM documents WHERE file_path = ? LIMIT 1",
-        (str(path),)
-    )
-    row = cursor.fetchone()
+class ResidentIndex:
+    """The index held in memory by `bf-search.py serve`.
     
-    if row and row[0] == current_hash:
-        return False  # No change
+    Vectors are loaded once into one VectorPartition per doc_type, so a
+    typed search only scans its own partition. When an index run changes
+    search.db (its generation in index_meta moves), only the added and
+    removed chunks are applied. Chunk text is still read from SQLite for
+    the final results.
+    """
     
-    # Remove old entries
-    cursor.execute(
-        "DELETE FROM embeddings WHERE doc_id IN (SELECT id FROM documents WHERE file_path = ?)",
-        (str(path),)
-    )
-    cursor.execute("DELETE FROM documents WHERE file_path = ?", (str(path),))
+    REFRESH_INTERVAL = 1.0  # seconds between generation checks
     
-    # Read and chunk file
-    try:
-        content = path.read_text(encoding='utf-8', errors='ignore')
-    except Exception as e:
-        print(f"  Error reading {path}: {e}", file=sys.stderr)
-        return False
+    def __init__(self, db_path: Path, config: dict):
+        self.db_path = db_path
+        self.config = config
+        self.dims = config["embedding"]["dimensions"]
+        self.lock = threading.Lock()
+        self.generation = None
+        self.precision = None
+        self.last_check = 0.0
+        self.doc_types: Dict[int, str] = {}  # doc_id -> doc_type
+        self.partitions: Dict[str, VectorPartition] = {}
+        self.mismatched: Set[int] = set()  # doc ids whose stored vector has the wrong size
+        
+        init_database(db_path, self.dims).close()
+        self.refresh(force=True)
     
-    chunks = chunk_text(
-        content,
-        config["embedding"]["chunk_size"],
-        config["embedding"]["chunk_overlap"]
-    )
+    def __len__(self):
+        return sum(len(partition) for partition in self.partitions.values())
     
-    # Index each chunk
-    for i, chunk in enumerate(chunks):
-        # Insert document
-        cursor.execute("""
-            INSERT INTO documents (file_path, chunk_index, content, start_line, end_line, file_hash, doc_type)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (str(path), i, chunk["text"], chunk["start_line"], chunk["end_line"], current_hash, doc_type))
+    def refresh(self, force: bool = False) -> bool:
+        """Apply index changes made since the last refresh; True if any."""
+        now = time.monotonic()
+        if not force and now - self.last_check < self.REFRESH_INTERVAL:
+            return False
         
-        doc_id = cursor.lastrowid
+        with self.lock:
+            self.last_check = now
+            conn = sqlite3.connect(self.db_path)
+            try:
+                generation = get_index_meta(conn, "generation", "0")
+                if generation == self.generation:
+                    return False
+                
+                # Committed documents always have their embeddings, and this
+                # only reads the doc_type index, not the chunk text or vectors
+                current = dict(conn.execute("SELECT id, doc_type FROM documents"))
+                precision = get_embedding_precision(conn)
+                if precision != self.precision:
+                    # Stored vectors were re-encoded: reload them all
+                    self._remove(set(self.doc_types))
+                    self.mismatched.clear()
+                    self.precision = precision
+                known = set(self.doc_types)
+                # A chunk whose doc_type changed moves to another partition
+                removed = {doc_id for doc_id in known if current.get(doc_id) != self.doc_types[doc_id]}
+                # Chunks already skipped for their size are not read again
+                self.mismatched &= set(current)
+                added = sorted(set(current) - (known - removed) - self.mismatched)
+                
+                if known:
+                    rows = iter_embedding_rows(conn, added)
+                else:
+                    rows = conn.execute("SELECT doc_id, embedding FROM embeddings")
+                size = embedding_blob_size(self.dims, precision)
+                loaded = []
+                skipped = 0
+                for doc_id, blob in rows:
+                    if doc_id not in current:
+                        continue
+                    if len(blob) != size:
+                        self.mismatched.add(doc_id)
+                        skipped += 1
+                        continue
+                    loaded.append((doc_id, blob, current[doc_id]))
+                if skipped:
+                    # Another model's dimensions or a different precision: searches
+                    # (here and with --no-daemon) leave these chunks out
+                    print(f"⚠️  Skipped {skipped} embeddings that are not {self.dims}-dimensional {precision} "
+                          f"vectors ({len(self.mismatched)} in all). Run 'bf-search.py index --rebuild' to "
+                          f"re-embed them", file=sys.stderr)
+                
+                self._remove(removed)
+                self._add(loaded)
+                self.generation = generation
+                return True
+            finally:
+                conn.close()
+    
+    def _remove(self, doc_ids: Set[int]):
+        by_type: Dict[str, Set[int]] = {}
+        for doc_id in doc_ids:
+            by_type.setdefault(self.doc_types.pop(doc_id), set()).add(doc_id)
+        for doc_type, type_ids in by_type.items():
+            self.partitions[doc_type].remove(type_ids)
+    
+    def _add(self, rows: List[Tuple[int, bytes, str]]):
+        by_type: Dict[str, List[Tuple[int, bytes]]] = {}
+        for doc_id, blob, doc_type in rows:
+            by_type.setdefault(doc_type, []).append((doc_id, blob))
+            self.doc_types[doc_id] = doc_type
+        for doc_type, type_rows in by_type.items():
+            if doc_type not in self.partitions:
+                self.partitions[doc_type] = VectorPartition(self.dims)
+            self.partitions[doc_type].add(type_rows, self.precision)
+    
+    def search(self, query: str, limit: int = 10, doc_type: Optional[str] = None,
+               stats: Optional[Dict] = None, mode: Optional[str] = None,
+               filters: Optional[Dict] = None) -> List[Dict]:
+        """Exact search over the in-memory vectors (full-text ranking and filters from SQLite)."""
+        self.refresh()
+        mode = mode or self.config["index"].get("search_mode", "semantic")
+        conn = sqlite3.connect(self.db_path)
+        try:
+            lexical = None
+            if mode != "semantic":
+                lexical = lexical_scores(conn, query, max(limit, HYBRID_DEPTH), doc_type, filters)
+            if mode == "lexical":
+                return hydrate_results(conn, (lexical or [])[:limit])
+            
+            query_embedding = get_query_embedding(conn, query, self.config, stats)
+            if len(query_embedding) != self.dims:
+                return []
+            depth = max(limit, HYBRID_DEPTH) if mode == "hybrid" else limit
+            candidates = depth
+            if self.precision != "float32":
+                candidates = max(depth, int(self.config["index"].get("rescore_candidates", 0)))
+            scored = self.score(query_embedding, candidates, doc_type, filtered_doc_ids(conn, filters))
+            if candidates > depth:
+                scored = rescore_candidates(conn, self.config, query_embedding, scored, depth)
+            if mode == "hybrid" and lexical is not None:
+                scored = reciprocal_rank_fusion([scored, lexical], limit)
+            return hydrate_results(conn, scored[:limit])
+        finally:
+            conn.close()
+    
+    def score(self, query_embedding: List[float], limit: int, doc_type: Optional[str],
+              allowed=None) -> List[Tuple[int, float]]:
+        """Top `limit` (doc_id, similarity) pairs from the in-memory vectors."""
+        import heapq
         
-        # Get and store embedding
-        embedding = get_embedding(chunk["text"], config)
-        cursor.execute(
-            "INSERT INTO embeddings (doc_id, embedding) VALUES (?, ?)",
-            (doc_id, serialize_embedding(embedding))
-        )
+        with self.lock:
+            partitions = [self.partitions[doc_type]] if doc_type in self.partitions else []
+            if not doc_type:
+                partitions = list(self.partitions.values())
+            scored = []
+            for partition in partitions:
+                scored.extend(partition.score(query_embedding, limit, self.precision, allowed))
+        return heapq.nlargest(limit, scored, key=lambda item: item[1])
     
-    conn.commit()
-    return True
+    def find_similar(self, file_path: str, limit: int = 10, stats: Optional[Dict] = None) -> List[Dict]:
+        """find_similar() answered from memory."""
+        path = Path(file_path)
+        if not path.exists():
+            return []
+        conn = sqlite3.connect(self.db_path)
+        try:
+            results = similar_files(conn, self.config, index_path(file_path), limit)
+        finally:
+            conn.close()
+        if results is not None:
+            return results
+        content = path.read_text(encoding='utf-8', errors='ignore')
+        return self.search(content[:self.config["embedding"]["chunk_size"]], limit + 1, stats=stats)
 
 
-def build_index(config: dict, verbose: bool = True):
-    """Build or update the search index."""
-    # Ensure index directory exists
-    index_dir = Path(".branch-flow/index")
-    index_dir.mkdir(parents=True, exist_ok=True)
+def handle_daemon_request(index: ResidentIndex, request: Dict) -> Dict:
+    """Answer one daemon request: ping, search or similar.
     
-    db_path = index_dir / "search.db"
+    A similar request's file is relative to the project root.
+    """
+    command = request.get("command")
+    try:
+        if command == "ping":
+            return {"ok": True, "chunks": len(index), "generation": index.generation}
+        stats: Dict = {}
+        if command == "search":
+            results = index.search(request["query"], int(request.get("limit", 10)), request.get("doc_type"),
+                                   stats, request.get("mode"), request.get("filters"))
+            return {"results": results, "stats": stats}
+        if command == "similar":
+            results = index.find_similar(request["file"], int(request.get("limit", 10)), stats)
+            return {"results": results, "stats": stats}
+        return {"error": f"Unknown command: {command}"}
+    except (Exception, SystemExit) as e:
+        # get_embedding exits the process on connection errors; a daemon
+        # thread reports it to the client instead
+        return {"error": str(e) or type(e).__name__}
+
+
+def query_daemon(request: Dict, timeout: float = 60) -> Optional[Dict]:
+    """Send a request to a running search daemon, or None if none is running."""
+    import socket
     
-    # Ensure model is available
-    if not ensure_model_available(config):
-        return False
+    if not hasattr(socket, "AF_UNIX") or not DAEMON_SOCKET.exists():
+        return None
     
-    # Initialize database
-    conn = init_database(db_path, config["embedding"]["dimensions"])
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(0.5)
+            sock.connect(str(DAEMON_SOCKET))
+            sock.settimeout(timeout)
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as reader:
+                line = reader.readline()
+    except OSError:
+        return None
     
-    # Get files to index
-    files = get_files_to_index(config)
+    if not line:
+        return None
+    response = json.loads(line.decode("utf-8"))
+    return None if "error" in response else response
+
+
+def start_daemon_socket(index: ResidentIndex):
+    """Serve the index on the Unix socket from a background thread, or None if taken."""
+    import socket
+    import socketserver
     
-    if verbose:
-        print(f"Indexing {len(files)} files...")
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    if query_daemon({"command": "ping"}, timeout=2) is not None:
+        return None
+    if DAEMON_SOCKET.exists():
+        DAEMON_SOCKET.unlink()  # left behind by a daemon that died
     
-    indexed = 0
-    errors = 0
-    for path, doc_type in files:
-        if verbose:
-            print(f"  {path}", end="", flush=True)
-        
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            line = self.rfile.readline()
+            if not line:
+                return
+            try:
+                request = json.loads(line.decode("utf-8"))
+            except ValueError:
+                response = {"error": "Invalid JSON request"}
+            else:
+                response = handle_daemon_request(index, request)
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+    
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+    
+    server = Server(str(DAEMON_SOCKET), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+MCP_TOOLS = [
+    {
+        "name": "search",
+        "description": "Semantic, full-text or hybrid search across the codebase, memory, specs and plans",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "Search query"},
+                "limit": {"type": "integer", "description": "Number of results", "default": 10},
+                "type": {"type": "string", "enum": list(DOC_TYPES),
+                         "description": "Filter by type"},
+                "mode": {"type": "string", "enum": list(SEARCH_MODES),
+                         "description": "lexical for exact identifiers and strings, hybrid to combine both"},
+                "path": {"type": "array", "items": {"type": "string"},
+                         "description": "Only files matching these globs (e.g. src/*.py)"},
+                "dir": {"type": "array", "items": {"type": "string"},
+                        "description": "Only files under these directories"},
+                "ext": {"type": "array", "items": {"type": "string"},
+                        "description": "Only files with these extensions (e.g. py)"},
+                "since": {"type": "string",
+                          "description": "Only files modified since (7d, 12h, 2024-05-01)"}
+            },
+            "required": ["query"]
+        }
+    },
+    {
+        "name": "similar",
+        "description": "Find files similar to a given file",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "file": {"type": "string", "description": "File to find similar to"},
+                "limit": {"type": "integer", "description": "Number of results", "default": 10}
+            },
+            "required": ["file"]
+        }
+    }
+]
+
+
+def serve_mcp(index: ResidentIndex):
+    """Answer MCP (JSON-RPC over stdio) tool calls until stdin closes."""
+    def reply(message_id, result=None, error=None):
+        message = {"jsonrpc": "2.0", "id": message_id}
+        if error is not None:
+            message["error"] = error
+        else:
+            message["result"] = result
+        sys.stdout.write(json.dumps(message) + "\n")
+        sys.stdout.flush()
+    
+    for line in sys.stdin:
         try:
-            changed = index_file(conn, path, doc_type, config)
-            
-            if verbose:
-                print(" ✓" if changed else " (unchanged)")
-            
-            if changed:
-                indexed += 1
-        except Exception as e:
-            errors += 1
-            if verbose:
-                print(f" ✗ Error: {e}")
-            # Continue with next file instead of stopping
+            message = json.loads(line)
+        except ValueError:
             continue
+        method = message.get("method")
+        message_id = message.get("id")
+        params = message.get("params") or {}
+        if message_id is None:
+            continue  # notification
+        
+        if method == "initialize":
+            reply(message_id, {
+                "protocolVersion": params.get("protocolVersion", "2024-11-05"),
+                "capabilities": {"tools": {}},
+                "serverInfo": {"name": "branch-flow-search", "version": "1.0.0"}
+            })
+        elif method == "tools/list":
+            reply(message_id, {"tools": MCP_TOOLS})
+        elif method == "tools/call":
+            arguments = params.get("arguments") or {}
+            if params.get("name") == "search":
+                request = {"command": "search", "query": arguments.get("query", ""),
+                           "limit": arguments.get("limit", 10), "doc_type": arguments.get("type"),
+                           "mode": arguments.get("mode")}
+                try:
+                    request["filters"] = search_filters(arguments.get("path"), arguments.get("dir"),
+                                                        arguments.get("ext"), arguments.get("since"))
+                except argparse.ArgumentTypeError as e:
+                    reply(message_id, {"content": [{"type": "text", "text": str(e)}], "isError": True})
+                    continue
+            else:
+                request = {"command": "similar", "file": arguments.get("file", ""),
+                           "limit": arguments.get("limit", 10)}
+            response = handle_daemon_request(index, request)
+            reply(message_id, {
+                "content": [{"type": "text", "text": json.dumps(response.get("results", response), indent=2)}],
+                "isError": "error" in response
+            })
+        elif method == "ping":
+            reply(message_id, {})
+        else:
+            reply(message_id, error={"code": -32601, "message": f"Method not found: {method}"})
+
+
+def serve(config: dict, mcp: bool = False):
+    """Run the search daemon until interrupted (or until stdin closes with mcp=True)."""
+    db_path = Path(".branch-flow/index/search.db")
+    if not db_path.exists():
+        print("Index not found. Run: /bf:index", file=sys.stderr)
+        return False
     
-    conn.close()
+    import signal
     
-    if verbose:
-        print(f"\n✅ Indexed {indexed} files ({len(files)} total)")
-        if errors > 0:
-            print(f"⚠️  {errors} files had errors (skipped)")
+    # Clean up the socket on `kill` as well as on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    
+    log = sys.stderr if mcp else sys.stdout
+    index = ResidentIndex(db_path, config)
+    server = start_daemon_socket(index)
+    print(f"Loaded {len(index)} chunks into memory", file=log)
+    if server is not None:
+        print(f"Listening on {DAEMON_SOCKET}", file=log)
+    elif not mcp:
+        print("A search daemon is already running", file=sys.stderr)
+        return False
     
+    try:
+        if mcp:
+            serve_mcp(index)
+        else:
+            while True:
+                time.sleep(index.REFRESH_INTERVAL)
+                index.refresh()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            if DAEMON_SOCKET.exists():
+                DAEMON_SOCKET.unlink()
     return True
 
 
 # =============================================================================
-# Search
+# Watch Mode
 # =============================================================================
 
-def search(query: str, config: dict, limit: int = 10, doc_type: Optional[str] = None) -> List[Dict]:
-    """Search the index for relevant documents."""
-    db_path = Path(".branch-flow/index/search.db")
+def is_path_gitignored(rel_path: str) -> bool:
+    """Check one path (and its parent directories) against every .gitignore above it."""
+    parts = rel_path.split("/")
+    rules = []
+    for depth in range(len(parts)):
+        rel_dir = "/".join(parts[:depth])
+        rules = rules + load_gitignore(Path(rel_dir or "."), rel_dir)
+        candidate = "/".join(parts[:depth + 1])
+        if is_gitignored(candidate, depth < len(parts) - 1, rules):
+            return True
+    return False
+
+
+def classify_path(path: Path, config: dict) -> Optional[str]:
+    """Return the doc_type a file would be indexed as, or None if it isn't indexed."""
+    index_config = config["index"]
+    parent = path.parent.as_posix()
+    if path.suffix == ".md":
+        if parent == ".branch-flow/memory" and index_config["index_memory"]:
+            return "memory"
+        if parent == ".branch-flow/specs" and index_config["index_specs"]:
+            return "spec"
+        if parent == ".branch-flow/plans" and index_config["index_specs"]:
+            return "plan"
     
-    if not db_path.exists():
-        print("Index not found. Run: /bf:index", file=sys.stderr)
-        return []
+    if (index_config["index_codebase"] and should_index_file(path, config)
+            and not (index_config.get("respect_gitignore") and is_path_gitignored(path.as_posix()))):
+        return "code"
+    return None
+
+
+class PollingWatcher:
+    """Detect changes by re-walking the tree and comparing stat signatures."""
     
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    def __init__(self, config: dict, interval: float = 2.0):
+        self.config = config
+        self.interval = interval
+        self.snapshot = self._scan()
     
-    # Get query embedding
-    query_embedding = get_embedding(query, config)
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+        for path, _ in get_files_to_index(self.config):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            snapshot[path.as_posix()] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
     
-    # Get all embeddings
-    if doc_type:
-        cursor.execute("""
-            SELECT d.id, d.file_path, d.content, d.start_line, d.end_line, d.doc_type, e.embedding
-            FROM documents d
-            JOIN embeddings e ON d.id = e.doc_id
-            WHERE d.doc_type = ?
-        """, (doc_type,))
-    else:
-        cursor.execute("""
-            SELECT d.id, d.file_path, d.content, d.start_line, d.end_line, d.doc_type, e.embedding
-            FROM documents d
-            JOIN embeddings e ON d.id = e.doc_id
-        """)
+    def poll(self, timeout: float) -> Optional[Set[str]]:
+        """Wait up to `timeout` seconds and return the paths that changed."""
+        time.sleep(min(timeout, self.interval))
+        current = self._scan()
+        changed = {
+            rel for rel in current.keys() | self.snapshot.keys()
+            if current.get(rel) != self.snapshot.get(rel)
+        }
+        self.snapshot = current
+        return changed
     
-    results = []
-    for row in cursor.fetchall():
-        doc_id, file_path, content, start_line, end_line, dtype, embedding_blob = row
-        embedding = deserialize_embedding(embedding_blob)
-        similarity = cosine_similarity(query_embedding, embedding)
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Linux inotify watches on every indexed directory, through libc via ctypes."""
+    
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+                  | IN_DELETE | IN_DELETE_SELF)
+    
+    def __init__(self, config: dict):
+        import ctypes
+        import ctypes.util
         
-        results.append({
-            "file_path": file_path,
-            "content": content,
-            "start_line": start_line,
-            "end_line": end_line,
-            "doc_type": dtype,
-            "similarity": similarity
-        })
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        self.config = config
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches: Dict[int, str] = {}
+        
+        directories = []
+        walk_files(Path("."), config, directories=directories)
+        for rel_dir in directories:
+            self._add_watch(rel_dir)
     
-    conn.close()
+    def _add_watch(self, rel_dir: str):
+        import ctypes
+        
+        wd = self.libc.inotify_add_watch(self.fd, (rel_dir or ".").encode(), self.WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            # ENOSPC: out of inotify watches; the caller falls back to polling
+            raise OSError(errno, f"inotify_add_watch failed for {rel_dir or '.'}: {os.strerror(errno)}")
+        self.watches[wd] = rel_dir
+    
+    def _expand_directory(self, rel_dir: str) -> Set[str]:
+        """Watch a new directory (and its subdirectories); return the files already in it."""
+        found = set()
+        if is_excluded_path(rel_dir, self.config):
+            return found
+        for dir_path, dir_names, file_names in os.walk(rel_dir):
+            rel = Path(dir_path).as_posix()
+            dir_names[:] = [name for name in dir_names if not is_excluded_path(f"{rel}/{name}", self.config)]
+            self._add_watch(rel)
+            found.update(f"{rel}/{name}" for name in file_names)
+        return found
+    
+    def poll(self, timeout: float) -> Optional[Set[str]]:
+        """Wait up to `timeout` seconds and return the paths that changed.
+        
+        Returns None when the kernel queue overflowed and events were lost.
+        """
+        import select
+        import struct
+        
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = struct.unpack_from("iIII", data, offset)
+                name = data[offset + 16:offset + 16 + length].rstrip(b"\0").decode("utf-8", errors="surrogateescape")
+                offset += 16 + length
+                
+                if mask & self.IN_Q_OVERFLOW:
+                    return None
+                if mask & self.IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                rel_dir = self.watches.get(wd)
+                if rel_dir is None or not name:
+                    continue
+                rel = f"{rel_dir}/{name}" if rel_dir else name
+                
+                if mask & self.IN_ISDIR:
+                    if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                        changed.update(self._expand_directory(rel))
+                    else:
+                        changed.add(rel)  # deleted or moved away with its files
+                else:
+                    changed.add(rel)
+        return changed
     
-    # Sort by similarity and return top results
-    results.sort(key=lambda x: x["similarity"], reverse=True)
-    return results[:limit]
+    def close(self):
+        os.close(self.fd)
 
 
-def find_similar(file_path: str, config: dict, limit: int = 10) -> List[Dict]:
-    """Find files similar to the given file."""
-    path = Path(file_path)
+def remove_deleted_paths(conn: sqlite3.Connection, rel_path: str) -> int:
+    """Delete index rows for a removed file or for every file under a removed directory."""
+    prefix = rel_path.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "/%"
+    paths = {row[0] for row in conn.execute(
+        "SELECT DISTINCT file_path FROM documents WHERE file_path = ? OR file_path LIKE ? ESCAPE '\\'",
+        (rel_path, prefix)
+    )}
+    paths.update(row[0] for row in conn.execute(
+        "SELECT file_path FROM file_manifest WHERE file_path = ? OR file_path LIKE ? ESCAPE '\\'",
+        (rel_path, prefix)
+    ))
+    if paths:
+        delete_file_rows(conn, sorted(paths))
+        bump_index_generation(conn)
+    return len(paths)
+
+
+def watch(config: dict, debounce: float = 0.5, interval: float = 2.0, verbose: bool = True,
+          poll: bool = False):
+    """Keep the index current, re-indexing only the files that change.
     
-    if not path.exists():
-        print(f"File not found: {file_path}", file=sys.stderr)
-        return []
+    Events are coalesced until the tree has been quiet for `debounce`
+    seconds (capped at 10x that while events keep arriving), so branch
+    checkouts and formatters trigger one update instead of hundreds.
+    """
+    if not build_index(config, verbose=False):
+        return False
     
-    content = path.read_text(encoding='utf-8', errors='ignore')
+    index_dir = Path(".branch-flow/index")
+    conn = init_database(index_dir / "search.db", config["embedding"]["dimensions"])
+    configure_bulk_writes(conn)
     
-    # Use file content as query
-    return search(content[:config["embedding"]["chunk_size"]], config, limit + 1)
+    watcher = None
+    if not poll:
+        try:
+            watcher = InotifyWatcher(config)
+            mode = "inotify"
+        except OSError as e:
+            if verbose:
+                print(f"inotify unavailable ({e}), falling back to polling")
+    if watcher is None:
+        watcher = PollingWatcher(config, interval)
+        mode = f"polling every {interval}s"
+    
+    if verbose:
+        print(f"👀 Watching for changes ({mode}). Press Ctrl-C to stop.")
+    
+    failed: Set[str] = set()  # paths to retry with the next update
+    try:
+        while True:
+            changed = watcher.poll(3600)
+            if changed is not None and not changed:
+                continue
+            
+            # Coalesce the rest of the burst
+            started = time.monotonic()
+            while changed is not None and time.monotonic() - started < debounce * 10:
+                more = watcher.poll(debounce)
+                if more is None:
+                    changed = None
+                elif not more:
+                    break
+                else:
+                    changed |= more
+            
+            if changed is None:
+                # Events were lost: fall back to a full (stat-based) pass
+                if verbose:
+                    print("Event queue overflowed, rescanning...")
+                build_index(config, verbose=False)
+                failed.clear()
+                continue
+            
+            failed = set(update_paths(conn, sorted(changed | failed), config, verbose))
+            if config["index"].get("vector_file"):
+                sync_vector_file(conn, index_dir, config)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        conn.close()
+    return True
+
+
+def update_paths(conn: sqlite3.Connection, rel_paths: List[str], config: dict,
+                 verbose: bool = True) -> List[str]:
+    """Re-index changed files and drop removed ones.
+    
+    A failure rolls back everything since the batcher's last commit, so the
+    other paths of the burst rolled back with the failing one are updated
+    once more. Returns the paths left out of the index: the failing ones,
+    or every uncommitted one when the embedding server is unreachable.
+    """
+    failed: Set[str] = set()
+    for attempt in range(2):
+        retry: Set[str] = set()
+        uncommitted: List[str] = []  # paths handled since the last commit
+        batcher = EmbeddingBatcher(conn, config)
+        
+        def roll_back(error: Exception, rel: Optional[str] = None):
+            culprits = set(batcher.failed_files or ([rel] if rel else uncommitted))
+            rolled_back = set(uncommitted) | set(batcher.discard())
+            uncommitted.clear()
+            if is_endpoint_failure(error):
+                culprits |= rolled_back
+            failed.update(culprits)
+            retry.update(rolled_back - culprits)
+            return culprits
+        
+        try:
+            for i, rel in enumerate(rel_paths):
+                path = Path(rel)
+                doc_type = classify_path(path, config) if path.is_file() else None
+                try:
+                    if doc_type:
+                        if index_file(conn, path, doc_type, config, batcher) and verbose:
+                            print(f"  {rel} ✓")
+                    elif remove_deleted_paths(conn, rel) and verbose:
+                        print(f"  {rel} (removed)")
+                    uncommitted.append(rel)
+                except Exception as e:
+                    culprits = roll_back(e, rel)
+                    if verbose:
+                        print(f"  {', '.join(sorted(culprits))} ✗ Error: {e}")
+                    if is_endpoint_failure(e):
+                        # The rest would only wait out the same retries
+                        failed.update(rel_paths[i + 1:])
+                        break
+                if not conn.in_transaction:
+                    uncommitted.clear()
+            batcher.flush()
+        except Exception as e:
+            culprits = roll_back(e)
+            if verbose:
+                print(f"  ✗ Error embedding batch ({', '.join(sorted(culprits))}): {e}")
+        finally:
+            batcher.close()
+        
+        rel_paths = sorted(retry - failed)
+        if not rel_paths:
+            break
+        if verbose:
+            print(f"  Re-indexing {len(rel_paths)} files rolled back with the failure...")
+    
+    if failed and verbose:
+        print(f"  ⚠️  {len(failed)} files not indexed, retried with the next change: "
+              f"{', '.join(sorted(failed))}")
+    return sorted(failed)
 
 
 # =============================================================================
 # CLI
 # =============================================================================
 
+def print_query_cache_stats(stats: Dict):
+    """One-line query cache summary after search output."""
+    if "query_cache" in stats:
+        print(f"Query cache: {stats['query_cache']} "
+              f"({stats['query_cache_hits']} hits, {stats['query_cache_misses']} misses)")
+
+
+def add_metrics_arguments(parser: argparse.ArgumentParser):
+    """--metrics, --metrics-textfile and --profile for a command."""
+    group = parser.add_argument_group("metrics")
+    group.add_argument("--metrics", choices=["json"],
+                       help="Print per-stage timings, latency percentiles and cache hit rates to stderr")
+    group.add_argument("--metrics-textfile", metavar="PATH",
+                       help="Write the metrics to PATH in Prometheus textfile format")
+    group.add_argument("--profile", metavar="PATH", help="Write cProfile stats of the run to PATH")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Branch Flow Semantic Search")
     subparsers = parser.add_subparsers(dest="command", help="Commands")
@@ -676,33 +5005,156 @@ def main():
     # Index command
     index_parser = subparsers.add_parser("index", help="Build or update search index")
     index_parser.add_argument("-q", "--quiet", action="store_true", help="Quiet output")
+    index_parser.add_argument("--rebuild", action="store_true", help="Re-index every file from scratch")
+    index_parser.add_argument("--resume", action="store_true",
+                              help="Only index the files the last run left unfinished")
+    index_parser.add_argument("-j", "--jobs", type=int, help="Embedding requests in flight at once")
+    index_parser.add_argument("--read-workers", type=int, metavar="N",
+                              help="Processes reading, hashing and chunking files (1 = in-process)")
+    index_parser.add_argument("--git", action="store_true", help="Use git to find candidate and changed files")
+    index_parser.add_argument("--ann", action="store_true", help="Build/update the approximate nearest-neighbour index")
+    add_metrics_arguments(index_parser)
     
     # Search command
     search_parser = subparsers.add_parser("search", help="Search the index")
-    search_parser.add_argument("query", help="Search query")
+    search_parser.add_argument("query", nargs="?", help="Search query")
+    search_parser.add_argument("--batch", metavar="FILE", type=argparse.FileType("r", encoding="utf-8"),
+                               help="Run the JSONL queries in FILE ('-' for stdin), writing JSONL results")
     search_parser.add_argument("-n", "--limit", type=int, default=10, help="Number of results")
-    search_parser.add_argument("-t", "--type", choices=["code", "memory", "spec", "plan"], help="Filter by type")
+    search_parser.add_argument("-t", "--type", choices=DOC_TYPES, help="Filter by type")
     search_parser.add_argument("--json", action="store_true", help="JSON output")
+    search_parser.add_argument("--nprobe", type=int, help="ANN lists to scan (0 = exact scan)")
+    search_parser.add_argument("--shortlist", type=int,
+                               help="Candidates kept by the sign-code prefilter (0 = no prefilter)")
+    search_parser.add_argument("--mode", choices=SEARCH_MODES, help="Ranking: semantic, lexical (BM25) or hybrid")
+    search_parser.add_argument("--prefilter", type=int,
+                               help="Vector-score only the top N full-text matches (0 = off)")
+    search_parser.add_argument("--path", action="append", metavar="GLOB",
+                               help="Only files matching a glob, e.g. 'src/*.py' (repeatable)")
+    search_parser.add_argument("--dir", action="append", help="Only files under a directory (repeatable)")
+    search_parser.add_argument("--ext", action="append", help="Only files with an extension, e.g. py (repeatable)")
+    search_parser.add_argument("--since", type=parse_since,
+                               help="Only files modified since: 30m, 12h, 7d, 2w, a date or a timestamp")
+    search_parser.add_argument("--no-daemon", action="store_true", help="Don't use a running search daemon")
+    add_metrics_arguments(search_parser)
     
     # Similar command
     similar_parser = subparsers.add_parser("similar", help="Find similar files")
-    similar_parser.add_argument("file", help="File to find similar to")
+    similar_parser.add_argument("file", nargs="?", help="File to find similar to")
+    similar_parser.add_argument("--all-pairs", action="store_true",
+                                help="Report clusters of near-duplicate files across the index")
+    similar_parser.add_argument("--threshold", type=float, default=DUPLICATE_THRESHOLD,
+                                help=f"Similarity for --all-pairs (default: {DUPLICATE_THRESHOLD})")
     similar_parser.add_argument("-n", "--limit", type=int, default=10, help="Number of results")
     similar_parser.add_argument("--json", action="store_true", help="JSON output")
+    similar_parser.add_argument("--no-daemon", action="store_true", help="Don't use a running search daemon")
+    add_metrics_arguments(similar_parser)
+    
+    # Watch command
+    watch_parser = subparsers.add_parser("watch", help="Re-index files as they change")
+    watch_parser.add_argument("--debounce", type=float, default=0.5, help="Seconds of quiet before re-indexing")
+    watch_parser.add_argument("--interval", type=float, default=2.0, help="Polling interval without inotify")
+    watch_parser.add_argument("--poll", action="store_true", help="Poll even if inotify is available")
+    watch_parser.add_argument("-q", "--quiet", action="store_true", help="Quiet output")
+    
+    # Serve command
+    serve_parser = subparsers.add_parser("serve", help="Keep the index in memory and answer searches")
+    serve_parser.add_argument("--mcp", action="store_true", help="Also answer MCP tool calls on stdin/stdout")
+    
+    # ANN recall command
+    recall_parser = subparsers.add_parser("ann-recall", help="Measure ANN recall@k against the exact scan")
+    recall_parser.add_argument("-k", type=int, default=10, help="Results per query")
+    recall_parser.add_argument("--queries", type=int, default=100, help="Number of sampled queries")
+    recall_parser.add_argument("--nprobe", type=int, nargs="+", help="nprobe values to evaluate")
+    recall_parser.add_argument("--json", action="store_true", help="JSON output")
+    
+    # Precision report command
+    precision_parser = subparsers.add_parser("precision-report",
+                                             help="Compare index size and recall@k per storage precision")
+    precision_parser.add_argument("-k", type=int, default=10, help="Results per query")
+    precision_parser.add_argument("--queries", type=int, default=100, help="Number of sampled queries")
+    precision_parser.add_argument("--candidates", type=int, help="Candidates rescored at full precision")
+    precision_parser.add_argument("--json", action="store_true", help="JSON output")
     
     # Config command
     config_parser = subparsers.add_parser("config", help="Show or update configuration")
     config_parser.add_argument("--set-model", help="Set embedding model")
     config_parser.add_argument("--list-models", action="store_true", help="List available models")
+    config_parser.add_argument("--set-precision", choices=list(EMBEDDING_PRECISIONS),
+                               help="Set embedding storage precision")
     
     args = parser.parse_args()
     config = get_config()
     
+    if getattr(args, "metrics", None) or getattr(args, "metrics_textfile", None) or getattr(args, "profile", None):
+        import atexit
+        
+        profiler = None
+        if args.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        atexit.register(write_metrics, args.command, config, args.metrics, args.metrics_textfile,
+                        profiler, args.profile)
+        # Measure this process, not a running daemon
+        args.no_daemon = True
+    
     if args.command == "index":
-        build_index(config, verbose=not args.quiet)
+        if args.jobs:
+            config["embedding"]["concurrency"] = args.jobs
+        if args.read_workers:
+            config["index"]["read_workers"] = args.read_workers
+        if args.ann:
+            config["index"]["ann"] = True
+        if args.git:
+            config["index"]["use_git"] = True
+        if not build_index(config, verbose=not args.quiet, rebuild=args.rebuild, resume=args.resume):
+            sys.exit(1)
+    
+    elif args.command == "search" and args.batch:
+        requests = []
+        with args.batch:
+            for line in args.batch:
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    request = None
+                    error = f"invalid JSON: {e}"
+                else:
+                    error = "expected a query string or object"
+                # A bare JSON string is a query with the command-line defaults
+                if isinstance(request, str):
+                    request = {"query": request}
+                requests.append(request if isinstance(request, dict) else error)
+        
+        filters = search_filters(args.path, args.dir, args.ext, args.since)
+        valid = [request for request in requests if isinstance(request, dict)]
+        records = search_batch(valid, config, args.limit, args.type, args.mode, filters)
+        if valid and not records:
+            sys.exit(1)
+        records = iter(records)
+        for request in requests:
+            print(json.dumps(next(records) if isinstance(request, dict) else {"error": request}))
     
     elif args.command == "search":
-        results = search(args.query, config, args.limit, args.type)
+        if args.query is None:
+            search_parser.error("a query or --batch is required")
+        response = None
+        mode = args.mode or config["index"].get("search_mode", "semantic")
+        filters = search_filters(args.path, args.dir, args.ext, args.since)
+        if not args.no_daemon and args.nprobe is None and args.shortlist is None and args.prefilter is None:
+            response = query_daemon({
+                "command": "search", "query": args.query, "limit": args.limit, "doc_type": args.type,
+                "mode": mode, "filters": filters
+            })
+        if response is not None:
+            results, stats = response["results"], response.get("stats", {})
+        else:
+            stats = {}
+            results = search(args.query, config, args.limit, args.type, args.nprobe, stats, args.shortlist,
+                             mode, args.prefilter, filters)
         
         if args.json:
             print(json.dumps(results, indent=2))
@@ -713,18 +5165,58 @@ def main():
             
             print(f"\n🔍 Search results for: {args.query}\n")
             for i, r in enumerate(results, 1):
-                score = r["similarity"] * 100
                 print(f"{i}. [{r['doc_type']}] {r['file_path']}:{r['start_line']}-{r['end_line']}")
-                print(f"   Score: {score:.1f}%")
+                if mode == "semantic":
+                    print(f"   Score: {r['similarity'] * 100:.1f}%")
+                else:
+                    # BM25 or fused rank score: only comparable within this list
+                    print(f"   Score: {r['similarity']:.4f}")
                 preview = r["content"][:200].replace('\n', ' ')
                 print(f"   {preview}...")
                 print()
+            print_query_cache_stats(stats)
+    
+    elif args.command == "similar" and args.all_pairs:
+        db_path = Path(".branch-flow/index/search.db")
+        if not db_path.exists():
+            print("Index not found. Run: /bf:index", file=sys.stderr)
+            sys.exit(1)
+        conn = init_database(db_path, config["embedding"]["dimensions"])
+        if backfill_file_vectors(conn, config["embedding"]["dimensions"], get_embedding_precision(conn)):
+            conn.commit()
+        clusters = duplicate_clusters(conn, config, args.threshold)
+        conn.close()
+        
+        if args.json:
+            print(json.dumps(clusters, indent=2))
+        elif not clusters:
+            print(f"No files with similarity >= {args.threshold * 100:.1f}%.")
+        else:
+            print(f"\n👯 {len(clusters)} clusters of near-duplicate files\n")
+            for i, cluster in enumerate(clusters, 1):
+                top = cluster["pairs"][0]["similarity"] * 100
+                print(f"{i}. {len(cluster['files'])} files (up to {top:.1f}% similar)")
+                for file_path in cluster["files"]:
+                    print(f"   {file_path}")
+                print()
     
     elif args.command == "similar":
-        results = find_similar(args.file, config, args.limit)
+        if args.file is None:
+            similar_parser.error("a file or --all-pairs is required")
+        response = None
+        if not args.no_daemon and Path(args.file).exists():
+            # Project-relative, as the daemon's working directory (or mount) may differ
+            response = query_daemon({
+                "command": "similar", "file": index_path(args.file), "limit": args.limit
+            })
+        if response is not None:
+            results, stats = response["results"], response.get("stats", {})
+        else:
+            stats = {}
+            results = find_similar(args.file, config, args.limit, stats)
         
         # Filter out the source file itself
-        results = [r for r in results if r["file_path"] != args.file]
+        results = [r for r in results if r["file_path"] != index_path(args.file)][:args.limit]
         
         if args.json:
             print(json.dumps(results, indent=2))
@@ -739,13 +5231,63 @@ def main():
                 print(f"{i}. [{r['doc_type']}] {r['file_path']}")
                 print(f"   Similarity: {score:.1f}%")
                 print()
+            print_query_cache_stats(stats)
+    
+    elif args.command == "watch":
+        if not watch(config, args.debounce, args.interval, verbose=not args.quiet, poll=args.poll):
+            sys.exit(1)
+    
+    elif args.command == "serve":
+        if not serve(config, mcp=args.mcp):
+            sys.exit(1)
+    
+    elif args.command == "ann-recall":
+        report = ann_recall(config, args.k, args.queries, args.nprobe)
+        if report is None:
+            sys.exit(1)
+        
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print(f"\n📈 ANN recall@{args.k} ({args.queries} sampled queries)\n")
+            print(f"  {'nprobe':>6}  {'recall':>7}  {'latency':>10}")
+            for r in report:
+                print(f"  {r['nprobe']:>6}  {r['recall'] * 100:>6.1f}%  {r['latency_ms']:>8.2f}ms")
+            if report:
+                print(f"\n  Exact scan: {report[0]['exact_latency_ms']:.2f}ms per query")
+    
+    elif args.command == "precision-report":
+        report = precision_report(config, args.k, args.queries, args.candidates)
+        if report is None:
+            sys.exit(1)
+        
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print(f"\n📦 Storage precision ({report['vectors']} vectors, recall@{args.k}, "
+                  f"{args.queries} sampled queries)\n")
+            print(f"  {'precision':>9}  {'bytes':>6}  {'ratio':>5}  {'scanned':>9}  {'on disk':>9}  {'ratio':>5}  "
+                  f"{'recall':>7}  {'rescored':>8}")
+            for r in report["precisions"]:
+                marker = "→" if r["precision"] == report["current"] else " "
+                print(f"{marker} {r['precision']:>9}  {r['bytes_per_vector']:>6}  {r['ratio']:>4.1f}x  "
+                      f"{r['scan_bytes'] / 1048576:>7.1f}MB  {r['index_bytes'] / 1048576:>7.1f}MB  "
+                      f"{r['index_ratio']:>4.1f}x  {r['recall'] * 100:>6.1f}%  {r['recall_rescored'] * 100:>7.1f}%")
+            print(f"\n  'On disk' adds the float32 copies kept while rescoring is on; "
+                  f"rescoring re-ranks the top {report['candidates']}")
+            print(f"  Stored now: {report['stored_bytes'] / 1048576:.1f}MB of {report['current']} vectors, "
+                  f"{report['rescore_bytes'] / 1048576:.1f}MB of rescoring copies and "
+                  f"{report['cache_bytes'] / 1048576:.1f}MB of embedding cache "
+                  f"(search.db: {report['db_bytes'] / 1048576:.1f}MB)")
     
     elif args.command == "config":
         if args.list_models:
+            precision = config["index"].get("embedding_precision", "float32")
             print("\n📋 Available embedding models:\n")
             for name, preset in MODEL_PRESETS.items():
                 marker = "→" if name == config["embedding"]["model"] else " "
-                print(f"  {marker} {name} ({preset['dimensions']} dimensions)")
+                size = embedding_blob_size(preset["dimensions"], precision)
+                print(f"  {marker} {name} ({preset['dimensions']} dimensions, {size} bytes/chunk as {precision})")
             print(f"\nCurrent model: {config['embedding']['model']}")
             print("\nTo change: bf-search.py config --set-model <name>")
             print("Or set environment variable: BF_EMBEDDING_MODEL=<name>")
@@ -772,6 +5314,22 @@ def main():
             print(f"✅ Model set to: {args.set_model}")
             print("Run '/bf:index' to rebuild the index with the new model.")
         
+        elif args.set_precision:
+            config_path = Path(".branch-flow/config.json")
+            if config_path.exists():
+                with open(config_path) as f:
+                    file_config = json.load(f)
+            else:
+                file_config = {}
+            
+            file_config.setdefault("index", {})["embedding_precision"] = args.set_precision
+            
+            with open(config_path, "w") as f:
+                json.dump(file_config, f, indent=2)
+            
+            print(f"✅ Embedding precision set to: {args.set_precision}")
+            print("Run '/bf:index' to convert the existing index in place.")
+        
         else:
             print(json.dumps(config, indent=2))
     
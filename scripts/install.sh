@@ -536,6 +536,7 @@ cat > .branch-flow/config.json << EOF
     "ollama_url": "$OLLAMA_URL",
     "llamacpp_url": "$LLAMACPP_URL",
     "batch_size": 10,
+    "concurrency": 4,
     "chunk_size": 1000,
     "chunk_overlap": 200
   },
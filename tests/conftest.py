@@ -0,0 +1,128 @@
+"""Shared fixtures: the scripts loaded as modules, a stub embedding server,
+and a generated repository indexed against it."""
+
+import copy
+import importlib.util
+import json
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+SCRIPTS = Path(__file__).resolve().parent.parent / "scripts"
+DIMENSIONS = 64
+CORPUS_FILES = 60
+
+
+def load_script(filename: str, name: str):
+    """Import a hyphenated script from scripts/ under a module name."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, SCRIPTS / filename)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def bf():
+    return load_script("bf-search.py", "bf_search")
+
+
+@pytest.fixture(scope="session")
+def bench(bf):
+    return load_script("bf-bench.py", "bf_bench")
+
+
+@pytest.fixture
+def stub(bench):
+    server = bench.StubEmbeddingServer(dimensions=DIMENSIONS).start()
+    yield server
+    server.stop()
+
+
+class Project:
+    """A generated repository, its config and the index built from it."""
+
+    def __init__(self, bf, root: Path, config: dict):
+        self.bf = bf
+        self.root = root
+        self.config = config
+        self.db_path = root / ".branch-flow" / "index" / "search.db"
+
+    def index(self, **kwargs) -> bool:
+        return self.bf.build_index(self.config, verbose=False, **kwargs)
+
+    def search(self, query: str, **kwargs):
+        return self.bf.search(query, self.config, **kwargs)
+
+    def rankings(self, queries, limit: int = 10, **kwargs):
+        """Each query's results as (file, start line) pairs, best first."""
+        return [[(r["file_path"], r["start_line"]) for r in self.search(query, limit=limit, **kwargs)]
+                for query in queries]
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+    def query(self, sql: str, *params):
+        conn = self.connect()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def write_config(self):
+        """Save the config where get_config (and a daemon) will read it."""
+        path = self.root / ".branch-flow" / "config.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.config, indent=2))
+
+
+@pytest.fixture
+def project(bf, bench, stub, tmp_path, monkeypatch):
+    """A 60-file generated repository as cwd, configured for the stub server."""
+    root = tmp_path / "repo"
+    bench.generate_corpus(root, CORPUS_FILES, seed=7, verbose=False)
+    monkeypatch.chdir(root)
+    # Endpoint pools keep backoff state between runs; start each test afresh
+    monkeypatch.setattr(bf, "_endpoint_pools", {})
+    # get_config updates the nested defaults in place
+    monkeypatch.setattr(bf, "DEFAULT_CONFIG", copy.deepcopy(bf.DEFAULT_CONFIG))
+
+    config = copy.deepcopy(bf.DEFAULT_CONFIG)
+    config["embedding"].update({
+        "provider": "ollama",
+        "model": "test-embed",
+        "dimensions": DIMENSIONS,
+        "endpoints": [stub.url],
+        "retries": 0,
+    })
+    config["index"]["read_workers"] = 1
+    project = Project(bf, root, config)
+    project.write_config()
+    # Age the files past the manifest's window for racy mtimes, as in a
+    # checkout that is not brand new
+    old = time.time() - 60
+    for path in root.rglob("*"):
+        os.utime(path, (old, old))
+    return project
+
+
+@pytest.fixture
+def queries(bench):
+    return bench.sample_queries(12, seed=7)
+
+
+@pytest.fixture
+def cli(bf, project, monkeypatch, capsys):
+    """Run bf-search.py's main() in the project and return its stdout."""
+    def run(*args) -> str:
+        capsys.readouterr()
+        monkeypatch.setattr(sys, "argv", ["bf-search.py", *args])
+        bf.main()
+        return capsys.readouterr().out
+    return run
@@ -0,0 +1,46 @@
+"""IVF index: probing every list, or none (nprobe=0), matches the exact scan."""
+
+import pytest
+
+
+@pytest.fixture
+def ann(project, queries):
+    """Exact rankings, then the same project indexed with 8 IVF lists."""
+    assert project.index()
+    exact = project.rankings(queries)
+    project.config["index"].update({"ann": True, "ann_lists": 8, "ann_nprobe": 1})
+    assert project.index()
+    return exact
+
+
+def test_ann_index_assigns_every_chunk(project, ann):
+    assert project.query("SELECT COUNT(*) FROM ivf_centroids") == [(8,)]
+    assert (project.query("SELECT COUNT(*) FROM ivf_assignments")
+            == project.query("SELECT COUNT(*) FROM embeddings"))
+
+
+def test_nprobe_zero_is_the_exact_scan(project, queries, ann):
+    assert project.rankings(queries, nprobe=0) == ann
+
+
+def test_probing_every_list_matches_exact_scan(project, queries, ann):
+    assert project.rankings(queries, nprobe=8) == ann
+
+
+def test_recall_grows_with_nprobe(project, ann, bf):
+    report = bf.ann_recall(project.config, k=10, queries=50, nprobes=[1, 8])
+    assert report[0]["recall"] <= report[1]["recall"] == 1.0
+
+
+def test_new_chunks_join_their_lists(project, queries, ann):
+    path = project.query(
+        "SELECT file_path FROM documents WHERE file_path LIKE 'src/%' ORDER BY file_path LIMIT 1"
+    )[0][0]
+    with open(path, "a") as f:
+        f.write("\n" + " ".join(queries) + "\n")
+    assert project.index()
+    assert project.query("""
+        SELECT COUNT(*) FROM embeddings e
+        WHERE NOT EXISTS (SELECT 1 FROM ivf_assignments a WHERE a.doc_id = e.doc_id)
+    """) == [(0,)]
+    assert project.rankings(queries, nprobe=8) == project.rankings(queries, nprobe=0)
@@ -0,0 +1,54 @@
+"""Batch search: one scan answers many queries exactly as single searches do."""
+
+import json
+
+
+def hits(results):
+    return [(r["file_path"], r["start_line"], round(r["similarity"], 5)) for r in results]
+
+
+def test_batch_matches_single_searches(project, queries, stub, bf):
+    assert project.index()
+    requests = [{"id": n, "query": query, "limit": 5 + n % 3} for n, query in enumerate(queries)]
+    requests.append({"id": "typed", "query": queries[0], "doc_type": "code", "ext": ["md"]})
+    requests.append({"id": "hybrid", "query": queries[1], "mode": "hybrid"})
+
+    before = stub.stats()
+    records = bf.search_batch(requests, project.config)
+    # Distinct queries are embedded once each, batch_size to a request
+    after = stub.stats()
+    assert after["texts"] - before["texts"] == len(set(queries))
+    batch_size = project.config["embedding"].get("batch_size", 10)
+    assert after["requests"] - before["requests"] == -(-len(set(queries)) // batch_size)
+
+    assert [record["id"] for record in records] == [request["id"] for request in requests]
+    for request, record in zip(requests, records):
+        expected = project.search(
+            request["query"], limit=request.get("limit", 10), doc_type=request.get("doc_type"),
+            mode=request.get("mode"), filters=bf.search_filters(exts=request.get("ext")),
+        )
+        assert record["query"] == request["query"]
+        assert hits(record["results"]) == hits(expected)
+
+
+def test_bad_requests_get_errors_in_place(project, queries, bf):
+    assert project.index()
+    records = bf.search_batch(
+        [{"id": 1}, {"id": 2, "query": queries[0], "mode": "fuzzy"}, {"id": 3, "query": queries[0]}],
+        project.config,
+    )
+    assert records[0] == {"id": 1, "error": "missing 'query'"}
+    assert records[1] == {"id": 2, "error": "unknown mode: fuzzy"}
+    assert len(records[2]["results"]) == 10
+
+
+def test_cli_reads_jsonl(project, queries, cli, tmp_path):
+    assert project.index()
+    batch = tmp_path / "queries.jsonl"
+    batch.write_text(f"{json.dumps(queries[0])}\n\nnot json\n{json.dumps({'query': queries[1], 'limit': 3})}\n")
+
+    lines = [json.loads(line) for line in cli("search", "--batch", str(batch), "--limit", "4").splitlines()]
+    assert len(lines) == 3
+    assert hits(lines[0]["results"]) == hits(project.search(queries[0], limit=4))
+    assert lines[1]["error"].startswith("invalid JSON")
+    assert hits(lines[2]["results"]) == hits(project.search(queries[1], limit=3))
@@ -0,0 +1,28 @@
+"""Batched embedding requests: chunks are sent `batch_size` at a time."""
+
+import math
+
+import pytest
+
+
+@pytest.mark.parametrize("provider", ["ollama", "llamacpp"])
+def test_embed_texts_sends_one_request_in_order(project, stub, bench, bf, provider):
+    project.config["embedding"]["provider"] = provider
+    texts = ["retry the request", "parse the config", "render the page"]
+
+    assert bf.embed_texts(texts, project.config) == [bench.stub_embedding(text, 64) for text in texts]
+    assert stub.stats()["requests"] == 1
+    assert stub.stats()["texts"] == 3
+
+
+@pytest.mark.parametrize("provider", ["ollama", "llamacpp"])
+def test_index_fills_batches_across_files(project, stub, provider):
+    project.config["embedding"].update({"provider": provider, "batch_size": 8})
+    assert project.index()
+
+    texts = project.query("SELECT COUNT(DISTINCT content) FROM documents")[0][0]
+    files = project.query("SELECT COUNT(DISTINCT file_path) FROM documents")[0][0]
+    # Each distinct chunk is sent once, in full batches but the last
+    assert stub.stats()["texts"] == texts
+    assert stub.stats()["requests"] == math.ceil(texts / 8)
+    assert stub.stats()["requests"] < files
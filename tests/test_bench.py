@@ -0,0 +1,86 @@
+"""Benchmark harness: a deterministic stub server and reproducible corpora."""
+
+import json
+import math
+import sys
+
+import pytest
+
+
+def files(root):
+    return {str(path.relative_to(root)): path.read_bytes() for path in sorted(root.rglob("*")) if path.is_file()}
+
+
+def test_stub_embeddings_are_deterministic_unit_vectors(bench):
+    vector = bench.stub_embedding("parse the config file", 64)
+    assert vector == bench.stub_embedding("Parse the CONFIG file", 64)
+    assert math.sqrt(sum(x * x for x in vector)) == pytest.approx(1.0, abs=1e-5)
+    # Shared words score as similar
+    near = bench.stub_embedding("parse config", 64)
+    far = bench.stub_embedding("render socket upload", 64)
+    assert sum(a * b for a, b in zip(vector, near)) > sum(a * b for a, b in zip(vector, far))
+    assert len(bench.stub_embedding("", 64)) == 64
+
+
+@pytest.mark.parametrize("provider", ["ollama", "llamacpp"])
+def test_stub_server_speaks_both_apis(project, bf, bench, stub, provider):
+    project.config["embedding"]["provider"] = provider
+    request = bf.EMBEDDING_REQUESTS[provider]
+    texts = ["parse the config file", "render socket upload"]
+    assert request(stub.url, texts, project.config) == [bench.stub_embedding(text, stub.dimensions) for text in texts]
+    assert stub.stats() == {"requests": 1, "texts": 2, "probes": 0}
+
+
+def test_probes_are_counted_apart(bf, bench, stub, project):
+    bf.endpoint_pool(project.config).embed(["one text", "another"])
+    assert stub.stats() == {"requests": 1, "texts": 2, "probes": 1}
+
+
+def test_corpus_is_reproducible(bench, tmp_path):
+    first = bench.generate_corpus(tmp_path / "a", 120, seed=3, verbose=False)
+    second = bench.generate_corpus(tmp_path / "b", 120, seed=3, verbose=False)
+    bench.generate_corpus(tmp_path / "c", 120, seed=4, verbose=False)
+
+    assert files(tmp_path / "a") == files(tmp_path / "b")
+    assert files(tmp_path / "a") != files(tmp_path / "c")
+    assert len(files(tmp_path / "a")) == 120
+    assert first["bytes"] == second["bytes"] == sum(map(len, files(tmp_path / "a").values()))
+    # Some files are near-copies of earlier ones, for the near-duplicate report
+    memory_start = 120 - bench.memory_count(120)
+    copy = bench.DUPLICATE_EVERY - 1
+    source = bench.source_index(copy)
+    assert source < copy
+    contents = files(tmp_path / "a")
+    assert contents[bench.corpus_path(copy, memory_start)].startswith(contents[bench.corpus_path(source, memory_start)])
+    assert bench.sample_queries(5, seed=3) == bench.sample_queries(5, seed=3) != bench.sample_queries(5, seed=4)
+
+
+def test_matching_corpus_is_reused(bench, tmp_path):
+    root = tmp_path / "corpus"
+    manifest = bench.generate_corpus(root, 30, seed=1, verbose=False)
+    marker = root / "marker"
+    marker.write_text("kept")
+    assert bench.generate_corpus(root, 30, seed=1, verbose=False) == manifest
+    assert marker.exists()
+    bench.generate_corpus(root, 31, seed=1, verbose=False)
+    assert not marker.exists()
+
+
+def test_run_and_compare(bench, tmp_path, monkeypatch, capsys):
+    output = tmp_path / "report.json"
+    monkeypatch.setattr(sys, "argv", [
+        "bf-bench.py", "run", "--scales", "40", "--queries", "3", "--similar", "2", "--dimensions", "32",
+        "--workdir", str(tmp_path / "work"), "-o", str(output), "-q",
+    ])
+    bench.main()
+    report = json.loads(output.read_text())
+    (scale,) = report["scales"]
+    assert "error" not in scale
+    assert set(scale["scenarios"]) == set(bench.SCENARIOS)
+    assert scale["scenarios"]["search"]["latency_seconds"]["count"] == 3
+
+    slower = json.loads(json.dumps(report))
+    slower["scales"][0]["scenarios"]["cold_index"]["wall_seconds"] *= 2
+    assert bench.compare_reports(report, report, 0.1)
+    assert not bench.compare_reports(report, slower, 0.1)
+    assert "slower" in capsys.readouterr().out
@@ -0,0 +1,107 @@
+"""Change detection: unchanged files are skipped without reading or embedding them."""
+
+import os
+import subprocess
+
+import pytest
+
+
+def document_ids(project):
+    return project.query("SELECT id, file_path FROM documents ORDER BY id")
+
+
+def journaled(project):
+    """Files the last run stat-checked as possibly changed."""
+    return sorted(path for (path,) in project.query("SELECT file_path FROM index_jobs"))
+
+
+def first_source_file(project) -> str:
+    return project.query(
+        "SELECT file_path FROM documents WHERE file_path LIKE 'src/%' ORDER BY file_path LIMIT 1"
+    )[0][0]
+
+
+def touch(path: str):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_unchanged_reindex_makes_no_embedding_calls(project, stub):
+    assert project.index()
+    requests = stub.stats()["requests"]
+    ids = document_ids(project)
+
+    assert project.index()
+    assert stub.stats()["requests"] == requests
+    assert journaled(project) == []
+    assert document_ids(project) == ids
+
+
+def test_touched_file_is_hashed_but_not_reembedded(project, stub):
+    assert project.index()
+    requests = stub.stats()["requests"]
+    ids = document_ids(project)
+    path = first_source_file(project)
+    touch(path)
+
+    assert project.index()
+    assert journaled(project) == [path]
+    assert stub.stats()["requests"] == requests
+    assert document_ids(project) == ids
+    # The manifest now has the new mtime, so the next run skips the file
+    assert project.index()
+    assert journaled(project) == []
+
+
+def test_edited_file_alone_is_reembedded(project, stub):
+    assert project.index()
+    texts = stub.stats()["texts"]
+    path = first_source_file(project)
+    with open(path, "a") as f:
+        f.write("\ndef appended_function():\n    return 'a brand new chunk'\n")
+
+    assert project.index()
+    assert journaled(project) == [path]
+    chunks = project.query("SELECT COUNT(*) FROM documents WHERE file_path = ?", path)[0][0]
+    assert 0 < stub.stats()["texts"] - texts <= chunks
+
+
+@pytest.fixture
+def git_project(project):
+    """The project as a git work tree with everything committed."""
+    def git(*args):
+        subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+                       check=True, capture_output=True)
+
+    git("init", "-q")
+    git("add", "-A")
+    git("commit", "-q", "-m", "corpus")
+    project.config["index"]["use_git"] = True
+    project.git = git
+    return project
+
+
+def test_git_skips_files_unchanged_since_the_last_run(git_project, stub):
+    project = git_project
+    assert project.index()
+    path = first_source_file(project)
+    # Same content with a new mtime: git sees no change, so no stat is needed
+    touch(path)
+    assert project.index()
+    assert journaled(project) == []
+
+    with open(path, "a") as f:
+        f.write("\n# committed change\n")
+    project.git("commit", "-q", "-am", "edit")
+    assert project.index()
+    assert journaled(project) == [path]
+
+
+def test_git_discovery_matches_the_walker(git_project):
+    project = git_project
+    assert project.index()
+    with_git = sorted(path for (path,) in project.query("SELECT DISTINCT file_path FROM documents"))
+
+    project.config["index"]["use_git"] = False
+    assert project.index(rebuild=True)
+    assert sorted(path for (path,) in project.query("SELECT DISTINCT file_path FROM documents")) == with_git
@@ -0,0 +1,50 @@
+"""Chunk embedding cache: a chunk's text is embedded once per embedding space."""
+
+import shutil
+from pathlib import Path
+
+
+def stored_vectors(project):
+    return project.query("""
+        SELECT d.file_path, d.start_line, e.embedding FROM documents d JOIN embeddings e ON e.doc_id = d.id
+        ORDER BY d.file_path, d.start_line
+    """)
+
+
+def test_rebuild_is_served_from_the_cache(project, stub):
+    assert project.index()
+    sent = stub.stats()["texts"]
+    vectors = stored_vectors(project)
+
+    assert project.index(rebuild=True)
+    assert stub.stats()["texts"] == sent
+    assert stored_vectors(project) == vectors
+
+
+def test_copied_file_needs_no_embedding(project, stub):
+    assert project.index()
+    sent = stub.stats()["texts"]
+    path = Path(project.query("SELECT file_path FROM documents WHERE file_path LIKE 'src/%' LIMIT 1")[0][0])
+    shutil.copy(path, path.with_name(f"{path.stem}_copy{path.suffix}"))
+
+    assert project.index()
+    assert stub.stats()["texts"] == sent
+    assert project.query("SELECT COUNT(DISTINCT file_path) FROM documents WHERE file_path LIKE '%_copy%'") == [(1,)]
+
+
+def test_cache_keys_depend_on_the_model(project, bf):
+    other = dict(project.config["embedding"], model="other-embed")
+    assert (bf.chunk_cache_key(bf.embedding_identity(project.config), "text")
+            != bf.chunk_cache_key(bf.embedding_identity({"embedding": other}), "text"))
+
+
+def test_cache_is_pruned_to_its_size(project):
+    project.config["embedding"]["cache_max_entries"] = 10
+    assert project.index()
+    assert project.query("SELECT COUNT(*) FROM embedding_cache") == [(10,)]
+
+
+def test_disabled_cache_stays_empty(project):
+    project.config["embedding"]["cache_max_entries"] = 0
+    assert project.index()
+    assert project.query("SELECT COUNT(*) FROM embedding_cache") == [(0,)]
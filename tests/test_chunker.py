@@ -0,0 +1,114 @@
+"""Structure-aware chunking: chunks fit chunk_size and start where the code or text does."""
+
+import textwrap
+
+import pytest
+
+
+def function(name, body_lines=4, decorated=False):
+    lines = [f"# {name} handles one case", *(["@cached"] if decorated else []), f"def {name}(value):"]
+    lines += [f"    value = value + {i}  # step {i}" for i in range(body_lines)]
+    return "\n".join(lines + ["    return value", ""])
+
+
+PYTHON = "import os\n\n\n" + "\n\n".join(function(f"handler_{i}", 3 + i % 4, i % 3 == 0) for i in range(12))
+
+MARKDOWN = textwrap.dedent("""\
+    # Guide
+
+    Intro paragraph that explains what this guide covers in a sentence or two.
+
+    ## Install
+
+    Run the installer, then check the version it prints before going on.
+
+    ```sh
+    ./install.sh --prefix /usr/local
+
+    ./install.sh --check
+    ```
+
+    ## Usage
+
+    Start the server and point a client at it; the defaults are fine for a trial.
+
+    ### Options
+
+    Every option can also be set in the config file under the same name.
+    """) * 3
+
+
+def covers(text, chunks):
+    """Chunks tile the text in order: each starts where the last ended, or overlaps it."""
+    lines = text.split("\n")
+    assert chunks[0]["start_line"] == 0
+    for chunk in chunks:
+        assert chunk["text"] == "\n".join(lines[chunk["start_line"]:chunk["end_line"] + 1])
+    for before, after in zip(chunks, chunks[1:]):
+        assert before["start_line"] < after["start_line"] <= before["end_line"] + 1
+    assert chunks[-1]["end_line"] == len(lines) - 1
+
+
+@pytest.mark.parametrize("chunk_size", [150, 400, 1000])
+def test_python_chunks_start_at_statements(bf, chunk_size):
+    chunks = bf.chunk_text(PYTHON, chunk_size, 50, "python")
+    covers(PYTHON, chunks)
+    lines = PYTHON.split("\n")
+    for chunk in chunks:
+        assert len(chunk["text"]) <= chunk_size
+    for chunk in chunks[1:]:
+        # Chunks start at statements; a function's leading comment and decorator stay with it
+        assert lines[chunk["start_line"]].startswith(("# handler_", "    value", "    return"))
+
+
+def test_markdown_chunks_start_at_headings_and_keep_fences(bf):
+    chunks = bf.chunk_text(MARKDOWN, 200, 50, "markdown")
+    covers(MARKDOWN, chunks)
+    for chunk in chunks:
+        assert len(chunk["text"]) <= 200
+        assert chunk["text"].count("```") in (0, 2)
+    lines = MARKDOWN.split("\n")
+    for chunk in chunks[1:]:
+        # At a heading or the first line of a paragraph or fence
+        start = chunk["start_line"]
+        assert lines[start].strip() and (lines[start].startswith("#") or not lines[start - 1].strip())
+
+
+def test_line_chunks_overlap(bf):
+    text = "\n".join(f"line {i:03d} of plain text" for i in range(200))
+    chunks = bf.chunk_text(text, 300, 60, "lines")
+    covers(text, chunks)
+    for before, after in zip(chunks, chunks[1:]):
+        carried = before["end_line"] + 1 - after["start_line"]
+        assert carried > 0 and carried * len("line 000 of plain text\n") <= 60
+
+
+def test_invalid_python_falls_back_to_indentation(bf):
+    text = "{% for item in items %}\n" + PYTHON
+    chunks = bf.chunk_text(text, 400, 50, "python")
+    covers(text, chunks)
+    depths = bf.indent_boundaries(text.split("\n"))
+    assert all(depths[chunk["start_line"]] is not None for chunk in chunks)
+    assert chunks == bf.chunk_text(text, 400, 50, "indent")
+
+
+def test_a_long_line_is_a_chunk_of_its_own(bf):
+    text = "short\n" + "x" * 500 + "\nshort again"
+    chunks = bf.chunk_text(text, 100, 20, "lines")
+    covers(text, chunks)
+    assert "x" * 500 in [chunk["text"] for chunk in chunks]
+
+
+def test_auto_chunker_by_extension(bf, project):
+    project.config["embedding"]["chunker"] = "auto"
+    assert [bf.file_chunker(bf.Path(name), project.config) for name in ("a.py", "b.MD", "c.txt", "d.go")] == [
+        "python", "markdown", "lines", "indent"
+    ]
+
+
+def test_changing_chunk_settings_rechunks_the_index(project):
+    assert project.index()
+    before = project.query("SELECT MAX(length(content)) FROM documents")[0][0]
+    project.config["embedding"]["chunk_size"] = before // 3
+    assert project.index()
+    assert project.query("SELECT MAX(length(content)) FROM documents")[0][0] < before
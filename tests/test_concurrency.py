@@ -0,0 +1,56 @@
+"""Concurrent embedding: requests overlap on pooled keep-alive connections."""
+
+import threading
+import time
+
+
+def track_overlap(stub, delay: float = 0.02):
+    """Record the most embedding requests the stub served at once."""
+    embed = stub.embed
+    lock = threading.Lock()
+    state = {"active": 0, "peak": 0}
+
+    def overlapping_embed(texts):
+        with lock:
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+        try:
+            time.sleep(delay)
+            return embed(texts)
+        finally:
+            with lock:
+                state["active"] -= 1
+
+    stub.embed = overlapping_embed
+    return state
+
+
+def test_index_keeps_concurrency_requests_in_flight(project, stub):
+    project.config["embedding"].update({"batch_size": 4, "concurrency": 3})
+    state = track_overlap(stub)
+    assert project.index()
+    assert state["peak"] == 3
+
+
+def test_concurrent_index_stores_the_same_vectors(project, stub):
+    project.config["embedding"].update({"batch_size": 4, "concurrency": 1})
+    assert project.index()
+    sequential = project.query("""
+        SELECT d.file_path, d.start_line, e.embedding FROM documents d JOIN embeddings e ON e.doc_id = d.id
+        ORDER BY d.file_path, d.start_line
+    """)
+
+    project.config["embedding"]["concurrency"] = 4
+    project.config["embedding"]["cache_max_entries"] = 0
+    assert project.index(rebuild=True)
+    assert project.query("""
+        SELECT d.file_path, d.start_line, e.embedding FROM documents d JOIN embeddings e ON e.doc_id = d.id
+        ORDER BY d.file_path, d.start_line
+    """) == sequential
+
+
+def test_requests_reuse_the_thread_connection(project, stub, bf):
+    bf.embed_texts(["first request"], project.config)
+    connection = bf._http_local.connections[("http", f"127.0.0.1:{stub.port}")]
+    bf.embed_texts(["second request"], project.config)
+    assert bf._http_local.connections[("http", f"127.0.0.1:{stub.port}")] is connection
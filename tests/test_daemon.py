@@ -0,0 +1,70 @@
+"""Search daemon: answers match the in-process commands."""
+
+import json
+import os
+import shutil
+
+import pytest
+
+
+@pytest.fixture
+def daemon(project, bf, monkeypatch):
+    """Serve the indexed project on the daemon socket; yields the requests it was sent."""
+    assert project.index()
+    server = bf.start_daemon_socket(bf.ResidentIndex(project.db_path, project.config))
+    assert server is not None
+    requests = []
+    query_daemon = bf.query_daemon
+
+    def recording_query_daemon(request, *args, **kwargs):
+        requests.append(request)
+        response = query_daemon(request, *args, **kwargs)
+        assert response is not None
+        return response
+
+    monkeypatch.setattr(bf, "query_daemon", recording_query_daemon)
+    yield requests
+    server.shutdown()
+    server.server_close()
+    os.unlink(bf.DAEMON_SOCKET)
+
+
+def ranked(output: str):
+    return [(r["file_path"], r["start_line"], round(r["similarity"], 5)) for r in json.loads(output)]
+
+
+def test_daemon_search_matches_no_daemon(daemon, cli, queries):
+    for query in queries:
+        served = ranked(cli("search", query, "--json"))
+        assert served
+        assert served == ranked(cli("search", query, "--json", "--no-daemon"))
+    assert len(daemon) == len(queries)
+
+
+def test_daemon_similar_gets_a_project_relative_path(daemon, cli, project):
+    file_path = project.query(
+        "SELECT file_path FROM documents WHERE file_path LIKE 'src/%' ORDER BY file_path LIMIT 1"
+    )[0][0]
+    expected = ranked(cli("similar", file_path, "--json", "--no-daemon"))
+    assert expected
+
+    for spelling in (file_path, "./" + file_path, str(project.root / file_path)):
+        assert ranked(cli("similar", spelling, "--json")) == expected
+        assert daemon[-1]["file"] == file_path
+
+
+def test_resident_index_applies_index_changes(project, queries, bf):
+    assert project.index()
+    index = bf.ResidentIndex(project.db_path, project.config)
+    chunks = len(index)
+
+    shutil.rmtree(project.root / "docs")
+    (project.root / "src" / "added.py").write_text("\n".join(f"def {query.replace(' ', '_')}():\n    pass\n" for query in queries))
+    assert project.index()
+
+    assert index.refresh(force=True)
+    assert len(index) == project.query("SELECT COUNT(*) FROM documents")[0][0] != chunks
+    for query in queries:
+        served = [(r["file_path"], r["start_line"]) for r in index.search(query, 10)]
+        assert served == project.rankings([query])[0]
+    assert not index.refresh(force=True)
@@ -0,0 +1,91 @@
+"""Embedding endpoints: weighted dispatch, failover, and only endpoints serving the configured model."""
+
+import threading
+import urllib.error
+
+import pytest
+
+
+@pytest.fixture
+def servers(bench, stub):
+    """Start extra stub servers like `stub`; all are stopped afterwards."""
+    started = []
+
+    def start(**kwargs):
+        server = bench.StubEmbeddingServer(**{"dimensions": stub.dimensions, **kwargs}).start()
+        started.append(server)
+        return server
+
+    yield start
+    for server in started:
+        server.stop()
+
+
+@pytest.fixture
+def dead(servers):
+    """The URL of a server that has gone away."""
+    server = servers()
+    server.stop()
+    return server.url
+
+
+def test_index_fails_over_from_a_dead_endpoint(project, queries, stub, dead):
+    assert project.index()
+    expected = project.rankings(queries)
+
+    project.config["embedding"]["endpoints"] = [dead, stub.url]
+    assert project.index(rebuild=True)
+    assert project.rankings(queries) == expected
+
+
+def test_all_endpoints_down(project, bf, dead):
+    project.config["embedding"]["endpoints"] = [dead]
+    with pytest.raises(urllib.error.URLError, match="no embedding endpoint reachable"):
+        bf.EndpointPool(project.config).embed(["some text"])
+
+
+def test_weighted_endpoints_share_load(project, bf, servers):
+    heavy, light = servers(latency=0.02), servers(latency=0.02)
+    project.config["embedding"]["endpoints"] = [{"url": heavy.url, "weight": 3}, light.url]
+    pool = bf.EndpointPool(project.config)
+
+    def work(n):
+        for i in range(10):
+            pool.embed([f"text {n} {i}"])
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    served = {e["url"]: e["requests"] for e in pool.summary()}
+    assert served[heavy.url] + served[light.url] == 80
+    assert served[heavy.url] > 2 * served[light.url] > 0
+
+
+def test_mismatched_endpoints_are_excluded(project, bf, bench, stub, servers, capsys):
+    dims = stub.dimensions
+    narrow = servers(dimensions=dims // 2)
+    other_model = servers()
+    other_model.embed = lambda texts: [[-x for x in bench.stub_embedding(text, dims)] for text in texts]
+    project.config["embedding"]["endpoints"] = [stub.url, narrow.url, other_model.url]
+    pool = bf.EndpointPool(project.config)
+
+    assert pool.check()
+    excluded = {e["url"]: e["excluded"] for e in pool.summary()}
+    assert excluded[stub.url] is None
+    assert f"{dims // 2}-dimensional" in excluded[narrow.url]
+    assert "different model" in excluded[other_model.url]
+    assert "not using it" in capsys.readouterr().err
+
+    for i in range(5):
+        assert pool.embed([f"text {i}"]) == [bench.stub_embedding(f"text {i}", dims)]
+    assert (narrow.stats()["requests"], other_model.stats()["requests"]) == (0, 0)
+
+
+@pytest.mark.parametrize("entry", [{"url": ""}, {"url": "http://x", "weight": 0}])
+def test_invalid_endpoint_entries(project, bf, entry):
+    project.config["embedding"]["endpoints"] = [entry]
+    with pytest.raises(ValueError):
+        bf.parse_endpoints(project.config)
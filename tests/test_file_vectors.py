@@ -0,0 +1,79 @@
+"""File vectors: `similar` and the near-duplicate report read stored vectors only."""
+
+import json
+import shutil
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def copied(project):
+    """Index the project with a copy of one source file; returns (original, copy)."""
+    assert project.index()
+    original = project.query(
+        "SELECT file_path FROM documents WHERE file_path LIKE 'src/%.py' ORDER BY file_path LIMIT 1"
+    )[0][0]
+    copy = "src/copy_of_original.py"
+    shutil.copyfile(original, copy)
+    assert project.index()
+    return original, copy
+
+
+def test_file_vector_is_the_mean_of_its_chunks(project, copied, bf):
+    original, _ = copied
+    conn = project.connect()
+    try:
+        precision = bf.get_embedding_precision(conn)
+        chunks = [bf.deserialize_embedding(blob, precision) for (blob,) in conn.execute("""
+            SELECT e.embedding FROM documents d JOIN embeddings e ON d.id = e.doc_id WHERE d.file_path = ?
+        """, (original,))]
+        (stored,) = conn.execute("SELECT embedding FROM file_vectors WHERE file_path = ?", (original,)).fetchone()
+    finally:
+        conn.close()
+    mean = np.mean(chunks, axis=0)
+    assert bf.deserialize_embedding(stored) == pytest.approx((mean / np.linalg.norm(mean)).tolist(), abs=1e-6)
+    assert (project.query("SELECT COUNT(DISTINCT file_path) FROM documents")
+            == project.query("SELECT COUNT(*) FROM file_vectors"))
+
+
+def test_similar_needs_no_embedding_server(project, stub, copied, cli):
+    original, copy = copied
+    stub.stop()
+    results = json.loads(cli("similar", original, "--json", "--no-daemon"))
+    assert original not in [r["file_path"] for r in results]
+    assert results[0]["file_path"] == copy
+    assert results[0]["similarity"] == pytest.approx(1.0)
+    assert results[0]["content"]
+
+
+def test_copies_cluster_together(project, copied, cli):
+    original, copy = copied
+    clusters = json.loads(cli("similar", "--all-pairs", "--json", "--threshold", "0.999"))
+    assert any({original, copy} <= set(cluster["files"]) for cluster in clusters)
+    for cluster in clusters:
+        assert all(pair["similarity"] >= 0.999 for pair in cluster["pairs"])
+
+
+def test_vectors_follow_edits_and_deletes(project, copied):
+    original, copy = copied
+    before = project.query("SELECT embedding FROM file_vectors WHERE file_path = ?", copy)
+    with open(copy, "a") as f:
+        f.write("\ndef appended_helper(value):\n    return value * 2\n")
+    assert project.index()
+    assert project.query("SELECT embedding FROM file_vectors WHERE file_path = ?", copy) != before
+
+    (project.root / copy).unlink()
+    assert project.index()
+    assert project.query("SELECT COUNT(*) FROM file_vectors WHERE file_path = ?", copy) == [(0,)]
+
+
+def test_duplicate_clusters_without_numpy_agree(project, copied, bf, monkeypatch):
+    conn = project.connect()
+    try:
+        fast = bf.duplicate_clusters(conn, project.config, 0.99)
+        monkeypatch.setattr(bf, "np", None)
+        slow = bf.duplicate_clusters(conn, project.config, 0.99)
+    finally:
+        conn.close()
+    assert [cluster["files"] for cluster in slow] == [cluster["files"] for cluster in fast]
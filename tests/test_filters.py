@@ -0,0 +1,67 @@
+"""Metadata filters: every scan returns the filtered top results of the full ranking."""
+
+import fnmatch
+import time
+
+import pytest
+
+FILTERS = [
+    ({"dirs": ["src/account_0"]}, lambda path: path.startswith("src/account_0/")),
+    ({"exts": ["md", ".yaml"]}, lambda path: path.endswith((".md", ".yaml"))),
+    ({"paths": ["src/*_1*.py"]}, lambda path: fnmatch.fnmatchcase(path, "src/*_1*.py")),
+    ({"dirs": ["src"], "exts": ["go"]}, lambda path: path.startswith("src/") and path.endswith(".go")),
+]
+
+BACKENDS = {
+    "scan": ({}, {}),
+    "vector_file": ({"vector_file": True}, {}),
+    "ann": ({"ann": True, "ann_lists": 4}, {"nprobe": 4}),
+    "sign_codes": ({"binary_codes": True}, {"shortlist": 10 ** 6}),
+}
+
+
+def scored(results):
+    return [(r["file_path"], r["start_line"], round(r["similarity"], 5)) for r in results]
+
+
+def assert_same_top(found, expected):
+    """Equal scores in order; hits may only differ among ties (duplicated chunks)."""
+    assert [score for _, _, score in found] == [score for _, _, score in expected]
+    cutoff = expected[-1][2]
+    assert {hit for hit in found if hit[2] > cutoff} == {hit for hit in expected if hit[2] > cutoff}
+
+
+@pytest.mark.parametrize("backend", sorted(BACKENDS))
+def test_filtered_search_is_the_filtered_ranking(project, queries, backend):
+    settings, search_options = BACKENDS[backend]
+    project.config["index"].update(settings)
+    assert project.index()
+    chunks = project.query("SELECT COUNT(*) FROM documents")[0][0]
+
+    for query in queries[:4]:
+        ranking = scored(project.search(query, limit=chunks, nprobe=0, shortlist=0))
+        for filters, matches in FILTERS:
+            expected = [hit for hit in ranking if matches(hit[0])][:10]
+            assert expected
+            assert_same_top(scored(project.search(query, filters=filters, **search_options)), expected)
+
+
+def test_doc_type_and_filters_combine(project, queries):
+    assert project.index()
+    for result in project.search(queries[0], doc_type="code", filters={"exts": ["md"]}, limit=50):
+        assert result["doc_type"] == "code" and result["file_path"].endswith(".md")
+
+
+def test_since_keeps_recently_changed_files(project, queries, bf):
+    assert project.index()
+    path = project.query(
+        "SELECT file_path FROM documents WHERE file_path LIKE 'src/%' ORDER BY file_path LIMIT 1"
+    )[0][0]
+    with open(path, "a") as f:
+        f.write("\n# changed just now\n")
+    assert project.index()
+
+    filters = bf.search_filters(since=str(time.time() - 30))
+    results = project.search(queries[0], filters=filters, limit=50)
+    assert {r["file_path"] for r in results} == {path}
+    assert bf.search_filters(since="1h")["since"] < time.time_ns()
@@ -0,0 +1,62 @@
+"""Bulk ingestion: WAL writes, stale-row pruning and --rebuild."""
+
+import shutil
+
+
+def orphans(project):
+    """Rows left pointing at chunks or files that are gone, per table."""
+    counts = {
+        table: project.query(
+            f"SELECT COUNT(*) FROM {table} WHERE doc_id NOT IN (SELECT id FROM documents)"
+        )[0][0]
+        for table in ("embeddings", "ivf_assignments", "sign_codes", "rescore_vectors")
+    }
+    counts["file_vectors"] = project.query(
+        "SELECT COUNT(*) FROM file_vectors WHERE file_path NOT IN (SELECT file_path FROM documents)"
+    )[0][0]
+    return {table: count for table, count in counts.items() if count}
+
+
+def files(project):
+    return {path for (path,) in project.query("SELECT file_path FROM file_manifest")}
+
+
+def test_index_writes_in_wal_mode(project):
+    assert project.index()
+    assert project.query("PRAGMA journal_mode") == [("wal",)]
+
+
+def test_removed_files_are_pruned(project):
+    project.config["index"].update({"ann": True, "binary_codes": True})
+    assert project.index()
+    before = files(project)
+    removed = sorted(path for path in before if path.startswith("src/"))[:2]
+    for path in removed:
+        (project.root / path).unlink()
+    shutil.rmtree(project.root / "docs")
+
+    assert project.index()
+    assert files(project) == {path for path in before
+                              if path not in removed and not path.startswith("docs/")}
+    assert {path for (path,) in project.query("SELECT DISTINCT file_path FROM documents")} == files(project)
+    assert orphans(project) == {}
+    # The full-text index follows the documents table through its triggers
+    assert (project.query("SELECT COUNT(*) FROM documents_fts")
+            == project.query("SELECT COUNT(*) FROM documents"))
+
+
+def test_newly_excluded_files_are_pruned(project):
+    assert project.index()
+    project.config["index"]["exclude_patterns"] = project.config["index"]["exclude_patterns"] + ["docs"]
+    assert project.index()
+    assert not any(path.startswith("docs/") for path in files(project))
+    assert orphans(project) == {}
+
+
+def test_rebuild_recreates_the_same_index(project):
+    assert project.index()
+    chunks = project.query("SELECT file_path, start_line, end_line, content FROM documents ORDER BY 1, 2")
+
+    assert project.index(rebuild=True)
+    assert project.query("SELECT file_path, start_line, end_line, content FROM documents ORDER BY 1, 2") == chunks
+    assert orphans(project) == {}
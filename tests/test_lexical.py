@@ -0,0 +1,63 @@
+"""Full-text and hybrid search over the FTS5 index."""
+
+import pytest
+
+IDENTIFIER = "frobnicate_quux_handler"
+
+
+@pytest.fixture
+def marked(project):
+    """Index the project with a rare identifier added to one file."""
+    path = project.root / "src" / "marked.py"
+    path.write_text(f"def {IDENTIFIER}(request):\n    return request\n")
+    assert project.index()
+    return "src/marked.py"
+
+
+def hits(results):
+    return [(r["file_path"], r["start_line"]) for r in results]
+
+
+def test_lexical_search_needs_no_embedding_server(project, stub, marked):
+    stub.stop()
+    results = project.search(IDENTIFIER, mode="lexical")
+    assert results[0]["file_path"] == marked
+    # An identifier's tokens match as one phrase, not anywhere in a chunk
+    assert project.search("quux_frobnicate", mode="lexical") == []
+
+
+def test_hybrid_fuses_both_rankings(project, marked, bf):
+    depth = bf.HYBRID_DEPTH
+    lexical = hits(project.search(IDENTIFIER, mode="lexical", limit=depth))
+    semantic = hits(project.search(IDENTIFIER, mode="semantic", limit=depth))
+    hybrid = hits(project.search(IDENTIFIER, mode="hybrid", limit=10))
+
+    assert hybrid[0] == (marked, 0)
+    assert set(hybrid) <= set(lexical) | set(semantic)
+
+
+def test_prefilter_scores_only_full_text_matches(project, marked):
+    lexical = hits(project.search("render socket", mode="lexical", limit=20))
+    assert len(lexical) == 20
+    prefiltered = hits(project.search("render socket", prefilter=20, limit=10))
+    assert set(prefiltered) <= set(lexical)
+    # Ranked as the full scan ranks those chunks
+    chunks = project.query("SELECT COUNT(*) FROM documents")[0][0]
+    scanned = hits(project.search("render socket", limit=chunks))
+    assert prefiltered == [hit for hit in scanned if hit in lexical][:10]
+
+
+def test_reciprocal_rank_fusion(bf):
+    fused = bf.reciprocal_rank_fusion([[(1, 0.9), (2, 0.8), (3, 0.7)], [(3, 9.0), (1, 5.0)]], 3)
+    assert [doc_id for doc_id, _ in fused] == [1, 3, 2]
+    assert fused[0][1] == pytest.approx(1 / (bf.RRF_K + 1) + 1 / (bf.RRF_K + 2))
+
+
+@pytest.mark.parametrize("query, expected", [
+    ('get_embedding', '"get_embedding"'),
+    ('parse "exact phrase" now', '"parse" OR "exact phrase" OR "now"'),
+    ('a:b OR NOT -', '"a:b" OR "OR" OR "NOT"'),
+    ('" * ', ''),
+])
+def test_fts_query_quotes_every_term(bf, query, expected):
+    assert bf.fts_query(query) == expected
@@ -0,0 +1,73 @@
+"""Run metrics: stage timings, request latencies and cache hit rates, as JSON or Prometheus text."""
+
+import atexit
+import json
+import re
+import time
+
+import pytest
+
+
+@pytest.fixture
+def metrics(bf, monkeypatch):
+    """A fresh METRICS for the test."""
+    fresh = bf.Metrics()
+    monkeypatch.setattr(bf, "METRICS", fresh)
+    return fresh
+
+
+def test_index_run_is_measured(project, stub, metrics):
+    assert project.index()
+    snapshot = metrics.snapshot("index", project.config)
+    stages = snapshot["stages"]
+    files = project.query("SELECT COUNT(*) FROM file_manifest")[0][0]
+    chunks = project.query("SELECT COUNT(*) FROM documents")[0][0]
+
+    assert stages["read"]["calls"] == files
+    assert stages["read"]["bytes"] == sum(size for (size,) in project.query("SELECT size FROM file_manifest"))
+    # Duplicated chunks are embedded once
+    cache = snapshot["caches"]["embedding_cache"]
+    assert stages["embed"]["items"] == stub.stats()["texts"] == cache["misses"]
+    assert cache["hits"] + cache["misses"] == chunks
+    assert snapshot["latency_seconds"]["embed"]["count"] == stub.stats()["requests"]
+    assert snapshot["settings"]["dimensions"] == project.config["embedding"]["dimensions"]
+
+
+def test_nested_stages_are_not_counted_twice(bf, metrics):
+    with bf.metrics_stage("outer"):
+        time.sleep(0.01)
+        with bf.metrics_stage("inner", size=10, items=2):
+            time.sleep(0.1)
+    stages = metrics.snapshot("test", bf.DEFAULT_CONFIG)["stages"]
+    assert 0.01 <= stages["outer"]["seconds"] < 0.1 <= stages["inner"]["seconds"]
+    assert (stages["inner"]["bytes"], stages["inner"]["items"]) == (10, 2)
+
+
+def test_latency_summary_percentiles(bf):
+    summary = bf.latency_summary([i / 100 for i in range(100, 0, -1)])
+    assert summary == {"count": 100, "mean": 0.505, "p50": 0.5, "p90": 0.9, "p99": 0.99, "max": 1.0}
+
+
+def test_search_metrics_on_the_command_line(project, cli, monkeypatch, capsys, tmp_path, metrics):
+    assert project.index()
+    handlers = []
+    monkeypatch.setattr(atexit, "register", lambda *args: handlers.append(args))
+    textfile = tmp_path / "bf.prom"
+
+    cli("search", "render socket", "--metrics", "json", "--metrics-textfile", str(textfile))
+    cli("search", "render socket", "--metrics", "json")
+    function, *args = handlers[-1]
+    function(*args)
+
+    snapshot = json.loads(capsys.readouterr().err)
+    assert snapshot["command"] == "search"
+    assert snapshot["caches"]["query_cache"] == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+
+    function, *args = handlers[0]
+    function(*args)
+    text = textfile.read_text()
+    assert '# TYPE bf_stage_seconds gauge' in text
+    assert re.search(r'^bf_cache_hit_ratio\{command="search",cache="query_cache"\} 0\.5$', text, re.M)
+    for line in text.splitlines():
+        if not line.startswith("#"):
+            assert re.fullmatch(r'bf_\w+\{command="search"(,\w+="[^"]*")*\} [0-9.e+-]+', line), line
@@ -0,0 +1,46 @@
+"""Read pipeline: files prepared in worker processes index exactly as in one process."""
+
+from pathlib import Path
+
+
+def snapshot(project):
+    return project.query("""
+        SELECT d.file_path, d.chunk_index, d.start_line, d.end_line, d.content, d.file_hash, d.doc_type,
+               e.embedding
+        FROM documents d JOIN embeddings e ON d.id = e.doc_id ORDER BY d.file_path, d.chunk_index
+    """)
+
+
+def test_read_workers_build_the_same_index(project, queries):
+    project.config["index"]["read_workers"] = 1
+    assert project.index()
+    expected = snapshot(project), project.rankings(queries)
+
+    project.config["index"]["read_workers"] = 3
+    assert project.index(rebuild=True)
+    assert (snapshot(project), project.rankings(queries)) == expected
+
+
+def test_prepare_files_keeps_candidate_order(project, bf):
+    candidates = [(path, "code", path.stat()) for path in sorted(Path("src").rglob("*.py"))[:12]]
+    serial = list(bf.prepare_files(candidates, {}, project.config, 1))
+    pooled = list(bf.prepare_files(candidates, {}, project.config, 3))
+    assert [item[0] for item in pooled] == [path for path, _, _ in candidates]
+    # Timings differ; status, hash and chunks don't
+    assert [item[3][:3] for item in pooled] == [item[3][:3] for item in serial]
+
+
+def test_known_hashes_skip_chunking(project, bf):
+    candidates = [(path, "code", path.stat()) for path in sorted(Path("src").rglob("*.py"))[:6]]
+    first = {str(path): prepared[1] for path, _, _, prepared in bf.prepare_files(candidates, {}, project.config, 2)}
+    again = list(bf.prepare_files(candidates, first, project.config, 2))
+    assert {prepared[0] for *_, prepared in again} == {"unchanged"}
+    assert all(prepared[2] is None for *_, prepared in again)
+
+
+def test_unreadable_file_fails_alone(project, bf):
+    paths = sorted(Path("src").rglob("*.py"))[:4]
+    candidates = [(path, "code", path.stat()) for path in paths]
+    paths[1].unlink()
+    statuses = [prepared[0] for *_, prepared in bf.prepare_files(candidates, {}, project.config, 2)]
+    assert statuses == ["changed", "error", "changed", "changed"]
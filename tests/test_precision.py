@@ -0,0 +1,51 @@
+"""Embedding precision: float16/int8 shrink search.db and keep rankings."""
+
+
+def table_bytes(project, table: str) -> int:
+    return project.query(f"SELECT COALESCE(SUM(length(embedding)), 0) FROM {table}")[0][0]
+
+
+def test_lower_precision_shrinks_search_db(project):
+    assert project.index()
+    sizes = {"float32": project.db_path.stat().st_size}
+    vectors = {"float32": table_bytes(project, "embeddings")}
+
+    for precision in ("float16", "int8"):
+        project.config["index"]["embedding_precision"] = precision
+        assert project.index()
+        sizes[precision] = project.db_path.stat().st_size
+        vectors[precision] = table_bytes(project, "embeddings")
+        # Rescoring is opt-in, so no float32 copies are kept by default
+        assert table_bytes(project, "rescore_vectors") == 0
+
+    assert sizes["int8"] < sizes["float16"] < sizes["float32"]
+    assert vectors["float16"] * 2 == vectors["float32"]
+    assert vectors["int8"] * 3 < vectors["float32"]
+
+
+def test_rescoring_keeps_copies_only_while_enabled(project):
+    project.config["index"].update({"embedding_precision": "int8", "rescore_candidates": 50})
+    assert project.index()
+    chunks = project.query("SELECT COUNT(*) FROM documents")[0][0]
+    assert project.query("SELECT COUNT(*) FROM rescore_vectors") == [(chunks,)]
+
+    project.config["index"]["rescore_candidates"] = 0
+    assert project.index()
+    assert project.query("SELECT COUNT(*) FROM rescore_vectors") == [(0,)]
+
+
+def test_precision_round_trip_keeps_rankings(project, queries):
+    project.config["index"]["rescore_candidates"] = 50
+    assert project.index()
+    exact = project.rankings(queries)
+    vectors = project.query("SELECT doc_id, embedding FROM embeddings ORDER BY doc_id")
+
+    project.config["index"]["embedding_precision"] = "int8"
+    assert project.index()
+    # Rescoring the int8 shortlist at full precision restores the exact order
+    assert project.rankings(queries) == exact
+
+    project.config["index"]["embedding_precision"] = "float32"
+    assert project.index()
+    assert project.query("SELECT doc_id, embedding FROM embeddings ORDER BY doc_id") == vectors
+    assert project.rankings(queries) == exact
@@ -0,0 +1,53 @@
+"""Query embedding cache: a repeated query never reaches the embedding server."""
+
+import pytest
+
+
+@pytest.fixture
+def indexed(project, stub):
+    assert project.index()
+    return stub.stats()["requests"]
+
+
+def test_repeated_query_is_a_hit(project, stub, indexed):
+    first, second = {}, {}
+    results = project.search("render the socket", stats=first)
+    assert stub.stats()["requests"] == indexed + 1
+
+    # Whitespace is normalized, so this is the same query
+    assert project.search("  render   the socket ", stats=second) == results
+    assert stub.stats()["requests"] == indexed + 1
+    assert (first["query_cache"], second["query_cache"]) == ("miss", "hit")
+    assert (second["query_cache_hits"], second["query_cache_misses"]) == (1, 1)
+
+
+def test_least_recently_used_queries_are_evicted(project, stub, indexed):
+    project.config["embedding"]["query_cache_max_entries"] = 2
+    for query in ("first query", "second query", "first query", "third query"):
+        project.search(query)
+    assert project.query("SELECT COUNT(*) FROM query_cache") == [(2,)]
+
+    requests = stub.stats()["requests"]
+    project.search("first query")
+    assert stub.stats()["requests"] == requests
+    project.search("second query")
+    assert stub.stats()["requests"] == requests + 1
+
+
+def test_cache_is_keyed_by_model(project, stub, indexed, bf):
+    conn = project.connect()
+    try:
+        bf.get_query_embedding(conn, "parse config", project.config)
+        other = dict(project.config, embedding=dict(project.config["embedding"], model="other-embed"))
+        bf.get_query_embedding(conn, "parse config", other)
+    finally:
+        conn.close()
+    assert stub.stats()["requests"] == indexed + 2
+
+
+def test_disabled_cache_always_embeds(project, stub, indexed):
+    project.config["embedding"]["query_cache_max_entries"] = 0
+    project.search("render the socket")
+    project.search("render the socket")
+    assert stub.stats()["requests"] == indexed + 2
+    assert project.query("SELECT COUNT(*) FROM query_cache") == [(0,)]
@@ -0,0 +1,72 @@
+"""Index journal: a run stopped by a dead embedding server resumes where it left off."""
+
+import threading
+
+
+def kill_after(stub, bench, requests: int):
+    """Make the stub server die while answering its `requests`+1'th embedding request."""
+    embed = stub.embed
+    state = {"left": requests, "dead": False}
+    # Dropped connections are the point; keep their tracebacks off stderr
+    stub.server.handle_error = lambda request, client_address: None
+
+    def dying_embed(texts):
+        if texts != [bench.ENDPOINT_PROBE]:
+            if state["left"] == 0 and not state["dead"]:
+                state["dead"] = True
+                threading.Thread(target=stub.stop).start()
+            if state["dead"]:
+                raise ConnectionResetError("embedding server killed")
+            state["left"] -= 1
+        return embed(texts)
+
+    stub.embed = dying_embed
+    return embed
+
+
+def test_resume_reembeds_only_unfinished_jobs(project, stub, bench, bf, monkeypatch):
+    project.config["embedding"].update({"batch_size": 4, "concurrency": 1})
+    # Checkpoint after every file, so the kill lands between committed files
+    monkeypatch.setattr(bf.EmbeddingBatcher, "CHECKPOINT_INTERVAL", 0.0)
+    embed = kill_after(stub, bench, requests=10)
+
+    assert project.index() is False
+
+    jobs = dict(project.query("SELECT file_path, status FROM index_jobs"))
+    done = {path for path, status in jobs.items() if status == "done"}
+    unfinished = set(jobs) - done
+    assert done and unfinished
+    # Committed files are complete: every stored chunk has its embedding
+    assert project.query("""
+        SELECT COUNT(*) FROM documents d
+        WHERE NOT EXISTS (SELECT 1 FROM embeddings e WHERE e.doc_id = d.id)
+    """) == [(0,)]
+    assert {path for (path,) in project.query("SELECT DISTINCT file_path FROM documents")} <= done
+    done_rows = project.query("SELECT id, file_path FROM documents ORDER BY id")
+
+    # Restart the server on the same port and record what gets embedded
+    embedded = []
+    stub.embed = lambda texts: embedded.extend(texts) or embed(texts)
+    stub.start()
+    monkeypatch.setattr(bf, "_endpoint_pools", {})
+
+    assert project.index(resume=True) is True
+
+    assert project.query("SELECT COUNT(*) FROM index_jobs WHERE status != 'done'") == [(0,)]
+    assert project.query("""
+        SELECT COUNT(*) FROM documents d
+        WHERE NOT EXISTS (SELECT 1 FROM embeddings e WHERE e.doc_id = d.id)
+    """) == [(0,)]
+    # Files finished before the kill kept their rows untouched
+    assert project.query(
+        f"SELECT id, file_path FROM documents WHERE file_path IN ({','.join('?' * len(done))}) ORDER BY id",
+        *done,
+    ) == done_rows
+    # and only chunks of the unfinished files went to the server
+    texts = [bench.ENDPOINT_PROBE] + [
+        content for path, content in project.query("SELECT file_path, content FROM documents")
+        if path in unfinished
+    ]
+    assert embedded
+    assert set(embedded) <= set(texts)
+    assert {path for (path,) in project.query("SELECT DISTINCT file_path FROM documents")} == set(jobs)
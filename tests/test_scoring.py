@@ -0,0 +1,30 @@
+"""Vectorized scoring: NumPy and the pure Python fallback rank alike."""
+
+import random
+
+import pytest
+
+
+def random_rows(bf, count: int, dims: int, seed: int = 0):
+    rng = random.Random(seed)
+    return [(doc_id, bf.serialize_embedding(bf.normalize_embedding([rng.gauss(0, 1) for _ in range(dims)])))
+            for doc_id in range(count)]
+
+
+@pytest.mark.parametrize("limit", [1, 10, 500])
+def test_numpy_top_k_matches_python(bf, limit):
+    rows = random_rows(bf, 300, 32)
+    query = [random.Random(1).gauss(0, 1) for _ in range(32)]
+
+    exact = bf.score_python(rows, query, limit)
+    fast = bf.score_numpy(rows, query, limit)
+    assert [doc_id for doc_id, _ in fast] == [doc_id for doc_id, _ in exact]
+    assert [score for _, score in fast] == pytest.approx([score for _, score in exact], abs=1e-5)
+    assert len(fast) == min(limit, len(rows))
+
+
+def test_search_without_numpy_ranks_alike(project, queries, bf, monkeypatch):
+    assert project.index()
+    expected = project.rankings(queries)
+    monkeypatch.setattr(bf, "np", None)
+    assert project.rankings(queries) == expected
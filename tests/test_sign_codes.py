@@ -0,0 +1,54 @@
+"""Sign-code prefilter: with no shortlist, or a full one, search matches the exact scan."""
+
+import random
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def coded(project, queries):
+    """Exact rankings, then the same project indexed with sign codes."""
+    assert project.index()
+    exact = project.rankings(queries)
+    project.config["index"].update({"binary_codes": True, "binary_shortlist": 20})
+    assert project.index()
+    return exact
+
+
+def test_every_chunk_gets_a_code(project, coded):
+    assert (project.query("SELECT COUNT(*) FROM sign_codes")
+            == project.query("SELECT COUNT(*) FROM embeddings"))
+
+
+def test_shortlist_zero_is_the_exact_scan(project, queries, coded):
+    assert project.rankings(queries, shortlist=0) == coded
+
+
+def test_full_shortlist_matches_the_exact_scan(project, queries, coded):
+    chunks = project.query("SELECT COUNT(*) FROM embeddings")[0][0]
+    assert project.rankings(queries, shortlist=chunks) == coded
+
+
+def test_sign_code_packs_like_numpy(bf):
+    rng = random.Random(0)
+    vector = [rng.gauss(0, 1) for _ in range(70)]
+    assert bf.sign_code(vector) == np.packbits(np.array(vector) > 0).tobytes()
+
+
+def test_hamming_shortlist_without_numpy_agrees(bf, monkeypatch):
+    rng = random.Random(1)
+    rows = [(doc_id, bytes(rng.getrandbits(8) for _ in range(8))) for doc_id in range(200)]
+    query = bytes(rng.getrandbits(8) for _ in range(8))
+
+    def distance(code):
+        return bin(int.from_bytes(code, "big") ^ int.from_bytes(query, "big")).count("1")
+
+    fast = bf.hamming_shortlist(rows, query, 25)
+    monkeypatch.setattr(bf, "np", None)
+    slow = bf.hamming_shortlist(rows, query, 25)
+    codes = dict(rows)
+    # Ties at the cut may pick different ids, never different distances
+    nearest = sorted(distance(code) for _, code in rows)[:25]
+    assert sorted(distance(codes[doc_id]) for doc_id in fast) == nearest
+    assert sorted(distance(codes[doc_id]) for doc_id in slow) == nearest
@@ -0,0 +1,42 @@
+"""Streaming scan: vectors are scored a batch at a time, and only the results are hydrated."""
+
+
+def test_small_scan_batches_rank_alike(project, queries, bf, monkeypatch):
+    assert project.index()
+    expected = project.rankings(queries)
+
+    sizes = []
+    score_numpy = bf.score_numpy
+
+    def recording_score_numpy(rows, *args, **kwargs):
+        sizes.append(len(rows))
+        return score_numpy(rows, *args, **kwargs)
+
+    monkeypatch.setattr(bf, "score_numpy", recording_score_numpy)
+    project.config["index"]["scan_batch"] = 7
+    assert project.rankings(queries) == expected
+    assert max(sizes) == 7
+    assert sum(sizes) == len(queries) * project.query("SELECT COUNT(*) FROM embeddings")[0][0]
+
+
+def test_pure_python_scan_ranks_alike(project, queries, bf, monkeypatch):
+    assert project.index()
+    expected = project.rankings(queries)
+    monkeypatch.setattr(bf, "np", None)
+    project.config["index"]["scan_batch"] = 7
+    assert project.rankings(queries) == expected
+
+
+def test_only_results_are_hydrated(project, bf, monkeypatch):
+    assert project.index()
+    hydrated = []
+    hydrate_results = bf.hydrate_results
+
+    def recording_hydrate_results(conn, scored):
+        hydrated.append(len(scored))
+        return hydrate_results(conn, scored)
+
+    monkeypatch.setattr(bf, "hydrate_results", recording_hydrate_results)
+    results = project.search("render socket", limit=5)
+    assert hydrated == [5]
+    assert all(result["content"] for result in results)
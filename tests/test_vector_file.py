@@ -0,0 +1,53 @@
+"""Memory-mapped vector file: search over it matches the search.db scan."""
+
+import pytest
+
+
+@pytest.fixture
+def exact(project, queries):
+    """Rankings from scanning search.db."""
+    assert project.index()
+    return project.rankings(queries)
+
+
+def scan_disabled(bf, monkeypatch):
+    def no_scan(*args, **kwargs):
+        raise AssertionError("search.db was scanned instead of the vector file")
+
+    monkeypatch.setattr(bf, "score_embeddings", no_scan)
+
+
+def test_vector_file_search_matches_scan(project, queries, exact, bf, monkeypatch):
+    code = project.rankings(queries, doc_type="code")
+    project.config["index"]["vector_file"] = True
+    assert project.index()
+    assert (project.root / ".branch-flow" / "index" / "vectors-code.bin").exists()
+
+    scan_disabled(bf, monkeypatch)
+    assert project.rankings(queries) == exact
+    assert project.rankings(queries, doc_type="code") == code
+
+
+def test_vector_file_follows_edits(project, queries, exact):
+    project.config["index"]["vector_file"] = True
+    assert project.index()
+
+    path = project.query(
+        "SELECT file_path FROM documents WHERE file_path LIKE 'src/%' ORDER BY file_path LIMIT 1"
+    )[0][0]
+    with open(path, "w") as f:
+        f.write(" ".join(queries) + "\n")
+    assert project.index()
+    with_file = project.rankings(queries)
+
+    project.config["index"]["vector_file"] = False
+    assert project.rankings(queries) == with_file
+    assert any(hit[0] == path for ranking in with_file for hit in ranking)
+
+
+def test_float16_vector_file_keeps_rankings(project, queries, exact, bf, monkeypatch):
+    project.config["index"].update({"vector_file": True, "vector_file_dtype": "float16"})
+    assert project.index()
+    scan_disabled(bf, monkeypatch)
+    matches = sum(ranking[:5] == expected[:5] for ranking, expected in zip(project.rankings(queries), exact))
+    assert matches >= len(queries) - 1
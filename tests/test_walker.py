@@ -0,0 +1,79 @@
+"""Pruning walker: finds what should_index_file accepts, without entering excluded trees."""
+
+import copy
+import subprocess
+from pathlib import Path
+
+import pytest
+
+TREE = {
+    "src/app.py": "print('app')\n",
+    "src/util/helpers.ts": "export const x = 1;\n",
+    "src/notes.txt": "notes\n",
+    "src/logo.png": "not indexed\n",
+    "src/package-lock.json": "{}\n",
+    "src/big.py": "x = 1\n" * 100000,  # over max_file_size_kb
+    "node_modules/lib/index.js": "module.exports = 1;\n",
+    "pkg/node_modules/dep.py": "dep = 1\n",
+    "build/out.py": "out = 1\n",
+    ".branch-flow/index/meta.json": "{}\n",
+    ".branch-flow/memory/decisions.md": "# Decisions\n",
+    "logs/today.py": "log = 1\n",
+    "logs/keep.py": "keep = 1\n",
+    "docs/guide.md": "# Guide\n",
+    "docs/draft.tmp.md": "# Draft\n",
+    ".gitignore": "logs/*\n!logs/keep.py\n*.tmp.md\n",
+}
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    for rel, content in TREE.items():
+        path = tmp_path / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def config(bf):
+    return copy.deepcopy(bf.DEFAULT_CONFIG)
+
+
+def reference(bf, config):
+    """The files a full rglob filtered by should_index_file would index."""
+    return sorted(path.relative_to(".") for path in Path(".").rglob("*")
+                  if path.is_file() and bf.should_index_file(path, config))
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_walker_matches_filtered_rglob(tree, bf, config, workers):
+    config["index"]["walk_workers"] = workers
+    directories = []
+    found = bf.walk_files(Path("."), config, directories=directories)
+
+    assert found == reference(bf, config)
+    assert Path("src/app.py") in found and Path("src/big.py") not in found
+    # Excluded directories are pruned, never scanned
+    assert "node_modules" not in directories
+    assert "pkg/node_modules" not in directories
+    assert ".branch-flow/index" not in directories
+    assert ".branch-flow/memory" in directories
+
+
+def test_walker_skips_given_paths(tree, bf, config):
+    found = bf.walk_files(Path("."), config, skip={"src/app.py"})
+    assert Path("src/app.py") not in found
+    assert Path("src/notes.txt") in found
+
+
+def test_respect_gitignore_matches_git(tree, bf, config):
+    config["index"]["respect_gitignore"] = True
+    subprocess.run(["git", "init", "-q"], check=True)
+    listed = subprocess.run(["git", "ls-files", "--others", "--exclude-standard"],
+                            check=True, capture_output=True, text=True).stdout.split()
+
+    found = bf.walk_files(Path("."), config)
+    assert found == sorted(Path(rel) for rel in listed if bf.should_index_file(Path(rel), config))
+    assert Path("logs/keep.py") in found and Path("logs/today.py") not in found
@@ -0,0 +1,112 @@
+"""Watch mode: watched changes update the index, and a failure does not lose the rest of a burst."""
+
+import shutil
+
+import pytest
+
+
+@pytest.fixture
+def edited(project):
+    """Index the project, then append a marker line to three of its files."""
+    assert project.index()
+    paths = [path for (path,) in project.query(
+        "SELECT DISTINCT file_path FROM documents WHERE file_path LIKE '%.py' ORDER BY file_path LIMIT 3"
+    )]
+    for i, path in enumerate(paths):
+        with open(path, "a") as f:
+            f.write(f"\n# edited marker {i} {'POISON' if i == 1 else 'fine'}\n")
+    return paths
+
+
+def marked(project, path: str) -> bool:
+    return bool(project.query(
+        "SELECT COUNT(*) FROM documents WHERE file_path = ? AND content LIKE '%edited marker%'", path
+    )[0][0])
+
+
+def test_update_reindexes_files_rolled_back_with_a_failure(project, edited, bf, monkeypatch):
+    project.config["embedding"].update({"batch_size": 1, "concurrency": 1})
+    embed = bf.embed_with_retry
+
+    def rejecting_embed(texts, config):
+        if any("POISON" in text for text in texts):
+            raise ValueError("chunk rejected")
+        return embed(texts, config)
+
+    monkeypatch.setattr(bf, "embed_with_retry", rejecting_embed)
+    conn = bf.init_database(project.db_path, project.config["embedding"]["dimensions"])
+    try:
+        failed = bf.update_paths(conn, edited, project.config, verbose=False)
+    finally:
+        conn.close()
+
+    assert failed == [edited[1]]
+    assert marked(project, edited[0]) and marked(project, edited[2])
+    # The failing file keeps its previous, complete rows
+    assert not marked(project, edited[1])
+    assert project.query("""
+        SELECT COUNT(*) FROM documents d
+        WHERE NOT EXISTS (SELECT 1 FROM embeddings e WHERE e.doc_id = d.id)
+    """) == [(0,)]
+
+
+def test_update_returns_every_path_while_the_server_is_down(project, edited, stub, bf, monkeypatch):
+    stub.stop()
+    conn = bf.init_database(project.db_path, project.config["embedding"]["dimensions"])
+    try:
+        assert bf.update_paths(conn, edited, project.config, verbose=False) == sorted(edited)
+        assert not any(marked(project, path) for path in edited)
+
+        stub.start()
+        monkeypatch.setattr(bf, "_endpoint_pools", {})
+        assert bf.update_paths(conn, edited, project.config, verbose=False) == []
+    finally:
+        conn.close()
+    assert all(marked(project, path) for path in edited)
+
+
+def collect(watcher, timeout: float = 0.2):
+    """Poll until a quiet interval; the union of the reported paths."""
+    changed = set()
+    while True:
+        more = watcher.poll(timeout)
+        assert more is not None
+        if not more:
+            return changed
+        changed |= more
+
+
+@pytest.mark.parametrize("kind", ["inotify", "polling"])
+def test_watched_changes_update_the_index(project, stub, bf, kind):
+    assert project.index()
+    if kind == "inotify":
+        watcher = bf.InotifyWatcher(project.config)
+    else:
+        watcher = bf.PollingWatcher(project.config, interval=0.05)
+    sources = sorted((project.root / "src").rglob("*.py"))
+    try:
+        with open(sources[0], "a") as f:
+            f.write("\ndef watched_edit():\n    return 'edited while watching'\n")
+        sources[1].rename(sources[1].with_name("renamed.py"))
+        (project.root / "src" / "fresh").mkdir()
+        (project.root / "src" / "fresh" / "new.py").write_text("def fresh():\n    return 'a new file'\n")
+        shutil.rmtree(project.root / "docs")
+        changed = collect(watcher)
+    finally:
+        watcher.close()
+
+    texts = stub.stats()["texts"]
+    conn = bf.init_database(project.db_path, project.config["embedding"]["dimensions"])
+    try:
+        assert bf.update_paths(conn, sorted(changed), project.config, verbose=False) == []
+    finally:
+        conn.close()
+    # Only the edited and new chunks were embedded
+    assert 0 < stub.stats()["texts"] - texts <= 3
+    watched = project.query("SELECT file_path, start_line, content FROM documents ORDER BY 1, 2")
+
+    # A full run finds nothing the watcher missed
+    assert project.index()
+    assert project.query("SELECT file_path, start_line, content FROM documents ORDER BY 1, 2") == watched
+    assert not any(path.startswith("docs/") for path, _, _ in watched)
+    assert any(path == "src/fresh/new.py" for path, _, _ in watched)